@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""Benchmark for CompressedField at several thresholds.
+
+Documents holding a large JSON-like dictionary and a text body, of sizes
+spread between ``--min-size`` and ``--max-size`` bytes, are saved and loaded
+with plain fields and with compressed fields at each threshold. For each run
+the storage used by the collection, the bytes of BSON sent over the wire to
+save or load every document once, and the CPU time per document spent
+saving, loading without touching the compressed fields, and loading and
+reading them are reported.
+
+A MongoDB server must be running on localhost::
+
+    python benchmarks/compression.py --documents 2000 --thresholds 256,4096
+"""
+import sys
+import os
+import time
+import random
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mongoengine import *
+
+try:
+    import bson
+except ImportError:
+    from pymongo import bson
+
+
+DB_NAME = 'mongoengine_benchmark'
+
+WORDS = ('request response user session error warning timeout payload '
+         'status created updated deleted enabled disabled region account '
+         'value count total average latency host service version').split()
+
+
+class PlainPayload(Document):
+    name = StringField()
+    attributes = DictField()
+    body = StringField()
+
+
+class CompressedPayload(Document):
+    name = StringField()
+    attributes = CompressedField(DictField())
+    body = CompressedField(StringField())
+
+
+def random_text(size):
+    words = []
+    while size > 0:
+        word = random.choice(WORDS)
+        words.append(word)
+        size -= len(word) + 1
+    return u' '.join(words)
+
+
+def random_attributes(size):
+    attributes = {}
+    while size > 0:
+        key = '%s_%d' % (random.choice(WORDS), len(attributes))
+        value = random.choice([random.randint(0, 100000), random_text(30),
+                               [random.random() for i in range(3)]])
+        attributes[key] = value
+        size -= len(key) + 30
+    return attributes
+
+
+def generate(count, min_size, max_size):
+    random.seed(0)
+    payloads = []
+    for i in xrange(count):
+        size = random.randint(min_size, max_size)
+        payloads.append(('payload %d' % i, random_attributes(size / 2),
+                         random_text(size / 2)))
+    return payloads
+
+
+def storage_size(document):
+    """Return the size of the collection on disk, or the total size of its
+    documents if the server doesn't report it.
+    """
+    collection = document.objects._collection
+    try:
+        return collection.database.command('collstats',
+                                           collection.name)['storageSize']
+    except Exception:
+        return sum(len(bson.BSON.encode(son)) for son in collection.find())
+
+
+def run(document, payloads):
+    document.drop_collection()
+    results = {}
+
+    started = time.clock()
+    for name, attributes, body in payloads:
+        document(name=name, attributes=attributes, body=body).save()
+    results['save'] = time.clock() - started
+    results['storage'] = storage_size(document)
+
+    # Each document is sent as it is stored when saved and loaded
+    collection = document.objects._collection
+    results['wire'] = sum(len(bson.BSON.encode(son))
+                          for son in collection.find())
+
+    started = time.clock()
+    for doc in document.objects:
+        doc.name
+    results['load'] = time.clock() - started
+
+    started = time.clock()
+    for doc in document.objects:
+        doc.attributes, doc.body
+    results['read'] = time.clock() - started
+
+    document.drop_collection()
+    return results
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--documents', type='int', default=2000,
+                      help='number of documents to save and load')
+    parser.add_option('--min-size', type='int', default=200,
+                      help='smallest size in bytes of each payload')
+    parser.add_option('--max-size', type='int', default=20000,
+                      help='largest size in bytes of each payload')
+    parser.add_option('-t', '--thresholds', default='0,512,2048,8192',
+                      help='comma-separated compression thresholds to try')
+    parser.add_option('-c', '--codec', default='zlib',
+                      help='compression codec, zlib or lz4')
+    parser.add_option('-l', '--level', type='int', default=6,
+                      help='zlib compression level')
+    parser.add_option('--host', default='localhost')
+    parser.add_option('--port', type='int', default=27017)
+    options, args = parser.parse_args()
+
+    connect(DB_NAME, host=options.host, port=options.port)
+    payloads = generate(options.documents, options.min_size,
+                        options.max_size)
+
+    runs = [('plain', PlainPayload, None)]
+    for threshold in options.thresholds.split(','):
+        runs.append(('>= %s' % threshold, CompressedPayload, int(threshold)))
+
+    print '%-10s %12s %12s %10s %10s %10s' % (
+        'threshold', 'storage KB', 'wire KB', 'save us', 'load us',
+        'read us')
+    for label, document, threshold in runs:
+        if threshold is not None:
+            for field_name in ('attributes', 'body'):
+                field = document._fields[field_name]
+                field.threshold = threshold
+                field.codec = options.codec
+                field.level = options.level
+        results = run(document, payloads)
+        per_doc = 1000000.0 / options.documents
+        print '%-10s %12d %12d %10.1f %10.1f %10.1f' % (
+            label, results['storage'] / 1024, results['wire'] / 1024,
+            results['save'] * per_doc, results['load'] * per_doc,
+            results['read'] * per_doc)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+"""Micro-benchmarks for the hot paths of the ODM: converting documents to and
+from SON, validation, query and update compilation, index specs, document
+class creation and dereferencing.
+
+Each benchmark runs against synthetic schemas of several widths (number of
+fields) and depths (levels of embedded documents). The database is kept in
+memory (see :mod:`mongoengine.memory`), so no MongoDB server is needed and
+the timings don't depend on the network.
+
+Run the suite from the root of the repository, saving the results as the
+baseline that later runs are compared against::
+
+    python -m benchmarks.hotpaths --save
+
+Later runs report how each benchmark changed relative to the baseline, and
+exit with a non-zero status if any got slower by more than the threshold::
+
+    python -m benchmarks.hotpaths --threshold 0.15
+
+Timings depend on the machine, so baselines should be saved and compared on
+the same machine.
+"""
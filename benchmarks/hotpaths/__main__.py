@@ -0,0 +1,12 @@
+import sys
+import os
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', '..'))
+sys.path.insert(0, HERE)
+
+from runner import main
+from suite import BENCHMARKS
+
+
+main(BENCHMARKS, os.path.join(HERE, 'baseline.json'))
@@ -0,0 +1,116 @@
+"""Times benchmarks, and stores and compares JSON baselines.
+"""
+import sys
+import time
+import json
+import platform
+from optparse import OptionParser
+
+
+class Benchmark(object):
+    """A named benchmark. ``setup`` is called once, and returns the
+    function whose calls are timed.
+    """
+
+    def __init__(self, name, setup):
+        self.name = name
+        self.setup = setup
+
+    def run(self, repeat=5, min_time=0.1):
+        """Return the shortest time (in seconds) a call took, averaged over
+        enough calls to take ``min_time`` seconds, in ``repeat`` rounds.
+        """
+        func = self.setup()
+        number = 1
+        while True:
+            elapsed = self._time(func, number)
+            if elapsed >= min_time:
+                break
+            number *= 2
+        timings = [elapsed] + [self._time(func, number)
+                               for i in range(repeat - 1)]
+        return min(timings) / number
+
+    def _time(self, func, number):
+        started = time.time()
+        for i in xrange(number):
+            func()
+        return time.time() - started
+
+
+def load_baseline(path):
+    """Load the results stored in a baseline file, or ``None`` if there is
+    no baseline.
+    """
+    try:
+        with open(path) as baseline:
+            return json.load(baseline)['results']
+    except IOError:
+        return None
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as baseline:
+        json.dump({'python': platform.python_version(),
+                   'machine': platform.machine(),
+                   'saved': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'results': results},
+                  baseline, indent=2, sort_keys=True)
+
+
+def compare(results, baseline, threshold):
+    """Compare results with a baseline, returning a list of
+    ``(name, baseline, result, change, regressed)`` tuples, where ``change``
+    is the relative change in time (positive when slower).
+    """
+    comparison = []
+    for name in sorted(results):
+        if name not in baseline:
+            comparison.append((name, None, results[name], None, False))
+            continue
+        change = results[name] / baseline[name] - 1
+        comparison.append((name, baseline[name], results[name], change,
+                           change > threshold))
+    return comparison
+
+
+def main(benchmarks, default_baseline):
+    parser = OptionParser()
+    parser.add_option('-b', '--baseline', default=default_baseline,
+                      help='the JSON file holding the baseline results')
+    parser.add_option('-s', '--save', action='store_true', default=False,
+                      help='save the results as the new baseline')
+    parser.add_option('-t', '--threshold', type='float', default=0.1,
+                      help='the relative slowdown reported as a regression')
+    parser.add_option('-k', '--filter', default='',
+                      help='only run benchmarks whose name contains this')
+    parser.add_option('-r', '--repeat', type='int', default=5,
+                      help='the number of rounds each benchmark is timed')
+    options, args = parser.parse_args()
+
+    baseline = load_baseline(options.baseline) or {}
+    results = {}
+    print '%-44s %12s %12s %9s' % ('benchmark', 'baseline us', 'us', 'change')
+    for benchmark in benchmarks:
+        if options.filter not in benchmark.name:
+            continue
+        results[benchmark.name] = benchmark.run(options.repeat)
+        name, base, result, change, regressed = compare(
+            {benchmark.name: results[benchmark.name]}, baseline,
+            options.threshold)[0]
+        if base is None:
+            print '%-44s %12s %12.2f %9s' % (name, '-', result * 1e6, '-')
+        else:
+            print '%-44s %12.2f %12.2f %+8.1f%%%s' % (
+                name, base * 1e6, result * 1e6, change * 100,
+                regressed and ' REGRESSED' or '')
+
+    regressions = [row for row in compare(results, baseline,
+                                          options.threshold) if row[4]]
+    if options.save:
+        save_baseline(options.baseline, dict(baseline, **results))
+        print 'Saved baseline to %s' % options.baseline
+    elif regressions:
+        print '%d benchmark(s) slower than the baseline by more than %d%%' % (
+            len(regressions), options.threshold * 100)
+        sys.exit(1)
@@ -0,0 +1,67 @@
+"""Synthetic document schemas of varying width and nesting.
+"""
+import datetime
+import itertools
+
+from mongoengine import *
+
+
+# The field types used, in turn, for the fields of synthetic documents, with
+# a function giving a sample value for the field's position
+FIELD_TYPES = [
+    (StringField, lambda i: u'value %d' % i),
+    (IntField, lambda i: i),
+    (FloatField, lambda i: i + 0.5),
+    (BooleanField, lambda i: bool(i % 2)),
+    (DateTimeField, lambda i: datetime.datetime(2010, 1, 1 + i % 28)),
+    (lambda: ListField(StringField()), lambda i: [u'a', u'b', u'c']),
+    (DictField, lambda i: {'key': i}),
+]
+
+_counter = itertools.count()
+
+
+def make_document(width, depth, base=Document):
+    """Create a document class with ``width`` fields named ``f0``, ``f1``
+    and so on, cycling through the types in ``FIELD_TYPES``. Given a
+    ``depth``, the class also has an ``e`` field holding an embedded
+    document of the same shape, nested ``depth`` levels deep.
+    """
+    attrs = {}
+    for i in range(width):
+        field_type = FIELD_TYPES[i % len(FIELD_TYPES)][0]
+        attrs['f%d' % i] = field_type()
+    if depth:
+        embedded = make_document(width, depth - 1, EmbeddedDocument)
+        attrs['e'] = EmbeddedDocumentField(embedded)
+    name = 'Synthetic%d' % _counter.next()
+    return type(name, (base,), attrs)
+
+
+def make_instance(doc_cls):
+    """Create an instance of a synthetic document class with every field
+    set.
+    """
+    values = {}
+    for name, field in doc_cls._fields.items():
+        if name == 'e':
+            values[name] = make_instance(field.document_type)
+        elif name.startswith('f'):
+            i = int(name[1:])
+            values[name] = FIELD_TYPES[i % len(FIELD_TYPES)][1](i)
+    return doc_cls(**values)
+
+
+def field_paths(doc_cls, prefix=''):
+    """Generate the ``__``-separated paths to every non-container field of a
+    synthetic document class, including those in embedded documents, along
+    with sample values.
+    """
+    for name, field in sorted(doc_cls._fields.items()):
+        if name == 'e':
+            for path in field_paths(field.document_type, prefix + 'e__'):
+                yield path
+        elif name.startswith('f'):
+            i = int(name[1:])
+            if i % len(FIELD_TYPES) < 5:
+                yield prefix + name, FIELD_TYPES[i % len(FIELD_TYPES)][1](i)
@@ -0,0 +1,103 @@
+"""The hot path benchmarks.
+"""
+from mongoengine import *
+from mongoengine.queryset import QuerySet
+
+from runner import Benchmark
+from schemas import make_document, make_instance, field_paths
+
+
+DB_NAME = 'mongoengine_benchmark'
+
+# The (width, depth) of the synthetic schemas each benchmark is run against
+SCHEMAS = [(5, 0), (20, 0), (50, 0), (10, 2)]
+
+# The number of references dereferenced by the dereferencing benchmark
+REFERENCES = 50
+
+
+def schema_benchmarks(width, depth):
+    label = 'w%d_d%d' % (width, depth)
+
+    def instance():
+        return make_instance(make_document(width, depth))
+
+    def to_mongo():
+        return instance().to_mongo
+
+    def validate():
+        return instance().validate
+
+    def from_son():
+        doc = instance()
+        son = doc.to_mongo()
+        return lambda: doc.__class__._from_son(son)
+
+    def transform_query():
+        doc_cls = make_document(width, depth)
+        query = {}
+        for i, (path, value) in enumerate(field_paths(doc_cls)):
+            query[path + ['', '__gt', '__in', '__ne'][i % 4]] = (
+                i % 4 == 2 and [value] or value)
+        return lambda: QuerySet._transform_query(doc_cls, **query)
+
+    def transform_update():
+        doc_cls = make_document(width, depth)
+        update = {}
+        for i, (path, value) in enumerate(field_paths(doc_cls)):
+            update[['set__', 'unset__'][i % 2] + path] = value
+        return lambda: QuerySet._transform_update(doc_cls, **update)
+
+    def class_creation():
+        return lambda: make_document(width, depth)
+
+    return [
+        Benchmark('to_mongo_' + label, to_mongo),
+        Benchmark('validate_' + label, validate),
+        Benchmark('from_son_' + label, from_son),
+        Benchmark('transform_query_' + label, transform_query),
+        Benchmark('transform_update_' + label, transform_update),
+        Benchmark('class_creation_' + label, class_creation),
+    ]
+
+
+def q_to_query():
+    doc_cls = make_document(10, 1)
+    q = ((Q(f0='a', f1__gt=1) | Q(f2__lt=2.5, e__f0='b')) &
+         (Q(f3=True) | Q(f1__in=[1, 2, 3])) & Q(e__f1__ne=4))
+    return lambda: q.to_query(doc_cls)
+
+
+def build_index_spec():
+    doc_cls = make_document(10, 1)
+    spec = ['f0', '-f1', '+e.f2']
+    return lambda: QuerySet._build_index_spec(doc_cls, spec)
+
+
+def dereference():
+    class Target(Document):
+        name = StringField()
+
+    class Holder(Document):
+        targets = ListField(ReferenceField(Target))
+
+    connect(DB_NAME, backend='memory')
+    Target.drop_collection()
+    Holder.drop_collection()
+    targets = [Target(name=str(i)) for i in range(REFERENCES)]
+    for target in targets:
+        target.save()
+    holder = Holder(targets=targets)
+    holder.save()
+    son = Holder.objects._collection.find_one()
+    return lambda: Holder._from_son(son).targets
+
+
+BENCHMARKS = []
+for width, depth in SCHEMAS:
+    BENCHMARKS.extend(schema_benchmarks(width, depth))
+BENCHMARKS.extend([
+    Benchmark('q_to_query', q_to_query),
+    Benchmark('build_index_spec', build_index_spec),
+    Benchmark('dereference_list_%d' % REFERENCES, dereference),
+])
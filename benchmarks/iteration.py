@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""Benchmark for iterating over large result sets.
+
+Compares iterating over a :class:`~mongoengine.queryset.QuerySet` directly,
+loading it into a list and iterating with
+:meth:`~mongoengine.queryset.QuerySet.iterator` using several chunk sizes.
+Throughput (documents per second) and the peak resident set size of the
+process are reported for each. Every mode runs in a fresh process so that the
+peak RSS figures don't influence each other.
+
+A MongoDB server must be running on localhost::
+
+    python benchmarks/iteration.py --documents 200000
+"""
+import sys
+import os
+import time
+import resource
+import multiprocessing
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mongoengine import *
+
+
+DB_NAME = 'mongoengine_benchmark'
+
+
+class Record(Document):
+    name = StringField()
+    value = IntField()
+    payload = StringField()
+
+
+def populate(count, payload_size):
+    Record.drop_collection()
+    payload = 'x' * payload_size
+    collection = Record.objects._collection
+    batch = []
+    for i in xrange(count):
+        batch.append(Record(name='record %d' % i, value=i,
+                            payload=payload).to_mongo())
+        if len(batch) == 1000:
+            collection.insert(batch)
+            batch = []
+    if batch:
+        collection.insert(batch)
+
+
+def peak_rss():
+    """Peak resident set size of this process, in megabytes.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Reported in bytes rather than kilobytes on OS X
+        usage /= 1024
+    return usage / 1024.0
+
+
+def run_mode(mode, chunk_size, results):
+    connect(DB_NAME)
+    baseline = peak_rss()
+    started = time.time()
+    total = 0
+    if mode == 'iterate':
+        for record in Record.objects:
+            total += 1
+    elif mode == 'list':
+        total = len(list(Record.objects))
+    elif mode == 'batch_size':
+        for record in Record.objects.batch_size(chunk_size):
+            total += 1
+    elif mode == 'iterator':
+        for chunk in Record.objects.iterator(chunk_size):
+            total += len(chunk)
+    elapsed = time.time() - started
+    results.put((total, elapsed, peak_rss() - baseline))
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--documents', type='int', default=100000,
+                      help='number of documents to iterate over')
+    parser.add_option('-p', '--payload', type='int', default=1024,
+                      help='size in bytes of each document\'s payload')
+    parser.add_option('-c', '--chunk-sizes', default='100,1000,5000',
+                      help='comma-separated chunk sizes for iterator()')
+    options, args = parser.parse_args()
+
+    connect(DB_NAME)
+    print 'Inserting %d documents...' % options.documents
+    populate(options.documents, options.payload)
+
+    chunk_sizes = [int(size) for size in options.chunk_sizes.split(',')]
+    modes = [('iterate', None), ('list', None)]
+    modes += [('batch_size', size) for size in chunk_sizes]
+    modes += [('iterator', size) for size in chunk_sizes]
+
+    print '%-20s %12s %12s %14s' % ('mode', 'documents', 'docs/sec',
+                                   'peak RSS (MB)')
+    for mode, chunk_size in modes:
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_mode,
+                                          args=(mode, chunk_size, results))
+        process.start()
+        total, elapsed, rss = results.get()
+        process.join()
+
+        label = mode
+        if chunk_size:
+            label = '%s(%d)' % (mode, chunk_size)
+        print '%-20s %12d %12.0f %14.1f' % (label, total, total / elapsed, rss)
+
+    Record.drop_collection()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""Benchmark for background prefetching of cursor batches.
+
+Iterates over a collection while doing a fixed amount of work per document,
+first normally and then with :meth:`~mongoengine.queryset.QuerySet.prefetch`
+at several depths, and reports the end-to-end time of each run.
+
+To make the cost of each getMore visible on a single machine, the benchmark
+talks to MongoDB through a local proxy that delays every reply from the server
+by a configurable latency, standing in for a remote server.
+
+A MongoDB server must be running on localhost::
+
+    python benchmarks/prefetch.py --latency 20 --work 50
+"""
+import sys
+import os
+import time
+import socket
+import struct
+import threading
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mongoengine import *
+
+
+DB_NAME = 'mongoengine_benchmark'
+
+
+class Record(Document):
+    name = StringField()
+    value = IntField()
+    payload = StringField()
+
+
+class LatencyProxy(object):
+    """A TCP proxy that forwards MongoDB wire protocol messages, delaying
+    each message sent back by the server by ``latency`` seconds.
+    """
+
+    def __init__(self, upstream, latency, port=0):
+        self.upstream = upstream
+        self.latency = latency
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', port))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+
+    def start(self):
+        self._spawn(self._accept)
+
+    def _spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.setDaemon(True)
+        thread.start()
+
+    def _accept(self):
+        while True:
+            client, address = self.listener.accept()
+            server = socket.create_connection(self.upstream)
+            self._spawn(self._pump, client, server, 0)
+            self._spawn(self._pump, server, client, self.latency)
+
+    def _read(self, sock, size):
+        data = ''
+        while len(data) < size:
+            received = sock.recv(size - len(data))
+            if not received:
+                raise socket.error('connection closed')
+            data += received
+        return data
+
+    def _pump(self, source, destination, latency):
+        try:
+            while True:
+                header = self._read(source, 4)
+                length = struct.unpack('<i', header)[0]
+                message = header + self._read(source, length - 4)
+                if latency:
+                    time.sleep(latency)
+                destination.sendall(message)
+        except socket.error:
+            source.close()
+            destination.close()
+
+
+def populate(count, payload_size):
+    Record.drop_collection()
+    payload = 'x' * payload_size
+    collection = Record.objects._collection
+    batch = []
+    for i in xrange(count):
+        batch.append(Record(name='record %d' % i, value=i,
+                            payload=payload).to_mongo())
+        if len(batch) == 1000:
+            collection.insert(batch)
+            batch = []
+    if batch:
+        collection.insert(batch)
+
+
+def work(microseconds):
+    """Busy-wait to simulate application work on a document.
+    """
+    until = time.time() + microseconds / 1000000.0
+    while time.time() < until:
+        pass
+
+
+def run(depth, batch_size, work_us):
+    queryset = Record.objects.batch_size(batch_size)
+    if depth:
+        queryset = queryset.prefetch(depth)
+    started = time.time()
+    total = 0
+    for record in queryset:
+        work(work_us)
+        total += 1
+    return total, time.time() - started
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--documents', type='int', default=20000,
+                      help='number of documents to iterate over')
+    parser.add_option('-p', '--payload', type='int', default=512,
+                      help='size in bytes of each document\'s payload')
+    parser.add_option('-b', '--batch-size', type='int', default=500,
+                      help='number of documents per batch')
+    parser.add_option('-l', '--latency', type='float', default=20,
+                      help='simulated server latency in milliseconds')
+    parser.add_option('-w', '--work', type='int', default=50,
+                      help='simulated work per document in microseconds')
+    parser.add_option('-d', '--depths', default='1,2,4',
+                      help='comma-separated prefetch depths to try')
+    parser.add_option('--host', default='localhost')
+    parser.add_option('--port', type='int', default=27017)
+    options, args = parser.parse_args()
+
+    connect(DB_NAME, host=options.host, port=options.port)
+    print 'Inserting %d documents...' % options.documents
+    populate(options.documents, options.payload)
+
+    proxy = LatencyProxy((options.host, options.port),
+                         options.latency / 1000.0)
+    proxy.start()
+    connect(DB_NAME, host='127.0.0.1', port=proxy.port)
+
+    depths = [0] + [int(depth) for depth in options.depths.split(',')]
+    print '%-12s %12s %12s %12s' % ('prefetch', 'documents', 'seconds',
+                                   'docs/sec')
+    for depth in depths:
+        total, elapsed = run(depth, options.batch_size, options.work)
+        label = depth and 'depth %d' % depth or 'off'
+        print '%-12s %12d %12.2f %12.0f' % (label, total, elapsed,
+                                            total / elapsed)
+
+    connect(DB_NAME, host=options.host, port=options.port)
+    Record.drop_collection()
+
+
+if __name__ == '__main__':
+    main()
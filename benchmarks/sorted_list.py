@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""Benchmark for append-heavy workloads on a SortedListField.
+
+A leaderboard document holding a sorted list of scores is loaded, then scores
+are appended and the document saved, over and over. This is done with
+incremental maintenance (items are inserted in order and saved with an
+ordered ``$push``), and with the list reassigned before every save, which
+sorts the list and rewrites it as a whole as every save used to. The time per
+append and save, and the number of bytes of BSON sent per save, are reported.
+
+A MongoDB server must be running on localhost::
+
+    python benchmarks/sorted_list.py --items 5000 --appends 500
+"""
+import sys
+import os
+import time
+import random
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mongoengine import *
+
+try:
+    import bson
+except ImportError:
+    from pymongo import bson
+
+
+DB_NAME = 'mongoengine_benchmark'
+
+
+class Score(EmbeddedDocument):
+    player = StringField()
+    points = IntField()
+
+
+class Leaderboard(Document):
+    name = StringField()
+    scores = SortedListField(EmbeddedDocumentField(Score), ordering='points')
+
+
+def random_score():
+    points = random.randint(0, 1000000)
+    return Score(player='player %d' % points, points=points)
+
+
+def populate(items):
+    Leaderboard.drop_collection()
+    Leaderboard(name='Leaderboard',
+                scores=[random_score() for i in xrange(items)]).save()
+
+
+def run(appends, per_save, rewrite):
+    board = Leaderboard.objects.get()
+    sent = 0
+    started = time.time()
+    for i in xrange(appends / per_save):
+        for j in xrange(per_save):
+            board.scores.append(random_score())
+        if rewrite:
+            # Reassigning the list means that it's sorted and saved whole
+            board.scores = list(board.scores)
+        update = board._build_update(board.to_mongo())
+        sent += len(bson.BSON.encode(update))
+        board.save()
+    elapsed = time.time() - started
+    return elapsed, sent
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-i', '--items', type='int', default=5000,
+                      help='number of scores initially on the leaderboard')
+    parser.add_option('-a', '--appends', type='int', default=500,
+                      help='number of scores to append')
+    parser.add_option('-s', '--per-save', type='int', default=1,
+                      help='number of scores appended between saves')
+    parser.add_option('--host', default='localhost')
+    parser.add_option('--port', type='int', default=27017)
+    options, args = parser.parse_args()
+
+    connect(DB_NAME, host=options.host, port=options.port)
+
+    print '%-12s %14s %14s' % ('mode', 'ms/append', 'bytes/save')
+    saves = options.appends / options.per_save
+    for label, rewrite in (('rewrite', True), ('incremental', False)):
+        populate(options.items)
+        elapsed, sent = run(options.appends, options.per_save, rewrite)
+        print '%-12s %14.3f %14d' % (label, elapsed * 1000 / options.appends,
+                                     sent / saves)
+
+    board = Leaderboard.objects.get()
+    points = [score.points for score in board.scores]
+    assert points == sorted(points), 'Leaderboard is out of order'
+    Leaderboard.drop_collection()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""Benchmark for :class:`~mongoengine.workqueue.JobQueue` throughput.
+
+Enqueues a number of jobs, then drains the queue with many competing workers
+(processes or threads) claiming jobs in batches, and reports the number of
+jobs completed per second for each batch size. Every job is checked to have
+been completed exactly once.
+
+A MongoDB server must be running on localhost, unless the in-memory backend
+is used, which needs the workers to be threads::
+
+    python benchmarks/workqueue.py --jobs 20000 --workers 16 --batch 1,10,50
+    python benchmarks/workqueue.py --backend memory --threads
+"""
+import sys
+import os
+import time
+import threading
+import multiprocessing
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mongoengine import *
+from mongoengine.workqueue import QueuedJob, JobQueue
+
+
+DB_NAME = 'mongoengine_benchmark'
+
+
+def worker(options, batch, done):
+    """Claim and acknowledge jobs until the queue is empty, reporting the
+    number of each completed job.
+    """
+    connect(DB_NAME, host=options.host, port=options.port,
+            backend=options.backend)
+    queue = JobQueue('benchmark', min_wait=0.01, max_wait=0.1)
+    completed = []
+    while True:
+        jobs = queue.get(batch, timeout=0.5)
+        if not jobs:
+            break
+        completed.extend(job.payload['n'] for job in jobs)
+        queue.ack(jobs)
+    done.put(completed)
+
+
+def run(options, batch):
+    QueuedJob.drop_collection()
+    queue = JobQueue('benchmark')
+    for start in xrange(0, options.jobs, 1000):
+        end = min(start + 1000, options.jobs)
+        queue.enqueue([{'n': n} for n in xrange(start, end)])
+
+    done = multiprocessing.Queue()
+    spawn = options.threads and threading.Thread or multiprocessing.Process
+    workers = [spawn(target=worker, args=(options, batch, done))
+               for i in range(options.workers)]
+    started = time.time()
+    for process in workers:
+        process.start()
+    completed = []
+    for process in workers:
+        completed.extend(done.get())
+    elapsed = time.time() - started
+    for process in workers:
+        process.join()
+
+    assert len(completed) == options.jobs, 'Jobs were completed twice'
+    assert len(set(completed)) == options.jobs, 'Jobs were lost'
+    return elapsed
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-j', '--jobs', type='int', default=10000,
+                      help='number of jobs to enqueue')
+    parser.add_option('-w', '--workers', type='int', default=8,
+                      help='number of competing workers')
+    parser.add_option('-b', '--batch', default='1,10,50',
+                      help='comma-separated numbers of jobs claimed at once')
+    parser.add_option('-t', '--threads', action='store_true', default=False,
+                      help='run workers as threads rather than processes')
+    parser.add_option('--host', default='localhost')
+    parser.add_option('--port', type='int', default=27017)
+    parser.add_option('--backend', default='mongodb',
+                      help='mongodb, or memory (with --threads)')
+    options, args = parser.parse_args()
+    if options.backend == 'memory' and not options.threads:
+        parser.error('the memory backend is only shared by threads')
+
+    connect(DB_NAME, host=options.host, port=options.port,
+            backend=options.backend)
+
+    print '%-8s %10s %12s' % ('batch', 'seconds', 'jobs/sec')
+    for batch in [int(size) for size in options.batch.split(',')]:
+        elapsed = run(options, batch)
+        print '%-8d %10.2f %12.1f' % (batch, elapsed, options.jobs / elapsed)
+    QueuedJob.drop_collection()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,482 @@
+"""Recommends indexes for the queries an application makes.
+
+Record the shapes of the queries made while running tests or on a staging
+server with a :class:`~mongoengine.advisor.ShapeRecorder`, then compare them
+with the indexes each :class:`~mongoengine.Document` defines::
+
+    from mongoengine import monitoring, advisor
+
+    recorder = advisor.ShapeRecorder()
+    monitoring.register(recorder)
+    ...
+    recorder.save('shapes.json')
+
+    print advisor.advise(advisor.load_shapes('shapes.json')).format()
+
+or from the command line, importing the modules that define the documents::
+
+    python -m mongoengine.advisor -m myapp.models shapes.json
+
+.. versionadded:: 0.5
+"""
+# Imported absolutely, as this module may be run with ``python -m``
+from mongoengine.base import _document_registry
+from mongoengine.document import Document
+from mongoengine.fields import ListField
+from mongoengine.monitoring import QueryListener
+from mongoengine.queryset import QuerySet
+
+import re
+import threading
+from optparse import OptionParser
+from collections import OrderedDict
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+__all__ = ['QueryShape', 'ShapeRecorder', 'IndexReport', 'advise',
+           'load_shapes']
+
+
+# The operations whose queries are recorded
+_RECORDED = ('find', 'count', 'distinct', 'update', 'remove',
+             'findandmodify')
+
+# Operators answered by the geospatial indexes created for GeoPointFields
+_GEO_OPERATORS = ('$near', '$nearSphere', '$within')
+
+_pattern_type = type(re.compile(''))
+
+# The index MongoDB creates on every collection
+_ID_INDEX = [('_id', 1)]
+
+# The keys queries use to match the classes of documents
+_TYPE_KEYS = ('_types', '_cls')
+
+
+def _parse_filter(query, filter, clause=None):
+    """Add the fields of a query to ``filter``, a dict of sets of the
+    operators used on each field. Fields within an ``$or`` or ``$nor`` are
+    recorded as using that operator.
+    """
+    for key, value in query.items():
+        if key == '$and':
+            for item in value:
+                _parse_filter(item, filter, clause)
+            continue
+        if key in ('$or', '$nor'):
+            for item in value:
+                _parse_filter(item, filter, key)
+            continue
+        if key.startswith('$'):
+            # e.g. $where, which can't use an index
+            continue
+        if clause is not None:
+            operators = [clause]
+        elif isinstance(value, dict) and value and all(
+                op.startswith('$') for op in value):
+            operators = value.keys()
+        elif isinstance(value, _pattern_type):
+            operators = ['$regex']
+        else:
+            operators = ['$eq']
+        filter.setdefault(key, set()).update(operators)
+
+
+class QueryShape(object):
+    """The shape of a query: the collection queried, the operators used on
+    each field, the sort and the projection, along with the number of times
+    a query of that shape was made.
+
+    :param collection: the name of the collection queried
+    :param filter: a dict of the lists of operators used on each field, with
+        ``'$eq'`` standing for an equality match
+    :param sort: a list of ``(field, direction)`` pairs
+    :param projection: a dict of the fields included (``1``) and excluded
+        (``0``) from the results
+    :param count: the number of times the query was made
+    """
+
+    def __init__(self, collection, filter, sort=None, projection=None,
+                 count=1):
+        self.collection = collection
+        self.filter = dict((field, sorted(ops))
+                           for field, ops in filter.items())
+        self.sort = [(key, direction) for key, direction in sort or []]
+        self.projection = projection or {}
+        self.count = count
+
+    @classmethod
+    def from_query(cls, collection, query, sort=None, projection=None):
+        """Return the shape of a query in MongoDB's format.
+        """
+        if query is None:
+            query = {}
+        elif not isinstance(query, dict):
+            query = {'_id': query}
+        filter = {}
+        _parse_filter(query, filter)
+        if isinstance(projection, (list, tuple)):
+            projection = dict((field, 1) for field in projection)
+        return cls(collection, filter, sort, projection)
+
+    @property
+    def key(self):
+        return (self.collection,
+                tuple((field, tuple(ops))
+                      for field, ops in sorted(self.filter.items())),
+                tuple(self.sort), tuple(sorted(self.projection.items())))
+
+    @property
+    def equality_fields(self):
+        # Classes are matched with $in when only _cls is stored, which uses
+        # an index like an equality match on the few class names
+        return set(field for field, ops in self.filter.items()
+                   if ops == ['$eq'] or
+                   (field in _TYPE_KEYS and ops == ['$in']))
+
+    @property
+    def range_fields(self):
+        equality = self.equality_fields
+        return set(field for field, ops in self.filter.items()
+                   if field not in equality and
+                   not set(ops).intersection(_GEO_OPERATORS))
+
+    def to_dict(self):
+        return {'collection': self.collection, 'filter': self.filter,
+                'sort': self.sort, 'projection': self.projection,
+                'count': self.count}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['collection'], data['filter'], data.get('sort'),
+                   data.get('projection'), data.get('count', 1))
+
+    def __repr__(self):
+        description = '%s %r' % (self.collection, self.filter)
+        if self.sort:
+            description += ' sort %r' % (self.sort,)
+        return '<QueryShape %s>' % description
+
+
+class ShapeRecorder(QueryListener):
+    """A listener that records the shapes of the queries, counts, updates
+    and removes made, counting how many times each shape was seen. Shapes
+    are kept in the order they were first seen.
+    """
+
+    def __init__(self):
+        self._shapes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def finished(self, event):
+        if event.operation not in _RECORDED:
+            return
+        shape = QueryShape.from_query(event.collection, event.query,
+                                      event.sort, event.projection)
+        key = shape.key
+        with self._lock:
+            if key in self._shapes:
+                self._shapes[key].count += 1
+            else:
+                self._shapes[key] = shape
+
+    @property
+    def shapes(self):
+        with self._lock:
+            return self._shapes.values()
+
+    def save(self, path):
+        """Save the recorded shapes to a file, as one JSON object per line.
+        """
+        with open(path, 'w') as output:
+            for shape in self.shapes:
+                output.write(json.dumps(shape.to_dict()) + '\n')
+
+
+def load_shapes(path):
+    """Load the shapes saved by :meth:`ShapeRecorder.save`.
+    """
+    with open(path) as input:
+        return [QueryShape.from_dict(json.loads(line))
+                for line in input if line.strip()]
+
+
+def _index_use(index, shape):
+    """Return the number of leading keys of ``index`` that a query of
+    ``shape`` can use: equality matches, then the sort, then a range.
+    Also return whether the index gives the sort order.
+    """
+    keys = [key for key, direction in index]
+    equality = shape.equality_fields
+    used = 0
+    while used < len(keys) and keys[used] in equality:
+        used += 1
+
+    sort = [(key, direction) for key, direction in shape.sort
+            if key not in equality]
+    sorted_by_index = not sort
+    if sort:
+        segment = index[used:used + len(sort)]
+        if [key for key, direction in segment] == [key for key, d in sort]:
+            same = [d == direction for (k, d), (key, direction)
+                    in zip(segment, sort)]
+            # An index may be walked backwards to give the reverse order
+            if all(same) or not any(same):
+                sorted_by_index = True
+                used += len(sort)
+
+    if used < len(keys) and keys[used] in shape.range_fields:
+        used += 1
+    return used, sorted_by_index
+
+
+def _recommend(shape):
+    """Return the index that best suits a query of ``shape``: its equality
+    matches, then its sort, then its ranges.
+    """
+    equality = shape.equality_fields
+    index = [(key, 1) for key in _TYPE_KEYS if key in equality]
+    index += [(field, 1) for field in sorted(equality)
+              if field not in _TYPE_KEYS]
+    index += [(key, direction) for key, direction in shape.sort
+              if key not in equality]
+    index += [(field, 1) for field in sorted(shape.range_fields)
+              if field not in dict(index)]
+    return index
+
+
+def _is_prefix(index, other):
+    return len(index) < len(other) and other[:len(index)] == index
+
+
+def _attribute_path(document, db_path):
+    """Translate the database name of a (possibly nested) field into the
+    name used in index specifications.
+    """
+    names = []
+    fields = document._fields
+    for part in db_path.split('.'):
+        match = [(name, field) for name, field in (fields or {}).items()
+                 if field.db_field == part]
+        if not match:
+            names.append(part)
+            fields = None
+            continue
+        name, field = match[0]
+        names.append(name)
+        while isinstance(field, ListField):
+            field = field.field
+        document_type = getattr(field, 'document_type', None)
+        fields = getattr(document_type, '_fields', None)
+    return '.'.join(names)
+
+
+class IndexReport(object):
+    """The result of comparing recorded query shapes with the indexes of
+    the documents they query, returned by :func:`~mongoengine.advisor.advise`.
+
+    :attr:`unindexed` lists ``(shape, problem, index)`` tuples for the
+    shapes that no index serves, where ``problem`` is ``'no usable index'``
+    or ``'sorted in memory'`` and ``index`` is the recommended index.
+    :attr:`redundant` lists ``(collection, index, longer_index)`` tuples for
+    indexes that are a prefix of another, and :attr:`unused` lists
+    ``(collection, index)`` tuples for indexes that no recorded query uses.
+    Indexes are given as lists of ``(key, direction)`` pairs, as built by
+    :meth:`~mongoengine.queryset.QuerySet.ensure_index`.
+    """
+
+    def __init__(self):
+        self.unindexed = []
+        self.redundant = []
+        self.unused = []
+        self.documents = {}
+        self.shape_counts = {}
+
+    def recommendations(self, collection):
+        """Return the indexes recommended for ``collection``, leaving out
+        those that are a prefix of another recommendation.
+        """
+        indexes = []
+        for shape, problem, index in self.unindexed:
+            if shape.collection == collection and index not in indexes:
+                indexes.append(index)
+        return [index for index in indexes
+                if not any(_is_prefix(index, other) for other in indexes)]
+
+    def entries(self, collection):
+        """Return the ``meta['indexes']`` entries of the document stored in
+        ``collection``: its current entries without the redundant and
+        unused indexes, followed by the recommended ones.
+        """
+        document = self.documents[collection]
+        dropped = [index for c, index, longer in self.redundant
+                   if c == collection]
+        dropped += [index for c, index in self.unused if c == collection]
+        entries = [self._entry(document, index)
+                   for index in document._meta['indexes']
+                   if index not in dropped]
+        for index in self.recommendations(collection):
+            entry = self._entry(document, index)
+            if entry not in entries:
+                entries.append(entry)
+        return entries
+
+    def _entry(self, document, index):
+        keys = []
+        for key, direction in index:
+            if key in _TYPE_KEYS and document._meta.get('allow_inheritance'):
+                # Added automatically by _build_index_spec
+                continue
+            name = _attribute_path(document, key)
+            keys.append(direction == -1 and '-' + name or name)
+        if len(keys) == 1:
+            return keys[0]
+        return tuple(keys)
+
+    def format(self):
+        """Return the report as text, with ready to paste
+        ``meta['indexes']`` for the documents that need changes.
+        """
+        lines = []
+        for collection in sorted(self.documents):
+            document = self.documents[collection]
+            unindexed = [(s, p, i) for s, p, i in self.unindexed
+                         if s.collection == collection]
+            redundant = [(i, l) for c, i, l in self.redundant
+                         if c == collection]
+            unused = [i for c, i in self.unused if c == collection]
+            lines.append('%s (%s): %d query shape(s), %d without a '
+                         'suitable index' % (document.__name__, collection,
+                                             self.shape_counts[collection],
+                                             len(unindexed)))
+            for shape, problem, index in unindexed:
+                description = '%r' % (shape.filter,)
+                if shape.sort:
+                    description += ' sort %r' % (shape.sort,)
+                lines.append('  %s (seen %d times): %s' % (
+                    problem.capitalize(), shape.count, description))
+            for index, longer in redundant:
+                lines.append('  Redundant index %r, a prefix of %r' % (
+                    index, longer))
+            for index in unused:
+                lines.append('  Unused index %r' % (index,))
+            if unindexed or redundant or unused:
+                lines.append("  meta = {'indexes': [")
+                for entry in self.entries(collection):
+                    lines.append('      %r,' % (entry,))
+                lines.append('  ]}')
+            lines.append('')
+        return '\n'.join(lines)
+
+
+def _root_documents(documents):
+    """Return the least derived document class stored in each collection.
+    """
+    roots = {}
+    for document in documents:
+        collection = document._meta.get('collection')
+        if not collection:
+            continue
+        root = roots.get(collection)
+        if root is None or (len(document._superclasses) <
+                            len(root._superclasses)):
+            roots[collection] = document
+    return roots
+
+
+def advise(shapes, documents=None):
+    """Compare query shapes with the indexes defined by ``documents`` (every
+    document class that has been defined, by default), returning an
+    :class:`~mongoengine.advisor.IndexReport`.
+
+    Indexes are those of ``meta['indexes']`` and the unique indexes, as built
+    by :meth:`~mongoengine.queryset.QuerySet.ensure_index`, including the
+    automatic ``_types`` (or ``_cls``) prefix, along with the ``_id`` index
+    and the indexes on the keys the classes' queries match their type
+    with. Indexes are
+    only reported as unused for collections that have recorded shapes, and
+    unique indexes never are, as they are needed for their constraint.
+
+    :param shapes: a list of :class:`~mongoengine.advisor.QueryShape`\ s
+    :param documents: a list of :class:`~mongoengine.Document` classes
+    """
+    if documents is None:
+        documents = [document for document in _document_registry.values()
+                     if issubclass(document, Document)]
+    roots = _root_documents(documents)
+
+    report = IndexReport()
+    report.documents = roots
+    for collection, document in roots.items():
+        indexes = [_ID_INDEX] + [list(index) for index
+                                 in document._meta['indexes']]
+        unique = [list(index) for index in document._meta['unique_indexes']]
+        # The keys that queries on the root class and its subclasses use to
+        # match the type, which ensure_indexes indexes
+        type_indexes = []
+        classes = [document] + document._get_subclasses().values()
+        for cls in classes:
+            for key in QuerySet._type_query(cls):
+                if [(key, 1)] not in type_indexes:
+                    type_indexes.append([(key, 1)])
+        indexes += type_indexes
+        all_indexes = indexes + unique
+
+        used = set()
+        collection_shapes = [s for s in shapes if s.collection == collection]
+        report.shape_counts[collection] = len(collection_shapes)
+        for shape in collection_shapes:
+            best, best_use = None, (0, False)
+            for index in all_indexes:
+                keys_used, sorted_by_index = _index_use(index, shape)
+                # Matching the type alone doesn't narrow down the query
+                if keys_used == 1 and index[0][0] in _TYPE_KEYS:
+                    keys_used = 0
+                use = (keys_used, sorted_by_index)
+                if use > best_use or (use == best_use and best is not None
+                                      and len(index) < len(best)):
+                    best, best_use = index, use
+            if best_use[0] or (shape.sort and best_use[1]):
+                used.add(repr(best))
+            problem = None
+            if not best_use[0] and not (shape.sort and best_use[1]):
+                problem = 'no usable index'
+            elif shape.sort and not best_use[1]:
+                problem = 'sorted in memory'
+            if problem:
+                report.unindexed.append((shape, problem, _recommend(shape)))
+
+        for index in indexes:
+            if index == _ID_INDEX or index in type_indexes:
+                # Created automatically, rather than through meta
+                continue
+            for other in all_indexes:
+                if _is_prefix(index, other):
+                    report.redundant.append((collection, index, other))
+                    break
+            else:
+                if collection_shapes and repr(index) not in used:
+                    report.unused.append((collection, index))
+    return report
+
+
+def main(args=None):
+    parser = OptionParser(usage='%prog [options] SHAPES...')
+    parser.add_option('-m', '--module', action='append', default=[],
+                      help='import a module that defines documents')
+    options, paths = parser.parse_args(args)
+    if not paths:
+        parser.error('no shape files given')
+    for module in options.module:
+        __import__(module)
+    shapes = []
+    for path in paths:
+        shapes += load_shapes(path)
+    print advise(shapes).format()
+
+
+if __name__ == '__main__':
+    main()
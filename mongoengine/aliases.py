@@ -0,0 +1,237 @@
+"""Short database names for the fields of documents, assigned automatically.
+
+Field names are stored in every document, so long names make documents (and
+their indexes) larger. Setting ``compact_keys`` in a document's
+:attr:`meta` stores its fields under short aliases (``a``, ``b``, ...)
+instead::
+
+    class LogEntry(Document):
+        timestamp = DateTimeField()
+        message = StringField()
+        meta = {'compact_keys': True}
+
+Aliases are assigned by calling :func:`resolve_all` (or
+:func:`resolve_aliases` for a single document) once connected, before the
+documents are used, and are recorded in the ``mongoengine.aliases``
+collection, so that a field keeps its alias as fields are added and removed,
+and no alias is ever reused::
+
+    connect('mydb')
+    aliases.resolve_all()
+
+Existing documents may be rewritten to use the aliases with :func:`migrate`,
+or from the command line::
+
+    python -m mongoengine.aliases -m myapp.models -d mydb LogEntry
+
+.. versionadded:: 0.5
+"""
+# Imported absolutely, as this module may be run with ``python -m``
+from mongoengine.connection import _get_db, connect
+
+import string
+import itertools
+import pymongo
+import pymongo.errors
+from optparse import OptionParser
+
+__all__ = ['resolve_aliases', 'resolve_all', 'is_resolved', 'migrate',
+           'METADATA_COLLECTION']
+
+
+# The collection holding the aliases of each collection's fields
+METADATA_COLLECTION = 'mongoengine.aliases'
+
+_LETTERS = string.ascii_lowercase + string.ascii_uppercase
+
+
+def _generate_aliases():
+    """Generate aliases from shortest to longest: ``a`` to ``Z``, then
+    ``aa`` to ``ZZ`` and so on.
+    """
+    for length in itertools.count(1):
+        for letters in itertools.product(_LETTERS, repeat=length):
+            yield ''.join(letters)
+
+
+def _root(document):
+    """Return the root of a document's class hierarchy.
+    """
+    for superclass in document._superclasses.values():
+        if not superclass._superclasses:
+            return superclass
+    return document
+
+
+def _load(metadata, collection):
+    """Return the aliases recorded for a collection, creating the record if
+    needed.
+    """
+    record = metadata.find_one({'_id': collection})
+    if record is None:
+        try:
+            metadata.insert({'_id': collection, 'aliases': {}, 'used': {}},
+                             safe=True)
+        except pymongo.errors.DuplicateKeyError:
+            # Created by another process in the meantime
+            pass
+        record = metadata.find_one({'_id': collection})
+    return record
+
+
+def _claim(metadata, collection, name, alias):
+    """Atomically record ``alias`` for the field ``name``, unless either
+    has been recorded by another process, returning whether it was.
+    """
+    result = metadata.update({'_id': collection,
+                              'aliases.' + name: {'$exists': False},
+                              'used.' + alias: {'$exists': False}},
+                             {'$set': {'aliases.' + name: alias,
+                                       'used.' + alias: name}}, safe=True)
+    return bool(result and result.get('n'))
+
+
+def _rename_index(index, renames):
+    renamed = []
+    for key, direction in index:
+        parts = key.split('.')
+        parts[0] = renames.get(parts[0], parts[0])
+        renamed.append(('.'.join(parts), direction))
+    return renamed
+
+
+def is_resolved(document):
+    """Return whether the fields of ``document`` may be used, which is
+    once they have their aliases, if it sets ``compact_keys``.
+    """
+    return (not document._meta.get('compact_keys') or
+            document._meta.get('aliases_resolved', False))
+
+
+def resolve_aliases(document):
+    """Assign aliases to the fields of ``document``'s class hierarchy, if
+    it sets ``compact_keys`` in its :attr:`meta`, returning a dict of the
+    fields' aliases. Fields with a ``db_field`` of their own keep it.
+    Aliases are read from (and new ones recorded in) the
+    :data:`METADATA_COLLECTION`.
+    """
+    if not document._meta.get('compact_keys'):
+        return {}
+    root = _root(document)
+    classes = [root] + root._get_subclasses().values()
+
+    # Fields whose db_field is their name (or an alias) get an alias, and
+    # the names of the others must not be used as aliases. Neither may the
+    # fields' own names, which documents saved without aliases use
+    fields, taken = {}, set(['_id', '_cls', '_types', '_version'])
+    for cls in classes:
+        for name, field in cls._fields.items():
+            if getattr(field, '_compact', False) or field.db_field == name:
+                fields.setdefault(name, []).append(field)
+            else:
+                taken.add(field.db_field)
+    taken.update(fields)
+
+    collection = root._meta['collection']
+    metadata = _get_db()[METADATA_COLLECTION]
+    record = _load(metadata, collection)
+    for name in sorted(fields):
+        while name not in record['aliases']:
+            used = taken.union(record['used'])
+            for alias in _generate_aliases():
+                if alias not in used:
+                    break
+            _claim(metadata, collection, name, alias)
+            record = _load(metadata, collection)
+
+    aliases, renames = {}, {}
+    for name, name_fields in fields.items():
+        alias = aliases[name] = str(record['aliases'][name])
+        renames[name] = alias
+        for field in name_fields:
+            renames[field.db_field] = alias
+            field.db_field = alias
+            field._compact = True
+
+    # Indexes were built using the fields' previous names
+    for cls in classes:
+        for option in ('indexes', 'unique_indexes'):
+            cls._meta[option] = [_rename_index(index, renames)
+                                 for index in cls._meta[option]]
+        cls._meta['aliases_resolved'] = True
+    return aliases
+
+
+def resolve_all():
+    """Assign aliases to every document class defined so far that sets
+    ``compact_keys``.
+    """
+    from mongoengine.base import _document_registry
+    roots = set()
+    for document in _document_registry.values():
+        if document._meta.get('compact_keys'):
+            roots.add(_root(document))
+    for root in roots:
+        resolve_aliases(root)
+
+
+def migrate(document, batch_size=1000):
+    """Rewrite the existing documents of ``document``'s collection so that
+    their fields are stored under their aliases, renaming the fields of
+    ``batch_size`` documents at a time, in ``_id`` order. Returns the number
+    of documents processed. Indexes on the fields' previous names are left
+    in place, and should be dropped once the migration is complete.
+
+    Fields are renamed in two steps, through temporary names, so that a
+    field may be renamed to the previous name of another.
+    """
+    aliases = resolve_aliases(document)
+    renames = dict((name, alias) for name, alias in aliases.items()
+                   if name != alias)
+    if not renames:
+        return 0
+    temporary = dict((name, '_migrating_%s' % name) for name in renames)
+    steps = [temporary, dict((temporary[name], alias)
+                             for name, alias in renames.items())]
+    collection = _get_db()[_root(document)._meta['collection']]
+    processed, last = 0, None
+    while True:
+        query = {}
+        if last is not None:
+            query['_id'] = {'$gt': last}
+        cursor = collection.find(query, fields=['_id'])
+        cursor = cursor.sort('_id', pymongo.ASCENDING).limit(batch_size)
+        ids = [doc['_id'] for doc in cursor]
+        if not ids:
+            return processed
+        for step in steps:
+            collection.update({'_id': {'$in': ids}}, {'$rename': step},
+                              multi=True, safe=True)
+        processed += len(ids)
+        last = ids[-1]
+
+
+def main(args=None):
+    parser = OptionParser(usage='%prog [options] DOCUMENT...')
+    parser.add_option('-m', '--module', action='append', default=[],
+                      help='import a module that defines documents')
+    parser.add_option('-d', '--db', help='the database to migrate')
+    parser.add_option('--host', default='localhost')
+    parser.add_option('--port', type='int', default=27017)
+    parser.add_option('-b', '--batch-size', type='int', default=1000,
+                      help='the number of documents rewritten at once')
+    options, names = parser.parse_args(args)
+    if not options.db or not names:
+        parser.error('a database and at least one document are needed')
+    for module in options.module:
+        __import__(module)
+    connect(options.db, host=options.host, port=options.port)
+
+    from mongoengine.base import get_document
+    for name in names:
+        processed = migrate(get_document(name), options.batch_size)
+        print 'Migrated %d %s documents' % (processed, name)
+
+
+if __name__ == '__main__':
+    main()
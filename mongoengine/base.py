@@ -2,6 +2,7 @@ from queryset import QuerySet, QuerySetManager
 from queryset import DoesNotExist, MultipleObjectsReturned
 
 import sys
+import bisect
 import pymongo
 import pymongo.objectid
 
@@ -16,6 +17,256 @@ class ValidationError(Exception):
     pass
 
 
+class PartialList(list):
+    """A list holding part of a list field's items, as loaded with a
+    ``$slice`` or ``$elemMatch`` projection. As writing it back would discard
+    the items that weren't loaded, it may not be modified, and it is skipped
+    when the document is saved.
+
+    .. versionadded:: 0.5
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('Partially loaded lists may not be modified')
+
+    append = extend = insert = pop = remove = reverse = sort = _read_only
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _read_only
+    __iadd__ = __imul__ = _read_only
+
+
+def _embedded_documents(value):
+    """Return the embedded documents in a field's value: the value itself,
+    or the embedded documents in a list.
+    """
+    if isinstance(value, BaseDocument):
+        return [value]
+    if isinstance(value, list):
+        return [item for item in value if isinstance(item, BaseDocument)]
+    return []
+
+
+def _fill_embedded(value, loaded):
+    """Fill in the fields left out of the embedded documents in a field's
+    value, from a complete copy of the value.
+    """
+    if isinstance(value, BaseDocument):
+        value._fill_missing_fields(loaded)
+    elif isinstance(value, list) and isinstance(loaded, list):
+        for item, loaded_item in zip(value, loaded):
+            if isinstance(item, BaseDocument):
+                item._fill_missing_fields(loaded_item)
+
+
+def _reset_on(name):
+    """Wrap a list method so that calling it means the whole list has to be
+    written when the document is saved.
+    """
+    method = getattr(list, name)
+    def wrapper(self, *args, **kwargs):
+        self._changed()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+class BaseList(list):
+    """The value of a list field on a document that has been loaded from (or
+    saved to) the database. Appends, extends and removals are recorded, so
+    that saving the document sends just those changes as ``$push``,
+    ``$pushAll``, ``$pull``, ``$pullAll`` or ``$addToSet`` operations, which
+    don't overwrite items added to or removed from the list concurrently.
+    Any other change to the list means that it is written as a whole.
+
+    .. versionadded:: 0.5
+    """
+
+    def __init__(self, items, field, origin):
+        super(BaseList, self).__init__(items)
+        self._field = field
+        self._commit(origin)
+
+    def _commit(self, origin):
+        """Start recording changes against ``origin``, the list's value in the
+        database.
+        """
+        self._origin = origin
+        self._operations = []
+        self._reset = False
+
+    def _changed(self):
+        """Note that the list has changed in a way that can't be recorded.
+        """
+        self._reset = True
+
+    def append(self, item):
+        super(BaseList, self).append(item)
+        self._operations.append(('$push', [item]))
+
+    def extend(self, items):
+        items = list(items)
+        super(BaseList, self).extend(items)
+        self._operations.append(('$push', items))
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def remove(self, item):
+        super(BaseList, self).remove(item)
+        self._operations.append(('$pull', [item]))
+
+    def add_to_set(self, item):
+        """Append ``item`` to the list unless it is already present, using
+        ``$addToSet`` when the document is saved.
+        """
+        if item not in self:
+            super(BaseList, self).append(item)
+            self._operations.append(('$addToSet', [item]))
+
+    insert = _reset_on('insert')
+    pop = _reset_on('pop')
+    reverse = _reset_on('reverse')
+    sort = _reset_on('sort')
+    __setitem__ = _reset_on('__setitem__')
+    __delitem__ = _reset_on('__delitem__')
+    __setslice__ = _reset_on('__setslice__')
+    __delslice__ = _reset_on('__delslice__')
+    __imul__ = _reset_on('__imul__')
+
+    def _delta(self, value):
+        """Return the update operators (as a dict mapping each operator to
+        its argument) that turn the list as it was loaded into ``value``, its
+        current database representation. ``None`` is returned if the list has
+        to be written as a whole.
+        """
+        if self._reset:
+            return None
+        if not self._operations:
+            if value == self._origin:
+                return {}
+            # Items have been modified in place
+            return None
+
+        operators = set(operator for operator, items in self._operations)
+        if len(operators) > 1:
+            # MongoDB can't apply different operators to the same field in
+            # a single update
+            return None
+        operator = operators.pop()
+        items = [item for op, batch in self._operations for item in batch]
+        items = self._field.to_mongo(items)
+
+        # Check that applying the operation gives the expected result, e.g.
+        # removing an item that occurs more than once may not
+        if self._apply(operator, items) != value:
+            return None
+
+        return self._operator(operator, items)
+
+    def _apply(self, operator, items):
+        """Return the result of applying a list operator to the list as it
+        was loaded, as the database would.
+        """
+        expected = list(self._origin)
+        if operator == '$push':
+            expected.extend(items)
+        elif operator == '$addToSet':
+            expected.extend(item for item in items if item not in expected)
+        else:
+            expected = [item for item in expected if item not in items]
+        return expected
+
+    def _operator(self, operator, items):
+        if len(items) == 1:
+            return {operator: items[0]}
+        if operator == '$addToSet':
+            return {operator: {'$each': items}}
+        return {operator + 'All': items}
+
+
+class SortedList(BaseList):
+    """The value of a :class:`~mongoengine.SortedListField` on a document
+    that has been loaded from (or saved to) the database. Items that are
+    appended or added are inserted in order using binary search, so the list
+    is never sorted as a whole, and they are saved with a ``$push`` that
+    keeps the stored array sorted.
+
+    .. versionadded:: 0.5
+    """
+
+    def __init__(self, items, field, origin):
+        # The sort keys of the items, built when first needed
+        self._keys = None
+        super(SortedList, self).__init__(items, field, origin)
+
+    def _changed(self):
+        super(SortedList, self)._changed()
+        self._keys = None
+
+    def _insort(self, item):
+        if self._keys is None:
+            self._keys = [self._field._item_key(i) for i in self]
+            keys = self._keys
+            if any(keys[i] > keys[i + 1] for i in xrange(len(keys) - 1)):
+                list.sort(self, key=self._field._item_key)
+                self._keys.sort()
+        key = self._field._item_key(item)
+        index = bisect.bisect_right(self._keys, key)
+        self._keys.insert(index, key)
+        list.insert(self, index, item)
+
+    def append(self, item):
+        self._insort(item)
+        self._operations.append(('$push', [item]))
+
+    def extend(self, items):
+        items = list(items)
+        for item in items:
+            self._insort(item)
+        self._operations.append(('$push', items))
+
+    def remove(self, item):
+        index = self.index(item)
+        list.__delitem__(self, index)
+        if self._keys is not None:
+            del self._keys[index]
+        self._operations.append(('$pull', [item]))
+
+    def add_to_set(self, item):
+        if item not in self:
+            self._insort(item)
+            self._operations.append(('$addToSet', [item]))
+
+    def _delta(self, value):
+        operators = set(operator for operator, items in self._operations)
+        if operators - set(['$push', '$pull']):
+            # $addToSet would add the items at the end of the stored array
+            return None
+        return super(SortedList, self)._delta(value)
+
+    def _apply(self, operator, items):
+        if operator != '$push':
+            return super(SortedList, self)._apply(operator, items)
+        key = self._field._son_key
+        expected = list(self._origin)
+        keys = [key(item) for item in expected]
+        for item in items:
+            index = bisect.bisect_right(keys, key(item))
+            keys.insert(index, key(item))
+            expected.insert(index, item)
+        return expected
+
+    def _operator(self, operator, items):
+        if operator == '$push':
+            ordering = self._field._ordering
+            if ordering is None and items and isinstance(items[0], dict):
+                # MongoDB can only sort embedded documents by their fields
+                return None
+            sort = ordering is None and 1 or {ordering: 1}
+            return {'$push': {'$each': items, '$sort': sort}}
+        return super(SortedList, self)._operator(operator, items)
+
+
 class BaseField(object):
     """A base class for fields in a MongoDB document. Instances of this class
     may be added to subclasses of `Document` to define a document's schema.
@@ -24,6 +275,9 @@ class BaseField(object):
     # Fields may have _types inserted into indexes by default 
     _index_with_types = True
     _geo_index = False
+    # Fields whose values are decoded when first accessed, rather than when
+    # the document is loaded, and saved as they were loaded if never accessed
+    _lazy = False
 
     def __init__(self, db_field=None, name=None, required=False, default=None, 
                  unique=False, unique_with=None, primary_key=False,
@@ -50,6 +304,8 @@ class BaseField(object):
             # Document class being used rather than a document object
             return self
 
+        self._load_if_missing(instance)
+
         # Get value from document instance if available, if not use default
         value = instance._data.get(self.name)
         if value is None:
@@ -59,10 +315,18 @@ class BaseField(object):
                 value = value()
         return value
 
+    def _load_if_missing(self, instance):
+        """Fetch the field's value if it was left out when ``instance`` was
+        loaded.
+        """
+        if self.name in instance._missing_fields:
+            instance._load_missing_fields()
+
     def __set__(self, instance, value):
         """Descriptor for assigning a value to a field in a document.
         """
         instance._data[self.name] = value
+        instance._missing_fields.discard(self.name)
 
     def to_python(self, value):
         """Convert a MongoDB-compatible type to a Python type.
@@ -204,6 +468,12 @@ class DocumentMetaclass(type):
         exc = subclass_exception('MultipleObjectsReturned', base_excs, module)
         new_class.add_to_class('MultipleObjectsReturned', exc)
 
+        # Track the names of the classes whose documents each class may be
+        # loaded from, so that queries can match them all
+        new_class._subclasses = (new_class._class_name,)
+        for base in superclasses.values():
+            base._subclasses += (new_class._class_name,)
+
         global _document_registry
         _document_registry[name] = new_class
 
@@ -239,8 +509,9 @@ class TopLevelDocumentMetaclass(DocumentMetaclass):
             if hasattr(base, '_meta') and 'collection' in base._meta:
                 collection = base._meta['collection']
 
-                # Propagate index options.
-                for key in ('index_background', 'index_drop_dups', 'index_opts'):
+                # Propagate index and versioning options
+                for key in ('index_background', 'index_drop_dups', 'index_opts',
+                            'versioned', 'store_types', 'compact_keys'):
                    if key in base._meta:
                       base_meta[key] = base._meta[key]
 
@@ -258,6 +529,9 @@ class TopLevelDocumentMetaclass(DocumentMetaclass):
             'index_drop_dups': False,
             'index_opts': {},
             'queryset_class': QuerySet,
+            'versioned': False,
+            'store_types': True,
+            'compact_keys': False,
         }
         meta.update(base_meta)
 
@@ -328,8 +602,18 @@ class TopLevelDocumentMetaclass(DocumentMetaclass):
 
 class BaseDocument(object):
 
+    # Names of fields left out when the document was loaded from a projection
+    _missing_fields = frozenset()
+    # The projection the document was loaded with, if any
+    _projection = None
+    # The document and field name an embedded document was loaded as part of
+    _parent = None
+    # The version of a versioned document in the database
+    _version = None
+
     def __init__(self, **values):
         self._data = {}
+        self._missing_fields = set()
         # Assign default values to instance
         for attr_name in self._fields.keys():
             # Use default value if present
@@ -347,8 +631,9 @@ class BaseDocument(object):
         are present.
         """
         # Get a list of tuples of field names and their current values
-        fields = [(field, getattr(self, name)) 
-                  for name, field in self._fields.items()]
+        fields = [(field, self._get_value(name, field))
+                  for name, field in self._fields.items()
+                  if name not in self._missing_fields]
 
         # Ensure that each field is matched to a valid value
         for field, value in fields:
@@ -429,26 +714,129 @@ class BaseDocument(object):
             return unicode(self).encode('utf-8')
         return '%s object' % self.__class__.__name__
 
+    def _get_value(self, name, field):
+        """Return a field's value, leaving values of lazy fields as they
+        were loaded.
+        """
+        if field._lazy and self._data.get(name) is not None:
+            return self._data[name]
+        return getattr(self, name, None)
+
     def to_mongo(self):
         """Return data dictionary ready for use with MongoDB.
         """
         data = {}
         for field_name, field in self._fields.items():
-            value = getattr(self, field_name, None)
+            if field_name in self._missing_fields:
+                continue
+            value = self._get_value(field_name, field)
             if value is not None:
                 data[field.db_field] = field.to_mongo(value)
-        # Only add _cls and _types if allow_inheritance is not False
-        if not (hasattr(self, '_meta') and
-                self._meta.get('allow_inheritance', True) == False):
+        # Only add _cls and _types if allow_inheritance is not False, and
+        # _types only if the store_types meta option is not False
+        meta = getattr(self, '_meta', {})
+        if meta.get('allow_inheritance', True) != False:
             data['_cls'] = self._class_name
-            data['_types'] = self._superclasses.keys() + [self._class_name]
+            if meta.get('store_types', True):
+                data['_types'] = (self._superclasses.keys() +
+                                  [self._class_name])
         if data.has_key('_id') and not data['_id']:
             del data['_id']
         return data
 
+    def _load_missing_fields(self):
+        """Load the fields that were left out when the document was loaded.
+        Embedded documents have the document they belong to load them.
+        """
+        if self._parent is None:
+            self._missing_fields = set()
+            return
+        document, field_name = self._parent
+        document._load_subfields(field_name)
+
+    def _load_subfields(self, field_name):
+        """Load the whole of a field of which only some subfields were
+        loaded, filling in the subfields its embedded documents left out.
+        """
+        if self._parent is None:
+            self._missing_fields = set()
+            return
+        # Embedded documents are loaded as part of the top-level field
+        document, parent_field_name = self._parent
+        document._load_subfields(parent_field_name)
+
+    def _fill_missing_fields(self, loaded):
+        """Copy the fields that were left out of this embedded document
+        from ``loaded``, a complete copy of it (or ``None`` if it isn't in the
+        database).
+        """
+        if not isinstance(loaded, BaseDocument):
+            loaded = None
+        for field_name in self._fields:
+            value = None
+            if loaded is not None:
+                value = loaded._data.get(field_name)
+            if field_name in self._missing_fields:
+                self._data[field_name] = value
+            else:
+                _fill_embedded(self._data.get(field_name), value)
+        self._missing_fields = set()
+        self._projection = None
+        self._parent = None
+
+    def _track_lists(self, son):
+        """Start recording changes to the document's list fields, whose
+        database values are in ``son``. Only documents stored in their own
+        collection can do this.
+        """
+        pass
+
+    def _set_projection(self, projection):
+        """Record which fields were left out of the document by the projection
+        (a dict of database field paths) it was loaded with.
+        """
+        include = any(value == 1 for path, value in projection.items()
+                      if path != '_id' and not isinstance(value, dict))
+        missing = set()
+        for field_name, field in self._fields.items():
+            db_field = field.db_field
+            paths = [path for path, value in projection.items()
+                     if (path == db_field or path.startswith(db_field + '.'))
+                     and (value == 1 or isinstance(value, dict) or
+                          not include)]
+            if db_field == '_id':
+                loaded = projection.get('_id', 1) != 0
+            elif include:
+                loaded = bool(paths)
+            else:
+                loaded = projection.get(db_field) != 0
+            if not loaded:
+                missing.add(field_name)
+                # Don't hold the field's default in place of its real value
+                self._data[field_name] = None
+            elif isinstance(projection.get(db_field), dict):
+                value = self._data.get(field_name)
+                if isinstance(value, list):
+                    self._data[field_name] = PartialList(value)
+            else:
+                # Embedded documents record the subfields left out of them
+                prefix = db_field + '.'
+                subprojection = dict((path[len(prefix):], value)
+                                     for path, value in projection.items()
+                                     if path.startswith(prefix))
+                value = self._data.get(field_name)
+                if subprojection:
+                    for document in _embedded_documents(value):
+                        document._set_projection(subprojection)
+                        document._parent = (self, field_name)
+        self._missing_fields = missing
+        self._projection = dict(projection)
+
     @classmethod
-    def _from_son(cls, son):
-        """Create an instance of a Document (subclass) from a PyMongo SON.
+    def _from_son(cls, son, projection=None):
+        """Create an instance of a Document (subclass) from a PyMongo SON. If
+        the SON was loaded with a ``projection``, the fields it left out are
+        recorded so that they may be loaded when accessed.
         """
         # get the class name from the document, falling back to the given
         # class if unavailable
@@ -462,6 +850,8 @@ class BaseDocument(object):
         if '_cls' in data:
             del data['_cls']
 
+        version = data.pop('_version', None)
+
         # Return correct subclass for document type
         if class_name != cls._class_name:
             subclasses = cls._get_subclasses()
@@ -481,6 +871,10 @@ class BaseDocument(object):
 
         obj = cls(**data)
         obj._present_fields = present_fields
+        obj._version = version
+        if projection:
+            obj._set_projection(projection)
+        obj._track_lists(son)
         return obj
 
     def __eq__(self, other):
@@ -11,6 +11,7 @@ _connection_defaults = {
 _connection = {}
 _connection_settings = _connection_defaults.copy()
 
+_backend = 'mongodb'
 _db_name = None
 _db_username = None
 _db_password = None
@@ -26,8 +27,11 @@ def _get_connection(reconnect=False):
     identity = get_identity()
     # Connect to the database if not already connected
     if _connection.get(identity) is None or reconnect:
+        connection_class = Connection
+        if _backend == 'memory':
+            from memory import MemoryConnection as connection_class
         try:
-            _connection[identity] = Connection(**_connection_settings)
+            _connection[identity] = connection_class(**_connection_settings)
         except:
             raise ConnectionError('Cannot connect to the database')
     return _connection[identity]
@@ -56,16 +60,35 @@ def get_identity():
     identity = 0 if not identity else identity[0]
     return identity
     
-def connect(db, username=None, password=None, **kwargs):
+def connect(db, username=None, password=None, backend='mongodb',
+            slow_query_threshold=None, **kwargs):
     """Connect to the database specified by the 'db' argument. Connection 
     settings may be provided here as well if the database is not running on
     the default port on localhost. If authentication is needed, provide
     username and password arguments as well.
+
+    Passing ``backend='memory'`` stores the database in memory, in this
+    process, rather than connecting to a MongoDB server (see
+    :mod:`mongoengine.memory`). This is useful for tests and benchmarks.
+
+    Operations that take longer than ``slow_query_threshold`` seconds, if
+    given, are logged along with their query plan (see
+    :class:`~mongoengine.monitoring.SlowQueryLog`).
+
+    .. versionchanged:: 0.5 - added the ``backend`` and
+       ``slow_query_threshold`` arguments
     """
     global _connection_settings, _db_name, _db_username, _db_password, _db
+    global _backend
+    if backend not in ('mongodb', 'memory'):
+        raise ConnectionError('Unknown backend: %s' % backend)
+    _backend = backend
     _connection_settings = dict(_connection_defaults, **kwargs)
     _db_name = db
     _db_username = username
     _db_password = password
-    return _get_db(reconnect=True)
+    db = _get_db(reconnect=True)
+    import monitoring
+    monitoring.log_slow_queries(slow_query_threshold)
+    return db
 
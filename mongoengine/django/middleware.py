@@ -0,0 +1,59 @@
+from mongoengine.unitofwork import UnitOfWork, current_unit_of_work
+from mongoengine.monitoring import DereferenceDetector
+
+
+class UnitOfWorkMiddleware(object):
+    """Django middleware that runs each request in a
+    :class:`~mongoengine.unitofwork.UnitOfWork`, so that the documents saved
+    and deleted while handling it are written in batches once the response
+    is ready. If the view raises an exception, the writes are discarded.
+    """
+
+    def process_request(self, request):
+        # Discard the units of work of earlier requests on this thread whose
+        # response wasn't processed (e.g. because another middleware raised),
+        # so that they don't capture this request's writes
+        unit = current_unit_of_work()
+        while unit is not None:
+            unit.rollback()
+            unit = current_unit_of_work()
+        request.unit_of_work = UnitOfWork()
+        request.unit_of_work.begin()
+
+    def process_exception(self, request, exception):
+        unit = getattr(request, 'unit_of_work', None)
+        if unit is not None:
+            unit.rollback()
+
+    def process_response(self, request, response):
+        unit = getattr(request, 'unit_of_work', None)
+        if unit is not None:
+            unit.commit()
+        return response
+
+
+class DereferenceDetectorMiddleware(object):
+    """Django middleware that runs a
+    :class:`~mongoengine.monitoring.DereferenceDetector` while handling each
+    request, warning about the N+1 queries the views make. Subclass it to
+    change :attr:`threshold` or set :attr:`raise_error`.
+    """
+
+    threshold = 10
+    raise_error = False
+
+    def process_request(self, request):
+        request.dereference_detector = DereferenceDetector(self.threshold,
+                                                           self.raise_error)
+        request.dereference_detector.start()
+
+    def process_exception(self, request, exception):
+        detector = getattr(request, 'dereference_detector', None)
+        if detector is not None:
+            detector.stop()
+
+    def process_response(self, request, response):
+        detector = getattr(request, 'dereference_detector', None)
+        if detector is not None:
+            detector.stop()
+        return response
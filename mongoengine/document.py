@@ -1,12 +1,14 @@
 from base import (DocumentMetaclass, TopLevelDocumentMetaclass, BaseDocument,
-                  ValidationError)
-from queryset import OperationError
+                  ValidationError, PartialList, BaseList, _fill_embedded)
+from queryset import OperationError, ConflictError
 from connection import _get_db
+from unitofwork import current_unit_of_work
 
 import pymongo
 
 
-__all__ = ['Document', 'EmbeddedDocument', 'ValidationError', 'OperationError']
+__all__ = ['Document', 'EmbeddedDocument', 'ValidationError', 'OperationError',
+           'ConflictError']
 
 
 class EmbeddedDocument(BaseDocument):
@@ -38,7 +40,8 @@ class Document(BaseDocument):
     fields are added to documents (hidden though the MongoEngine interface
     though). To disable this behaviour and remove the dependence on the
     presence of `_cls` and `_types`, set :attr:`allow_inheritance` to
-    ``False`` in the :attr:`meta` dictionary.
+    ``False`` in the :attr:`meta` dictionary. To only store `_cls`, set
+    :attr:`store_types` to ``False``.
 
     A :class:`~mongoengine.Document` may use a **Capped Collection** by 
     specifying :attr:`max_documents` and :attr:`max_size` in the :attr:`meta`
@@ -52,10 +55,19 @@ class Document(BaseDocument):
     dictionary. The value should be a list of field names or tuples of field 
     names. Index direction may be specified by prefixing the field names with
     a **+** or **-** sign.
+
+    Setting :attr:`versioned` to ``True`` in the :attr:`meta` dictionary stores
+    a version number (in a `_version` field) with each document, which is
+    incremented by every save and update. Saving a document that has been
+    changed in the database since it was loaded raises a
+    :class:`~mongoengine.ConflictError` rather than overwriting the changes.
     """
 
     __metaclass__ = TopLevelDocumentMetaclass
 
+    # The list field values whose changes are being recorded, by field name
+    _tracked_lists = None
+
     def save(self, safe=True, force_insert=False, validate=True):
         """Save the :class:`~mongoengine.Document` to the database. If the
         document already exists, it will be updated, otherwise it will be
@@ -64,6 +76,26 @@ class Document(BaseDocument):
         If ``safe=True`` and the operation is unsuccessful, an 
         :class:`~mongoengine.OperationError` will be raised.
 
+        A document loaded with only some of its fields (see
+        :meth:`~mongoengine.queryset.QuerySet.only` and
+        :meth:`~mongoengine.queryset.QuerySet.exclude`) is saved by setting
+        the fields that were loaded, leaving the others untouched.
+
+        Once a document has been loaded or saved, items appended to or removed
+        from its list fields are saved with atomic list operations such as
+        ``$push`` and ``$pull``, rather than by rewriting the whole list. If
+        ``safe=True`` and the document was deleted in the meantime, it is
+        inserted again as a whole, or, if it was only partially loaded, an
+        :class:`~mongoengine.OperationError` is raised.
+
+        A versioned document is only saved if its version in the database is
+        still the one it was loaded with, otherwise a
+        :class:`~mongoengine.ConflictError` is raised. The check is always
+        made, regardless of ``safe``.
+
+        Inside a :class:`~mongoengine.unitofwork.UnitOfWork`, the document is
+        only validated, and is written when the unit of work is committed.
+
         :param safe: check if the operation succeeded before returning
         :param force_insert: only try to create a new document, don't allow 
             updates of existing documents
@@ -71,11 +103,35 @@ class Document(BaseDocument):
         """
         if validate:
             self.validate()
-        doc = self.to_mongo()
+        unit = current_unit_of_work()
+        if unit is not None:
+            unit.save(self, force_insert)
+            return
+        self._save(self.to_mongo(), safe, force_insert)
+
+    def _save(self, doc, safe=True, force_insert=False):
+        """Write the document's SON to the database.
+        """
+        versioned = self._meta.get('versioned')
         try:
             collection = self.__class__.objects._collection
-            if force_insert:
+            if force_insert or (versioned and '_id' not in doc):
+                if versioned:
+                    doc['_version'] = 1
                 object_id = collection.insert(doc, safe=safe)
+            elif versioned:
+                object_id = self._save_version(collection, doc)
+            elif self._projection is not None or self._tracked_lists:
+                if '_id' not in doc:
+                    raise OperationError('Cannot save a document that was '
+                                         'loaded without its id')
+                object_id = doc['_id']
+                update = self._build_update(doc)
+                if update:
+                    result = collection.update({'_id': object_id}, update,
+                                               safe=safe)
+                    if safe and not (result and result.get('n')):
+                        self._save_deleted(collection, doc, safe)
             else:
                 object_id = collection.save(doc, safe=safe)
         except pymongo.errors.OperationFailure, err:
@@ -83,15 +139,250 @@ class Document(BaseDocument):
             if u'duplicate key' in unicode(err):
                 message = u'Tried to save duplicate unique keys (%s)'
             raise OperationError(message % unicode(err))
+        self._saved(doc, object_id)
+
+    def _save_deleted(self, collection, doc, safe):
+        """Save a document that was deleted since it was loaded, which a
+        fully loaded document does by being inserted again, like a document
+        saved without tracked changes.
+        """
+        if self._projection is not None:
+            raise OperationError('Could not save document (it was deleted '
+                                 'after being partially loaded)')
+        collection.save(doc, safe=safe)
+
+    def _saved(self, doc, object_id):
+        """Update the document once its SON has been written.
+        """
         id_field = self._meta['id_field']
         self[id_field] = self._fields[id_field].to_python(object_id)
+        if self._meta.get('versioned'):
+            self._version = doc['_version']
+        self._track_lists(doc)
+
+    def _save_version(self, collection, doc):
+        """Update a versioned document, provided that its version in the
+        database is the one it was loaded with, and increment the version.
+        A document without a version (such as one stored before versioning
+        was enabled, or a new document with its own id) is at version 0, and
+        is inserted if it isn't in the database.
+        """
+        update = self._build_update(doc)
+        if self._tracked_lists is None:
+            # A new document is written whole, including _cls and _types,
+            # which aren't fields
+            sets = update.setdefault('$set', {})
+            for key, value in doc.items():
+                if key not in ('_id', '_version'):
+                    sets[key] = value
+        update.setdefault('$inc', {})['_version'] = 1
+        version = self._version or 0
+        spec = {'_id': doc['_id'], '_version': self._version}
+        if self._version is None:
+            spec['_version'] = {'$exists': False}
+        try:
+            result = collection.update(spec, update, upsert=not version,
+                                       safe=True)
+        except pymongo.errors.DuplicateKeyError:
+            # The upsert found the id taken by a versioned document
+            if collection.find_one({'_id': doc['_id']}, fields=[]) is None:
+                raise
+            result = None
+        if not result or not result.get('n'):
+            raise ConflictError('Document has been changed or deleted since '
+                                'version %d was loaded' % version)
+        doc['_version'] = version + 1
+        return doc['_id']
+
+    def retry_save(self, func, retries=5, **kwargs):
+        """Apply ``func`` to the document and save it. Whenever the save fails
+        with a :class:`~mongoengine.ConflictError` because the document was
+        changed by someone else, the document is reloaded and ``func``
+        applied again, up to ``retries`` times. ::
+
+            def add_view(page):
+                page.views += 1
+
+            page.retry_save(add_view)
+
+        The value returned by ``func`` is returned.
+
+        :param func: a function that is passed the document and makes changes
+            to it
+        :param retries: the number of times to retry before giving up and
+            raising the :class:`~mongoengine.ConflictError`; if the document
+            has been deleted, ``DoesNotExist`` is raised instead
+        :param kwargs: keyword arguments passed to
+            :meth:`~mongoengine.Document.save`
+
+        .. versionadded:: 0.5
+        """
+        attempts = 0
+        while True:
+            result = func(self)
+            try:
+                self.save(**kwargs)
+                return result
+            except ConflictError:
+                attempts += 1
+                if attempts > retries:
+                    raise
+                self.reload()
+
+    def _track_lists(self, son):
+        """Record the database values of the document's list fields, so that
+        changes to them may be saved as atomic list operations.
+        """
+        from fields import ListField
+        tracked = {}
+        for field_name, field in self._fields.items():
+            value = self._data.get(field_name)
+            if (not isinstance(field, ListField) or
+                not isinstance(value, list) or
+                isinstance(value, PartialList) or field.db_field not in son):
+                continue
+            if isinstance(value, BaseList) and value._field is field:
+                value._commit(son[field.db_field])
+            else:
+                value = field._list_class(value, field, son[field.db_field])
+                self._data[field_name] = value
+            tracked[field_name] = value
+        self._tracked_lists = tracked
+
+    def _build_update(self, son):
+        """Build an update modifier for saving a document that is already in
+        the database. Only the fields (and subfields) that were loaded are
+        written, and changes to list fields are made with list operators
+        where possible.
+        """
+        projection = self._projection or {}
+        include = any(value == 1 for path, value in projection.items()
+                      if path != '_id' and not isinstance(value, dict))
+        tracked = self._tracked_lists or {}
+        sets, unsets, operators = {}, {}, {}
+
+        def write(path, value, projection):
+            # projection holds the paths beneath this one that were selected
+            if not projection:
+                if value is None:
+                    unsets[path] = 1
+                else:
+                    sets[path] = value
+                return
+            if isinstance(value, list):
+                # Arrays with projected members can't be written back
+                return
+            value = value or {}
+            children = {}
+            for subpath, selected in projection.items():
+                key, _, rest = subpath.partition('.')
+                children.setdefault(key, {})
+                if rest:
+                    children[key][rest] = selected
+            if include:
+                for key, child in children.items():
+                    write(path + '.' + key, value.get(key), child)
+            else:
+                for key in value:
+                    if key not in children:
+                        sets[path + '.' + key] = value[key]
+                    elif children[key]:
+                        write(path + '.' + key, value[key], children[key])
+
+        for field_name, field in self._fields.items():
+            db_field = field.db_field
+            if field_name in self._missing_fields or db_field == '_id':
+                continue
+            value = self._data.get(field_name)
+            if isinstance(value, PartialList):
+                # Only part of the list was loaded, so leave it untouched
+                continue
+            prefix = db_field + '.'
+            subpaths = dict((path[len(prefix):], selected)
+                            for path, selected in projection.items()
+                            if path.startswith(prefix))
+            if (not subpaths and field_name in tracked and
+                value is tracked[field_name]):
+                delta = value._delta(son.get(db_field))
+                if delta is not None:
+                    for operator, argument in delta.items():
+                        operators.setdefault(operator, {})[db_field] = argument
+                    continue
+            write(db_field, son.get(db_field), subpaths)
+
+        update = operators
+        if sets:
+            update['$set'] = sets
+        if unsets:
+            update['$unset'] = unsets
+        return update
+
+    def _load_missing_fields(self):
+        """Load all of the fields that were left out when the document was
+        loaded, with a single query.
+        """
+        missing, self._missing_fields = self._missing_fields, set()
+        id_field = self._meta['id_field']
+        if self[id_field] is None:
+            return
+
+        object_id = self._fields[id_field].to_mongo(self[id_field])
+        fields = [self._fields[name].db_field for name in missing]
+        collection = self.__class__.objects._collection
+        son = collection.find_one({'_id': object_id}, fields=fields)
+        if son is None:
+            return
+
+        for field_name in missing:
+            field = self._fields[field_name]
+            value = son.get(field.db_field)
+            if value is not None:
+                value = field.to_python(value)
+            self._data[field_name] = value
+
+    def _load_subfields(self, field_name):
+        """Load the whole of a field of which only some subfields were
+        loaded, filling in the subfields its embedded documents left out, so
+        that the field is saved as a whole from then on.
+        """
+        field = self._fields[field_name]
+        db_field = field.db_field
+        prefix = db_field + '.'
+        projection = self._projection or {}
+        include = any(value == 1 for path, value in projection.items()
+                      if path != '_id' and not isinstance(value, dict))
+        self._projection = dict((path, value)
+                                for path, value in projection.items()
+                                if not path.startswith(prefix))
+        if include:
+            self._projection[db_field] = 1
+
+        id_field = self._meta['id_field']
+        value = self._data.get(field_name)
+        if self[id_field] is None:
+            _fill_embedded(value, None)
+            return
+        object_id = self._fields[id_field].to_mongo(self[id_field])
+        collection = self.__class__.objects._collection
+        son = collection.find_one({'_id': object_id}, fields=[db_field])
+        loaded = son and son.get(db_field)
+        if loaded is not None:
+            loaded = field.to_python(loaded)
+        _fill_embedded(value, loaded)
 
     def delete(self, safe=False):
         """Delete the :class:`~mongoengine.Document` from the database. This
         will only take effect if the document has been previously saved.
 
+        Inside a :class:`~mongoengine.unitofwork.UnitOfWork`, the document is
+        deleted when the unit of work is committed.
+
         :param safe: check if the operation succeeded before returning
         """
+        unit = current_unit_of_work()
+        if unit is not None:
+            unit.delete(self)
+            return
         id_field = self._meta['id_field']
         object_id = self._fields[id_field].to_mongo(self[id_field])
         try:
@@ -107,8 +398,13 @@ class Document(BaseDocument):
         """
         id_field = self._meta['id_field']
         obj = self.__class__.objects(**{id_field: self[id_field]}).first()
+        if obj is None:
+            raise self.DoesNotExist('Document has been deleted')
         for field in self._fields:
             setattr(self, field, obj[field])
+        self._projection = None
+        self._tracked_lists = obj._tracked_lists
+        self._version = obj._version
 
     @classmethod
     def drop_collection(cls):
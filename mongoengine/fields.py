@@ -1,7 +1,8 @@
-from base import BaseField, ObjectIdField, ValidationError, get_document
+from base import (BaseField, ObjectIdField, ValidationError, get_document,
+                  BaseList, SortedList)
 from document import Document, EmbeddedDocument
 from connection import _get_db
-from operator import itemgetter
+import monitoring
 
 import re
 import pymongo
@@ -13,13 +14,26 @@ import decimal
 import gridfs
 import warnings
 import types
+import zlib
+
+try:
+    import bson
+except ImportError:
+    # PyMongo < 1.9 ships the BSON module inside the pymongo package
+    from pymongo import bson
+
+try:
+    import lz4.block as lz4
+except ImportError:
+    lz4 = None
 
 
 __all__ = ['StringField', 'IntField', 'FloatField', 'BooleanField',
            'DateTimeField', 'EmbeddedDocumentField', 'ListField', 'DictField',
            'ObjectIdField', 'ReferenceField', 'ValidationError',
            'DecimalField', 'URLField', 'GenericReferenceField', 'FileField',
-           'BinaryField', 'SortedListField', 'EmailField', 'GeoPointField']
+           'BinaryField', 'SortedListField', 'EmailField', 'GeoPointField',
+           'CompressedField']
 
 RECURSIVE_REFERENCE_CONSTANT = 'self'
 
@@ -321,6 +335,8 @@ class ListField(BaseField):
 
     # ListFields cannot be indexed with _types - MongoDB doesn't support this
     _index_with_types = False
+    # The list type used to record changes to the values of saved documents
+    _list_class = BaseList
 
     def __init__(self, field, **kwargs):
         if not isinstance(field, BaseField):
@@ -337,6 +353,8 @@ class ListField(BaseField):
             # Document class being used rather than a document object
             return self
 
+        self._load_if_missing(instance)
+
         if isinstance(self.field, ReferenceField):
             referenced_type = self.field.document_type
             # Get value from document instance if available 
@@ -346,11 +364,12 @@ class ListField(BaseField):
                 for value in value_list:
                     # Dereference DBRefs
                     if isinstance(value, (pymongo.dbref.DBRef)):
-                        value = _get_db().dereference(value)
+                        value = monitoring.dereference(value, instance,
+                                                       self.name)
                         deref_list.append(referenced_type._from_son(value))
                     else:
                         deref_list.append(value)
-                instance._data[self.name] = deref_list
+                self._replace_items(instance, value_list, deref_list)
 
         if isinstance(self.field, GenericReferenceField):
             value_list = instance._data.get(self.name)
@@ -359,13 +378,22 @@ class ListField(BaseField):
                 for value in value_list:
                     # Dereference DBRefs
                     if isinstance(value, (dict, pymongo.son.SON)):
-                        deref_list.append(self.field.dereference(value))
+                        deref_list.append(self.field.dereference(
+                            value, instance, self.name))
                     else:
                         deref_list.append(value)
-                instance._data[self.name] = deref_list
+                self._replace_items(instance, value_list, deref_list)
 
         return super(ListField, self).__get__(instance, owner)
 
+    def _replace_items(self, instance, value_list, items):
+        if type(value_list) is list:
+            instance._data[self.name] = items
+        else:
+            # Keep list wrappers such as partially loaded lists, replacing
+            # their items without it counting as a change to the list
+            list.__setslice__(value_list, 0, len(value_list), items)
+
     def to_python(self, value):
         return [self.field.to_python(item) for item in value]
 
@@ -407,21 +435,36 @@ class SortedListField(ListField):
     the database in order to ensure that a sorted list is always
     retrieved.
 
+    Once a document has been saved, items added to the list are inserted
+    in order, and saved with a ``$push`` that keeps the stored list sorted,
+    so the list isn't sorted or rewritten as a whole on every save.
+
     .. versionadded:: 0.4
     """
 
     _ordering = None
+    _list_class = SortedList
 
     def __init__(self, field, **kwargs):
         if 'ordering' in kwargs.keys():
             self._ordering = kwargs.pop('ordering')
         super(SortedListField, self).__init__(field, **kwargs)
 
-    def to_mongo(self, value):
+    def _son_key(self, value):
+        """Return the sort key of an item's database representation.
+        """
         if self._ordering is not None:
-            return sorted([self.field.to_mongo(item) for item in value],
-                          key=itemgetter(self._ordering))
-        return sorted([self.field.to_mongo(item) for item in value])
+            return value[self._ordering]
+        return value
+
+    def _item_key(self, item):
+        return self._son_key(self.field.to_mongo(item))
+
+    def to_mongo(self, value):
+        value_list = [self.field.to_mongo(item) for item in value]
+        # Items may have been changed in place, so always sort; lists that
+        # are already in order are sorted in linear time
+        return sorted(value_list, key=self._son_key)
 
 
 class DictField(BaseField):
@@ -480,11 +523,13 @@ class ReferenceField(BaseField):
             # Document class being used rather than a document object
             return self
 
+        self._load_if_missing(instance)
+
         # Get value from document instance if available
         value = instance._data.get(self.name)
         # Dereference DBRefs
         if isinstance(value, (pymongo.dbref.DBRef)):
-            value = _get_db().dereference(value)
+            value = monitoring.dereference(value, instance, self.name)
             if value is not None:
                 instance._data[self.name] = self.document_type._from_son(value)
 
@@ -528,16 +573,19 @@ class GenericReferenceField(BaseField):
         if instance is None:
             return self
 
+        self._load_if_missing(instance)
+
         value = instance._data.get(self.name)
         if isinstance(value, (dict, pymongo.son.SON)):
-            instance._data[self.name] = self.dereference(value)
+            instance._data[self.name] = self.dereference(value, instance,
+                                                         self.name)
 
         return super(GenericReferenceField, self).__get__(instance, owner)
 
-    def dereference(self, value):
+    def dereference(self, value, instance=None, name=None):
         doc_cls = get_document(value['_cls'])
         reference = value['_ref']
-        doc = _get_db().dereference(reference)
+        doc = monitoring.dereference(reference, instance, name)
         if doc is not None:
             doc = doc_cls._from_son(doc)
         return doc
@@ -566,26 +614,173 @@ class GenericReferenceField(BaseField):
 
 class BinaryField(BaseField):
     """A binary data field.
+
+    Loaded values are copied into a :class:`str`, unless ``buffer`` is
+    ``True``, in which case they are :class:`memoryview`\ s of the data
+    returned by the driver, so that large values aren't copied when loaded.
+    Either a :class:`str` or a :class:`memoryview` may be assigned.
+
+    .. versionchanged:: 0.5 - added the ``buffer`` argument
     """
 
-    def __init__(self, max_bytes=None, **kwargs):
+    def __init__(self, max_bytes=None, buffer=False, **kwargs):
         self.max_bytes = max_bytes
+        self.buffer = buffer
         super(BinaryField, self).__init__(**kwargs)
 
     def to_mongo(self, value):
+        if isinstance(value, memoryview):
+            value = value.tobytes()
         return pymongo.binary.Binary(value)
 
     def to_python(self, value):
+        if self.buffer:
+            return memoryview(value)
         # Returns str not unicode as this is binary data
         return str(value)
 
     def validate(self, value):
-        assert isinstance(value, str)
+        assert isinstance(value, (str, memoryview))
 
         if self.max_bytes is not None and len(value) > self.max_bytes:
             raise ValidationError('Binary value is too long')
 
 
+class CompressedValue(object):
+    """A value of a :class:`~mongoengine.CompressedField` as it was loaded,
+    before it has been decompressed.
+    """
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+
+class CompressedField(BaseField):
+    """Stores the values of another field compressed, when they take up more
+    than ``threshold`` bytes. This suits large strings, binary data and
+    dictionaries that are loaded far more often than they are queried::
+
+        class Page(Document):
+            html = CompressedField(StringField())
+            headers = CompressedField(DictField(), threshold=4096)
+
+    Compressed values are stored as :class:`~pymongo.binary.Binary` data (of
+    the user-defined subtype) starting with a three byte header that names
+    the codec, followed by the compressed BSON encoding of the value. Smaller
+    values, and values that don't compress, are stored as the wrapped field
+    stores them.
+
+    Values are decompressed the first time they are accessed rather than when
+    the document is loaded, and values that were never accessed are saved
+    without being compressed again. As the database only sees compressed
+    data, queries on the field only match values that weren't compressed.
+
+    :param field: the field whose values are compressed
+    :param threshold: the smallest size in bytes of the encoded values that
+        are compressed
+    :param codec: ``'zlib'``, or ``'lz4'`` if the ``lz4`` package is
+        installed
+    :param level: the zlib compression level, from 1 (fastest) to 9 (best)
+
+    .. versionadded:: 0.5
+    """
+
+    _lazy = True
+    # The first bytes of compressed values, followed by a codec's identifier
+    MAGIC = 'mz'
+    CODECS = {'zlib': 'z', 'lz4': '4'}
+
+    def __init__(self, field, threshold=1024, codec='zlib', level=6,
+                 **kwargs):
+        if not isinstance(field, BaseField):
+            raise ValidationError('Argument to CompressedField constructor '
+                                  'must be a valid field')
+        if codec not in self.CODECS:
+            raise ValueError('Unknown compression codec: %s' % codec)
+        if codec == 'lz4' and lz4 is None:
+            raise ImportError('The lz4 codec needs the lz4 package')
+        self.field = field
+        self.threshold = threshold
+        self.codec = codec
+        self.level = level
+        kwargs.setdefault('default', field.default)
+        super(CompressedField, self).__init__(**kwargs)
+
+    def __get__(self, instance, owner):
+        """Descriptor to decompress values when they are first accessed.
+        """
+        if instance is None:
+            # Document class being used rather than a document object
+            return self
+
+        self._load_if_missing(instance)
+
+        value = instance._data.get(self.name)
+        if isinstance(value, CompressedValue):
+            instance._data[self.name] = self.decompress(value.data)
+        return super(CompressedField, self).__get__(instance, owner)
+
+    def compress(self, value):
+        """Return the database value of a field value, compressed if it is
+        large enough and compressible.
+        """
+        value = self.field.to_mongo(value)
+        data = bson.BSON.encode({'v': value})
+        if len(data) < self.threshold:
+            return value
+        if self.codec == 'lz4':
+            compressed = lz4.compress(data)
+        else:
+            compressed = zlib.compress(data, self.level)
+        compressed = self.MAGIC + self.CODECS[self.codec] + compressed
+        if len(compressed) >= len(data):
+            return value
+        return pymongo.binary.Binary(compressed,
+                                     pymongo.binary.USER_DEFINED_SUBTYPE)
+
+    def decompress(self, data):
+        """Return the field value of compressed data.
+        """
+        codec, data = data[len(self.MAGIC)], data[len(self.MAGIC) + 1:]
+        if codec == self.CODECS['lz4']:
+            if lz4 is None:
+                raise ValidationError('Cannot decompress lz4 data without '
+                                      'the lz4 package')
+            data = lz4.decompress(data)
+        else:
+            data = zlib.decompress(data)
+        value = bson.BSON(data).decode()['v']
+        return self.field.to_python(value)
+
+    def _is_compressed(self, value):
+        return (isinstance(value, pymongo.binary.Binary) and
+                value.subtype == pymongo.binary.USER_DEFINED_SUBTYPE and
+                value.startswith(self.MAGIC))
+
+    def to_python(self, value):
+        if self._is_compressed(value):
+            # Decompressed when first accessed
+            return CompressedValue(value)
+        return self.field.to_python(value)
+
+    def to_mongo(self, value):
+        if isinstance(value, CompressedValue):
+            return value.data
+        return self.compress(value)
+
+    def validate(self, value):
+        if not isinstance(value, CompressedValue):
+            self.field._validate(value)
+
+    def prepare_query_value(self, op, value):
+        return self.field.prepare_query_value(op, value)
+
+    def lookup_member(self, member_name):
+        return None
+
+
 class GridFSError(Exception):
     pass
 
@@ -596,11 +791,22 @@ class GridFSProxy(object):
     .. versionadded:: 0.4
     """
 
+    # The GridFS collection files are stored in
+    collection_name = 'fs'
+
     def __init__(self, grid_id=None):
-        self.fs = gridfs.GridFS(_get_db())  # Filesystem instance
+        self._fs = None
         self.newfile = None                 # Used for partial writes
         self.grid_id = grid_id              # Store GridFS id for file
 
+    @property
+    def fs(self):
+        # Created when first used, so that documents with file fields may be
+        # created without a database that supports GridFS
+        if self._fs is None:
+            self._fs = gridfs.GridFS(_get_db(), self.collection_name)
+        return self._fs
+
     def __getattr__(self, name):
         obj = self.get()
         if name in dir(obj):
@@ -650,6 +856,54 @@ class GridFSProxy(object):
         except:
             return None
 
+    def chunks(self):
+        """Yield the data of each of the file's chunks in order, fetching
+        them with a single query rather than one query per chunk.
+
+        .. versionadded:: 0.5
+        """
+        if self.grid_id is None:
+            return
+        chunks = _get_db()[self.collection_name].chunks
+        cursor = chunks.find({'files_id': self.grid_id}, fields=['data'])
+        for chunk in cursor.sort('n', pymongo.ASCENDING):
+            yield chunk['data']
+
+    def readinto(self, buffer):
+        """Read the file into a preallocated writable buffer, such as a
+        :class:`bytearray` or an :class:`mmap.mmap`, one chunk at a time, and
+        return the number of bytes read. At most ``len(buffer)`` bytes are
+        read, so the whole file is never held in memory as one string::
+
+            data = bytearray(document.file.length)
+            document.file.readinto(data)
+
+        .. versionadded:: 0.5
+        """
+        size = len(buffer)
+        position = 0
+        for data in self.chunks():
+            if position >= size:
+                break
+            if len(data) > size - position:
+                data = data[:size - position]
+            buffer[position:position + len(data)] = data
+            position += len(data)
+        return position
+
+    def write_to(self, file):
+        """Write the file's contents to a file-like object (or a writable
+        :class:`mmap.mmap`) one chunk at a time, and return the number of
+        bytes written.
+
+        .. versionadded:: 0.5
+        """
+        written = 0
+        for data in self.chunks():
+            file.write(data)
+            written += len(data)
+        return written
+
     def delete(self):
         # Delete file from GridFS, FileField still remains
         self.fs.delete(self.grid_id)
@@ -680,6 +934,8 @@ class FileField(BaseField):
         if instance is None:
             return self
 
+        self._load_if_missing(instance)
+
         # Check if a file already exists for this model
         grid_file = instance._data.get(self.name)
         self.grid_file = grid_file
@@ -0,0 +1,1770 @@
+"""An in-process stand-in for the parts of PyMongo that MongoEngine uses.
+
+The classes in this module mimic :class:`~pymongo.connection.Connection`,
+:class:`~pymongo.database.Database`, :class:`~pymongo.collection.Collection`
+and :class:`~pymongo.cursor.Cursor` closely enough for
+:class:`~mongoengine.queryset.QuerySet` and :class:`~mongoengine.Document` to
+run against them unchanged. Documents are stored BSON-encoded so values round
+trip exactly as they would through a real server, and indexes (including
+unique and compound ones) are maintained in memory and used to answer
+equality and ``$in`` lookups without scanning the whole collection.
+
+Select the backend by passing ``backend='memory'`` to
+:func:`~mongoengine.connect`. Connections made with the same ``host`` and
+``port`` share data, just like connections to the same server; nothing is
+shared between processes.
+
+.. versionadded:: 0.5
+"""
+import re
+import math
+import time
+import datetime
+import itertools
+import threading
+
+import pymongo
+import pymongo.code
+import pymongo.dbref
+import pymongo.objectid
+from pymongo.errors import (OperationFailure, DuplicateKeyError,
+                            CollectionInvalid, InvalidOperation)
+
+try:
+    import bson
+    from bson.son import SON
+except ImportError:
+    # PyMongo < 1.9 ships the BSON module inside the pymongo package
+    from pymongo import bson
+    from pymongo.son import SON
+
+from collections import OrderedDict
+
+__all__ = ['MemoryConnection', 'MemoryDatabase', 'MemoryCollection',
+           'MemoryCursor']
+
+
+RE_TYPE = type(re.compile(''))
+
+# The number of documents the server returns in the first batch of a query
+# when no batch size is given, and the byte limit used for later batches
+DEFAULT_FIRST_BATCH = 101
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+
+# How long a getMore on an await_data cursor waits for new documents
+AWAIT_DATA_SECONDS = 1.0
+
+# The default number of results returned by a $near query
+DEFAULT_NEAR_LIMIT = 100
+
+# Servers (keyed by host and port) that MemoryConnection objects attach to
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def _type_rank(value):
+    """Return the position of the value's type in MongoDB's cross-type sort
+    order.
+    """
+    if value is None:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, long, float)):
+        return 2
+    if isinstance(value, pymongo.binary.Binary):
+        return 6
+    if isinstance(value, basestring):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, pymongo.objectid.ObjectId):
+        return 7
+    if isinstance(value, datetime.datetime):
+        return 9
+    if isinstance(value, RE_TYPE):
+        return 10
+    return 11
+
+
+def _sort_key(value):
+    """Build a key that orders values the way MongoDB does.
+    """
+    rank = _type_rank(value)
+    if rank == 4:
+        return (rank, tuple((k, _sort_key(v)) for k, v in value.items()))
+    if rank == 5:
+        return (rank, tuple(_sort_key(v) for v in value))
+    if rank == 10:
+        return (rank, value.pattern)
+    return (rank, value)
+
+
+def _hashable(value):
+    """Convert a BSON value into something that can be used as a dict key.
+    """
+    if isinstance(value, dict):
+        return ('__dict__',) + tuple((k, _hashable(v))
+                                     for k, v in sorted(value.items()))
+    if isinstance(value, list):
+        return ('__list__',) + tuple(_hashable(v) for v in value)
+    if isinstance(value, RE_TYPE):
+        return ('__re__', value.pattern, value.flags)
+    return value
+
+
+def _lookup(doc, path):
+    """Return every value found at the dotted ``path`` in ``doc``, descending
+    into embedded documents held in arrays along the way.
+    """
+    values = [doc]
+    for part in path.split('.'):
+        found = []
+        for value in values:
+            if isinstance(value, dict):
+                if part in value:
+                    found.append(value[part])
+            elif isinstance(value, list):
+                if part.isdigit() and int(part) < len(value):
+                    found.append(value[int(part)])
+                for item in value:
+                    if isinstance(item, dict) and part in item:
+                        found.append(item[part])
+        values = found
+    return values
+
+
+def _expand(values):
+    """Yield each value together with the items of any arrays, as a query
+    condition on an array field matches either the array or one of its items.
+    """
+    for value in values:
+        yield value
+        if isinstance(value, list):
+            for item in value:
+                yield item
+
+
+def _equal(value, target):
+    if isinstance(value, bool) != isinstance(target, bool):
+        return False
+    return _type_rank(value) == _type_rank(target) and value == target
+
+
+def _compare(value, target):
+    """Compare two values of the same type class, returning ``None`` when
+    MongoDB would consider them incomparable.
+    """
+    if _type_rank(value) != _type_rank(target) or isinstance(target, RE_TYPE):
+        return None
+    return cmp(_sort_key(value), _sort_key(target))
+
+
+def _is_operator_dict(value):
+    return (isinstance(value, dict) and bool(value) and
+            all(isinstance(k, basestring) and k.startswith('$')
+                for k in value))
+
+
+def _eq(values, target):
+    if isinstance(target, RE_TYPE):
+        return any(isinstance(v, basestring) and target.search(v)
+                   for v in _expand(values))
+    if target is None and not values:
+        return True
+    return any(_equal(v, target) for v in _expand(values))
+
+
+def _distance(point, center):
+    return math.sqrt((point[0] - center[0]) ** 2 + (point[1] - center[1]) ** 2)
+
+
+def _is_point(value):
+    return (isinstance(value, list) and len(value) == 2 and
+            all(isinstance(v, (int, long, float)) for v in value))
+
+
+def _match_within(values, shape):
+    points = [v for v in values if _is_point(v)]
+    if '$center' in shape:
+        center, radius = shape['$center']
+        return any(_distance(p, center) <= radius for p in points)
+    if '$box' in shape:
+        (x1, y1), (x2, y2) = shape['$box']
+        return any(min(x1, x2) <= p[0] <= max(x1, x2) and
+                   min(y1, y2) <= p[1] <= max(y1, y2) for p in points)
+    raise OperationFailure('unsupported $within shape %r' % shape)
+
+
+def _match_element(item, condition):
+    """Match a single array item against an ``$elemMatch`` condition.
+    """
+    if isinstance(item, dict) and not _is_operator_dict(condition):
+        return _match(item, condition)
+    return _match_value([item], condition)
+
+
+def _match_operator(values, op, arg, condition):
+    if op == '$ne':
+        return not _eq(values, arg)
+    if op in ('$gt', '$gte', '$lt', '$lte'):
+        for value in _expand(values):
+            result = _compare(value, arg)
+            if result is None:
+                continue
+            if ((op == '$gt' and result > 0) or
+                (op == '$gte' and result >= 0) or
+                (op == '$lt' and result < 0) or
+                (op == '$lte' and result <= 0)):
+                return True
+        return False
+    if op == '$in':
+        return any(_eq(values, target) for target in arg)
+    if op == '$nin':
+        return not any(_eq(values, target) for target in arg)
+    if op == '$all':
+        return all(_eq(values, target) for target in arg)
+    if op == '$size':
+        return any(isinstance(v, list) and len(v) == arg for v in values)
+    if op == '$exists':
+        return bool(values) == bool(arg)
+    if op == '$mod':
+        divisor, remainder = arg
+        return any(isinstance(v, (int, long, float)) and
+                   not isinstance(v, bool) and v % divisor == remainder
+                   for v in _expand(values))
+    if op == '$not':
+        return not _match_value(values, arg)
+    if op == '$regex':
+        flags = 0
+        for flag in condition.get('$options', ''):
+            flags |= {'i': re.I, 'm': re.M, 's': re.S, 'x': re.X}.get(flag, 0)
+        return _eq(values, re.compile(arg, flags))
+    if op == '$options':
+        return True
+    if op == '$elemMatch':
+        return any(isinstance(v, list) and
+                   any(_match_element(item, arg) for item in v)
+                   for v in values)
+    if op == '$within':
+        return _match_within(values, arg)
+    if op == '$near':
+        points = [v for v in values if _is_point(v)]
+        if not points:
+            return False
+        max_distance = condition.get('$maxDistance')
+        if max_distance is None:
+            return True
+        return any(_distance(p, arg) <= max_distance for p in points)
+    if op == '$maxDistance':
+        return True
+    if op == '$type':
+        return any(_type_rank(v) == _type_rank(arg) for v in values)
+    raise OperationFailure('invalid operator: %s' % op)
+
+
+def _match_value(values, condition):
+    if _is_operator_dict(condition):
+        return all(_match_operator(values, op, arg, condition)
+                   for op, arg in condition.items())
+    return _eq(values, condition)
+
+
+def _match(doc, spec):
+    """Return ``True`` if ``doc`` satisfies the query ``spec``.
+    """
+    for key, condition in spec.items():
+        if key == '$or':
+            if not any(_match(doc, clause) for clause in condition):
+                return False
+        elif key == '$nor':
+            if any(_match(doc, clause) for clause in condition):
+                return False
+        elif key == '$and':
+            if not all(_match(doc, clause) for clause in condition):
+                return False
+        elif key == '$where':
+            if not callable(condition):
+                raise OperationFailure('$where clauses require a JavaScript '
+                                       'engine, which the in-memory backend '
+                                       'does not provide')
+            if not condition(doc):
+                return False
+        elif not _match_value(_lookup(doc, key), condition):
+            return False
+    return True
+
+
+def _near_condition(spec):
+    """Find a ``$near`` condition in a query, returning the field and point.
+    """
+    for key, condition in spec.items():
+        if isinstance(condition, dict) and '$near' in condition:
+            return key, condition['$near']
+    return None, None
+
+
+def _split(path):
+    return path.split('.')
+
+
+def _get_path(doc, path):
+    """Return the single value stored at ``path`` (no array expansion).
+    """
+    value = doc
+    for part in _split(path):
+        if isinstance(value, dict):
+            if part not in value:
+                return None
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit():
+            if int(part) >= len(value):
+                return None
+            value = value[int(part)]
+        else:
+            return None
+    return value
+
+
+def _container(doc, path, create=True):
+    """Walk to the parent of the last element of ``path``, creating embedded
+    documents as needed. Returns the container and the final key.
+    """
+    parts = _split(path)
+    value = doc
+    for part in parts[:-1]:
+        if isinstance(value, list):
+            if not part.isdigit():
+                raise OperationFailure("can't append to array using string "
+                                       "field name [%s]" % part)
+            index = int(part)
+            while create and len(value) <= index:
+                value.append(None)
+            if value[index] is None and create:
+                value[index] = {}
+            value = value[index]
+        elif isinstance(value, dict):
+            if part not in value:
+                if not create:
+                    return None, None
+                value[part] = {}
+            value = value[part]
+        else:
+            raise OperationFailure('cannot traverse into non-document field '
+                                   '%s' % path)
+    key = parts[-1]
+    if isinstance(value, list):
+        if not key.isdigit():
+            raise OperationFailure("can't append to array using string field "
+                                   "name [%s]" % key)
+        key = int(key)
+        while create and len(value) <= key:
+            value.append(None)
+    return value, key
+
+
+def _set_path(doc, path, value):
+    container, key = _container(doc, path)
+    container[key] = value
+
+
+def _get_array(doc, path, op):
+    container, key = _container(doc, path)
+    if isinstance(container, dict) and key not in container:
+        container[key] = []
+    elif isinstance(container, list) and container[key] is None:
+        container[key] = []
+    array = container[key]
+    if not isinstance(array, list):
+        raise OperationFailure('Cannot apply %s modifier to non-array' % op)
+    return array
+
+
+def _update_set(doc, path, arg):
+    _set_path(doc, path, arg)
+
+
+def _update_unset(doc, path, arg):
+    container, key = _container(doc, path, create=False)
+    if isinstance(container, dict):
+        container.pop(key, None)
+    elif isinstance(container, list) and key < len(container):
+        container[key] = None
+
+
+def _update_inc(doc, path, arg):
+    container, key = _container(doc, path)
+    if isinstance(container, dict):
+        current = container.get(key, 0)
+    else:
+        current = container[key] or 0
+    if (not isinstance(current, (int, long, float)) or
+        isinstance(current, bool)):
+        raise OperationFailure('Cannot apply $inc modifier to non-number')
+    container[key] = current + arg
+
+
+def _update_push(doc, path, arg):
+    array = _get_array(doc, path, '$push')
+    if not (isinstance(arg, dict) and '$each' in arg):
+        array.append(arg)
+        return
+
+    items = list(arg['$each'])
+    position = arg.get('$position')
+    if position is None:
+        array.extend(items)
+    else:
+        array[position:position] = items
+
+    if '$sort' in arg:
+        ordering = arg['$sort']
+        if isinstance(ordering, dict):
+            for field, direction in reversed(ordering.items()):
+                array.sort(key=lambda item: _sort_key(_get_path(item, field)),
+                           reverse=direction < 0)
+        else:
+            array.sort(key=_sort_key, reverse=ordering < 0)
+
+    if '$slice' in arg:
+        limit = arg['$slice']
+        if limit >= 0:
+            del array[limit:]
+        else:
+            del array[:limit]
+
+
+def _update_push_all(doc, path, arg):
+    _get_array(doc, path, '$pushAll').extend(arg)
+
+
+def _update_add_to_set(doc, path, arg):
+    array = _get_array(doc, path, '$addToSet')
+    items = arg['$each'] if isinstance(arg, dict) and '$each' in arg else [arg]
+    for item in items:
+        if not any(_equal(existing, item) for existing in array):
+            array.append(item)
+
+
+def _update_pop(doc, path, arg):
+    array = _get_array(doc, path, '$pop')
+    if array:
+        if arg < 0:
+            array.pop(0)
+        else:
+            array.pop()
+
+
+def _update_pull(doc, path, arg):
+    array = _get_array(doc, path, '$pull')
+    if isinstance(arg, dict):
+        array[:] = [item for item in array
+                    if not _match_element(item, arg)]
+    else:
+        array[:] = [item for item in array if not _eq([item], arg)]
+
+
+def _update_pull_all(doc, path, arg):
+    array = _get_array(doc, path, '$pullAll')
+    array[:] = [item for item in array
+                if not any(_equal(item, target) for target in arg)]
+
+
+def _update_rename(doc, path, arg):
+    container, key = _container(doc, path, create=False)
+    if isinstance(container, dict) and key in container:
+        _set_path(doc, arg, container.pop(key))
+
+
+_UPDATE_OPERATORS = {
+    '$set': _update_set,
+    '$unset': _update_unset,
+    '$inc': _update_inc,
+    '$push': _update_push,
+    '$pushAll': _update_push_all,
+    '$addToSet': _update_add_to_set,
+    '$pop': _update_pop,
+    '$pull': _update_pull,
+    '$pullAll': _update_pull_all,
+    '$rename': _update_rename,
+}
+
+
+def _positional_index(doc, spec, prefix):
+    """Find the index of the first item of the array at ``prefix`` that was
+    matched by the query, for use with the positional ``$`` operator.
+    """
+    array = _get_path(doc, prefix)
+    if not isinstance(array, list):
+        raise OperationFailure("can't use the positional operator on a "
+                               "non-array field")
+    conditions = []
+    for key, condition in spec.items():
+        if key == prefix:
+            conditions.append((None, condition))
+        elif key.startswith(prefix + '.'):
+            conditions.append((key[len(prefix) + 1:], condition))
+    for index, item in enumerate(array):
+        matched = True
+        for subpath, condition in conditions:
+            if subpath is None:
+                values = [item]
+            elif isinstance(item, dict):
+                values = _lookup(item, subpath)
+            else:
+                values = []
+            if not _match_value(values, condition):
+                matched = False
+                break
+        if matched and conditions:
+            return index
+    raise OperationFailure('the positional operator did not find the match '
+                           'needed from the query')
+
+
+def _overlaps(path, other):
+    return (path == other or path.startswith(other + '.') or
+            other.startswith(path + '.'))
+
+
+def _check_renames(update):
+    """Raise :class:`OperationFailure` if the sources or targets of the
+    ``$rename`` modifiers of an update overlap each other or any other path
+    the update modifies, as the server does, since renames would otherwise
+    depend on the order in which they are applied.
+    """
+    renames = update.get('$rename') or {}
+    paths = []
+    for op, args in update.items():
+        if op != '$rename':
+            paths.extend(args)
+    for source, target in renames.items():
+        if not isinstance(target, basestring) or source == target:
+            raise OperationFailure('$rename target must be a string that '
+                                   'differs from its source')
+        for path in (source, target):
+            if any(_overlaps(path, other) for other in paths):
+                raise OperationFailure("conflicting mods in update: "
+                                       "can't rename %s" % source)
+            paths.append(path)
+
+
+def _apply_update(doc, update, spec):
+    """Apply an update document to ``doc`` in place, returning the (possibly
+    replaced) document.
+    """
+    if not any(key.startswith('$') for key in update):
+        new_doc = dict(update)
+        if '_id' in doc:
+            new_doc['_id'] = doc['_id']
+        return new_doc
+
+    _check_renames(update)
+    for op, args in update.items():
+        try:
+            handler = _UPDATE_OPERATORS[op]
+        except KeyError:
+            raise OperationFailure('Invalid modifier specified %s' % op)
+        for path, arg in args.items():
+            if '.$' in path:
+                prefix, rest = path.split('.$', 1)
+                index = _positional_index(doc, spec, prefix)
+                path = '%s.%d%s' % (prefix, index, rest)
+            handler(doc, path, arg)
+    return doc
+
+
+def _upsert_document(spec):
+    """Build the base document for an upsert from the equality conditions of
+    a query.
+    """
+    doc = {}
+    for key, value in spec.items():
+        if key.startswith('$') or _is_operator_dict(value):
+            continue
+        if isinstance(value, RE_TYPE):
+            continue
+        _set_path(doc, key, value)
+    return doc
+
+
+def _slice(array, arg):
+    if isinstance(arg, (list, tuple)):
+        skip, limit = arg
+        if skip < 0:
+            skip = max(len(array) + skip, 0)
+        return array[skip:skip + limit]
+    if arg < 0:
+        return array[arg:]
+    return array[:arg]
+
+
+def _include_path(source, target, parts):
+    """Copy the value at ``parts`` from ``source`` into ``target``.
+    """
+    key = parts[0]
+    if key not in source:
+        return
+    value = source[key]
+    if len(parts) == 1:
+        target[key] = value
+    elif isinstance(value, dict):
+        _include_path(value, target.setdefault(key, {}), parts[1:])
+    elif isinstance(value, list):
+        existing = target.get(key)
+        items = []
+        for i, item in enumerate(value):
+            if isinstance(item, dict):
+                sub = existing[i] if existing else {}
+                _include_path(item, sub, parts[1:])
+                items.append(sub)
+        target[key] = items
+
+
+def _exclude_path(doc, parts):
+    key = parts[0]
+    if key not in doc:
+        return
+    if len(parts) == 1:
+        del doc[key]
+    elif isinstance(doc[key], dict):
+        _exclude_path(doc[key], parts[1:])
+    elif isinstance(doc[key], list):
+        for item in doc[key]:
+            if isinstance(item, dict):
+                _exclude_path(item, parts[1:])
+
+
+def _project(doc, fields):
+    """Apply a field specification to a freshly decoded document.
+    """
+    if not fields:
+        return doc
+    if not isinstance(fields, dict):
+        fields = dict((field, 1) for field in fields)
+
+    includes, excludes, operators = [], [], []
+    for field, spec in fields.items():
+        if isinstance(spec, dict):
+            operators.append((field, spec))
+        elif spec:
+            includes.append(field)
+        elif field != '_id':
+            excludes.append(field)
+    # $elemMatch projections behave like inclusions
+    includes += [field for field, spec in operators if '$elemMatch' in spec]
+
+    if includes and excludes:
+        raise OperationFailure('You cannot currently mix including and '
+                               'excluding fields. Contact us if this is an '
+                               'issue.')
+
+    if includes:
+        result = {}
+        if '_id' in doc and fields.get('_id', 1):
+            result['_id'] = doc['_id']
+        for field in includes:
+            _include_path(doc, result, _split(field))
+    else:
+        result = doc
+        if not fields.get('_id', 1):
+            result.pop('_id', None)
+        for field in excludes:
+            _exclude_path(result, _split(field))
+
+    for field, spec in operators:
+        array = _get_path(doc, field)
+        if not isinstance(array, list):
+            continue
+        if '$slice' in spec:
+            _set_path(result, field, _slice(array, spec['$slice']))
+        if '$elemMatch' in spec:
+            matched = [item for item in array
+                       if _match_element(item, spec['$elemMatch'])]
+            if matched:
+                _set_path(result, field, matched[:1])
+            else:
+                _exclude_path(result, _split(field))
+    return result
+
+
+def _index_name(keys):
+    return u'_'.join([u'%s_%s' % item for item in keys])
+
+
+def _index_keys(key_or_list, direction=None):
+    if isinstance(key_or_list, basestring):
+        return [(key_or_list, direction or pymongo.ASCENDING)]
+    return list(key_or_list)
+
+
+class _Record(object):
+    """A stored document: the BSON data handed out to readers, the decoded
+    form used for matching and the insertion sequence number used by tailable
+    cursors.
+    """
+
+    __slots__ = ('data', 'doc', 'seq')
+
+    def __init__(self, data, doc, seq):
+        self.data = data
+        self.doc = doc
+        self.seq = seq
+
+
+class _MemoryIndex(object):
+    """An in-memory B-tree stand-in. Keys are kept in one hash table per
+    prefix length so that equality and ``$in`` lookups on any prefix of a
+    compound index are answered without scanning the collection.
+    """
+
+    def __init__(self, name, keys, unique=False, sparse=False):
+        self.name = name
+        self.keys = keys
+        self.fields = [field for field, direction in keys]
+        self.unique = unique
+        self.sparse = sparse
+        self.geo = any(direction == pymongo.GEO2D for f, direction in keys)
+        self.prefixes = [{} for key in keys]
+
+    def _doc_keys(self, doc):
+        """Generate every index key for a document; array values produce one
+        key per item (a multikey index).
+        """
+        per_field = []
+        for field in self.fields:
+            values = _lookup(doc, field)
+            if not values:
+                if self.sparse:
+                    return []
+                values = [None]
+            expanded = []
+            for value in values:
+                if isinstance(value, list) and value and not self.geo:
+                    expanded.extend(value)
+                else:
+                    expanded.append(value)
+            per_field.append(set(_hashable(v) for v in expanded))
+        return set(itertools.product(*per_field))
+
+    def check(self, key, doc):
+        """Raise :class:`~pymongo.errors.DuplicateKeyError` if adding ``doc``
+        would violate this index's uniqueness constraint.
+        """
+        if not self.unique or self.geo:
+            return
+        full = self.prefixes[-1]
+        for index_key in self._doc_keys(doc):
+            owners = full.get(index_key, ())
+            if owners and (len(owners) > 1 or key not in owners):
+                raise DuplicateKeyError(
+                    'E11000 duplicate key error index: %s  dup key: { %s }'
+                    % (self.name, ', '.join(': %r' % v for v in index_key)))
+
+    def add(self, key, doc):
+        if self.geo:
+            return
+        for index_key in self._doc_keys(doc):
+            for i, prefix in enumerate(self.prefixes):
+                prefix.setdefault(index_key[:i + 1], set()).add(key)
+
+    def remove(self, key, doc):
+        if self.geo:
+            return
+        for index_key in self._doc_keys(doc):
+            for i, prefix in enumerate(self.prefixes):
+                owners = prefix.get(index_key[:i + 1])
+                if owners is not None:
+                    owners.discard(key)
+                    if not owners:
+                        del prefix[index_key[:i + 1]]
+
+    def candidates(self, spec):
+        """Return the record keys that may match ``spec``, or ``None`` if the
+        index cannot narrow the query down.
+        """
+        if self.geo:
+            return None
+        allowed = []
+        for field in self.fields:
+            if field not in spec:
+                break
+            condition = spec[field]
+            if isinstance(condition, dict) and list(condition) == ['$in']:
+                values = condition['$in']
+            elif (_is_operator_dict(condition) or
+                  isinstance(condition, (list, RE_TYPE))):
+                break
+            else:
+                values = [condition]
+            if any(isinstance(v, (list, dict, RE_TYPE)) for v in values):
+                break
+            allowed.append(set(_hashable(v) for v in values))
+        if not allowed:
+            return None
+
+        prefix = self.prefixes[len(allowed) - 1]
+        keys = set()
+        for index_key in itertools.product(*allowed):
+            keys.update(prefix.get(index_key, ()))
+        return keys, len(allowed)
+
+
+class MemoryCursor(object):
+    """A cursor over the results of a query on a
+    :class:`~mongoengine.memory.MemoryCollection`, mirroring
+    :class:`~pymongo.cursor.Cursor`.
+    """
+
+    def __init__(self, collection, spec=None, fields=None, skip=0, limit=0,
+                 timeout=True, snapshot=False, tailable=False, sort=None,
+                 max_scan=None, as_class=None, await_data=False, **kwargs):
+        if spec is None:
+            spec = {}
+        if not isinstance(spec, dict):
+            raise TypeError('spec must be an instance of dict')
+        if fields is not None and not isinstance(fields, dict):
+            fields = dict((field, 1) for field in fields) or {'_id': 1}
+
+        self.__collection = collection
+        self.__spec = spec
+        self.__fields = fields
+        self.__skip = skip
+        self.__limit = limit
+        self.__batch_size = 0
+        self.__timeout = timeout
+        self.__snapshot = snapshot
+        self.__tailable = tailable
+        self.__await_data = await_data
+        self.__ordering = sort and _index_keys(sort) or None
+        self.__hint = None
+        self.__where = None
+        self.__as_class = as_class
+        self.__empty = False
+        self.__reset()
+
+    def __reset(self):
+        self.__results = None
+        self.__position = 0
+        self.__data = []
+        self.__retrieved = 0
+        self.__batches = 0
+        self.__last_seq = None
+        self.__killed = False
+
+    @property
+    def collection(self):
+        return self.__collection
+
+    def rewind(self):
+        """Rewind this cursor to its unevaluated state.
+        """
+        self.__reset()
+        return self
+
+    def clone(self):
+        """Get an unevaluated copy of this cursor.
+        """
+        copy = MemoryCursor(self.__collection, self.__spec, self.__fields,
+                            self.__skip, self.__limit, self.__timeout,
+                            self.__snapshot, self.__tailable,
+                            as_class=self.__as_class,
+                            await_data=self.__await_data)
+        copy.__ordering = self.__ordering
+        copy.__hint = self.__hint
+        copy.__where = self.__where
+        copy.__batch_size = self.__batch_size
+        return copy
+
+    def close(self):
+        self.__killed = True
+        self.__data = []
+
+    def __check_okay_to_chain(self):
+        if self.__results is not None:
+            raise InvalidOperation('cannot set options after executing query')
+
+    def limit(self, limit):
+        if not isinstance(limit, (int, long)):
+            raise TypeError('limit must be an int')
+        self.__check_okay_to_chain()
+        self.__empty = False
+        self.__limit = limit
+        return self
+
+    def batch_size(self, batch_size):
+        if not isinstance(batch_size, (int, long)):
+            raise TypeError('batch_size must be an int')
+        if batch_size < 0:
+            raise ValueError('batch_size must be >= 0')
+        self.__check_okay_to_chain()
+        self.__batch_size = batch_size == 1 and 2 or batch_size
+        return self
+
+    def skip(self, skip):
+        if not isinstance(skip, (int, long)):
+            raise TypeError('skip must be an int')
+        self.__check_okay_to_chain()
+        self.__skip = skip
+        return self
+
+    def sort(self, key_or_list, direction=None):
+        self.__check_okay_to_chain()
+        self.__ordering = _index_keys(key_or_list, direction) or None
+        return self
+
+    def hint(self, index):
+        self.__check_okay_to_chain()
+        if index is None or isinstance(index, basestring):
+            self.__hint = index
+        else:
+            self.__hint = _index_name(_index_keys(index))
+        return self
+
+    def where(self, code):
+        """Add a ``$where`` clause. Only Python callables, which are passed
+        each decoded document, can be evaluated by the in-memory backend.
+        """
+        self.__check_okay_to_chain()
+        self.__where = code
+        return self
+
+    def __getitem__(self, index):
+        self.__check_okay_to_chain()
+        self.__empty = False
+        if isinstance(index, slice):
+            if index.step is not None:
+                raise IndexError('Cursor instances do not support slice steps')
+            skip = 0
+            if index.start is not None:
+                if index.start < 0:
+                    raise IndexError('Cursor instances do not support '
+                                     'negative indices')
+                skip = index.start
+            if index.stop is not None:
+                limit = index.stop - skip
+                if limit < 0:
+                    raise IndexError('stop index must be greater than start '
+                                     'index for slice %r' % index)
+                if limit == 0:
+                    self.__empty = True
+            else:
+                limit = 0
+            self.__skip = skip
+            self.__limit = limit
+            return self
+
+        if isinstance(index, (int, long)):
+            if index < 0:
+                raise IndexError('Cursor instances do not support negative '
+                                 'indices')
+            clone = self.clone()
+            clone.skip(index + self.__skip)
+            clone.limit(-1)
+            for doc in clone:
+                return doc
+            raise IndexError('no such item for Cursor instance')
+        raise TypeError('index %r cannot be applied to Cursor '
+                        'instances' % index)
+
+    def __spec_with_where(self):
+        if self.__where is None:
+            return self.__spec
+        spec = dict(self.__spec)
+        spec['$where'] = self.__where
+        return spec
+
+    def __plan(self):
+        """Run the query, returning the matching records (before skip and
+        limit are applied) and the plan that was used.
+        """
+        return self.__collection._execute(self.__spec_with_where(),
+                                          self.__ordering, self.__hint)
+
+    def __window(self, records):
+        limit = abs(self.__limit)
+        records = records[self.__skip:]
+        if limit:
+            records = records[:limit]
+        return records
+
+    def count(self, with_limit_and_skip=False):
+        self.__collection.database.connection._round_trip()
+        records, plan = self.__plan()
+        if with_limit_and_skip:
+            records = self.__window(records)
+        return len(records)
+
+    def distinct(self, key):
+        if not isinstance(key, basestring):
+            raise TypeError('key must be an instance of basestring')
+        return self.__collection._distinct(key, self.__spec_with_where())
+
+    def explain(self):
+        """Return an explain record describing how the query was answered.
+        """
+        started = time.time()
+        records, plan = self.__plan()
+        n = len(self.__window(records))
+        covered = False
+        if plan['index'] is not None and self.__fields:
+            # _id is returned unless it is excluded
+            projected = set(f for f, v in self.__fields.items() if v)
+            if self.__fields.get('_id', 1):
+                projected.add('_id')
+            # Projections that only exclude fields return the rest
+            covered = (any(self.__fields.values()) and
+                       projected <= set(plan['index'].fields))
+        return {
+            'cursor': plan['cursor'],
+            'nscanned': plan['nscanned'],
+            'nscannedObjects': plan['nscanned'],
+            'n': n,
+            'scanAndOrder': plan['scanAndOrder'],
+            'indexOnly': covered,
+            'millis': int((time.time() - started) * 1000),
+            'indexBounds': plan['indexBounds'],
+            'allPlans': [{'cursor': plan['cursor'],
+                          'indexBounds': plan['indexBounds']}],
+        }
+
+    def __refresh(self):
+        """Fetch the next batch of documents, as a getMore would.
+        """
+        if self.__killed:
+            return 0
+        collection = self.__collection
+        collection.database.connection._round_trip()
+
+        if self.__results is None:
+            records, plan = self.__plan()
+            self.__results = self.__window(records)
+            self.__position = 0
+        elif self.__tailable and self.__position >= len(self.__results):
+            # Pick up documents inserted since the last batch, waiting a
+            # while for some to arrive if the cursor awaits data
+            deadline = time.time() + AWAIT_DATA_SECONDS
+            while True:
+                self.__results = collection._records_after(
+                    self.__last_seq, self.__spec_with_where())
+                if (self.__results or not self.__await_data or
+                    not collection._capped or time.time() >= deadline):
+                    break
+                time.sleep(0.005)
+            self.__position = 0
+
+        remaining = len(self.__results) - self.__position
+        if self.__limit < 0 and self.__batches:
+            remaining = 0
+        if remaining <= 0:
+            if not self.__tailable or not collection._capped:
+                self.__killed = True
+            return 0
+
+        if self.__batch_size:
+            count = self.__batch_size
+        elif not self.__batches:
+            count = DEFAULT_FIRST_BATCH
+        else:
+            count, size = 0, 0
+            for record in self.__results[self.__position:]:
+                size += len(record.data)
+                if count and size > MAX_BATCH_BYTES:
+                    break
+                count += 1
+        if self.__limit < 0:
+            count = abs(self.__limit)
+
+        batch = self.__results[self.__position:self.__position + count]
+        self.__position += len(batch)
+        self.__batches += 1
+        self.__data = list(batch)
+        if batch:
+            self.__last_seq = batch[-1].seq
+        return len(batch)
+
+    @property
+    def alive(self):
+        return bool(len(self.__data) or not self.__killed)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.__empty:
+            raise StopIteration
+        if self.__data or self.__refresh():
+            record = self.__data.pop(0)
+            self.__retrieved += 1
+            as_class = (self.__as_class or
+                        self.__collection.database.connection.document_class)
+            doc = bson.BSON(record.data).decode(as_class=as_class)
+            return _project(doc, self.__fields)
+        raise StopIteration
+
+
+class MemoryCollection(object):
+    """An in-memory collection, mirroring
+    :class:`~pymongo.collection.Collection`.
+    """
+
+    def __init__(self, database, name, options=None):
+        self.__database = database
+        self.__name = unicode(name)
+        self.__full_name = u'%s.%s' % (database.name, self.__name)
+        self._lock = threading.RLock()
+        self._seq = 0
+        self._reset(options)
+
+    def _reset(self, options=None):
+        with self._lock:
+            self._options = dict(options or {})
+            self._capped = bool(self._options.get('capped'))
+            self._records = OrderedDict()
+            self._size = 0
+            self._indexes = {}
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def full_name(self):
+        return self.__full_name
+
+    @property
+    def database(self):
+        return self.__database
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.__database[u'%s.%s' % (self.__name, name)]
+
+    def __getitem__(self, name):
+        return self.__database[u'%s.%s' % (self.__name, name)]
+
+    def __repr__(self):
+        return 'MemoryCollection(%r, %r)' % (self.__database, self.__name)
+
+    def __eq__(self, other):
+        if isinstance(other, MemoryCollection):
+            return (self.__database, self.__name) == (other.database,
+                                                      other.name)
+        return NotImplemented
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.__full_name)
+
+    def options(self):
+        """Return the options this collection was created with.
+        """
+        return dict(self._options)
+
+    def _encode(self, doc, check_keys=False):
+        data = bson.BSON.encode(doc, check_keys)
+        return data, data.decode()
+
+    def _check_indexes(self, key, doc):
+        for index in self._indexes.values():
+            index.check(key, doc)
+
+    def _store(self, doc, check_keys=False):
+        """Store a new document, maintaining indexes and capped limits.
+        """
+        data, decoded = self._encode(doc, check_keys)
+        key = _hashable(decoded['_id'])
+        if key in self._records:
+            raise DuplicateKeyError('E11000 duplicate key error index: '
+                                    '%s.$_id_  dup key: { : %r }'
+                                    % (self.__full_name, decoded['_id']))
+        self._check_indexes(key, decoded)
+        self._seq += 1
+        self._records[key] = _Record(data, decoded, self._seq)
+        self._size += len(data)
+        for index in self._indexes.values():
+            index.add(key, decoded)
+        self.__database._created(self)
+        if self._capped:
+            self._trim()
+
+    def _replace(self, key, doc):
+        record = self._records[key]
+        data, decoded = self._encode(doc)
+        if _hashable(decoded.get('_id')) != key:
+            raise OperationFailure("cannot change _id of a document")
+        self._check_indexes(key, decoded)
+        if self._capped and len(data) != len(record.data):
+            raise OperationFailure('failing update: objects in a capped ns '
+                                   'cannot grow')
+        for index in self._indexes.values():
+            index.remove(key, record.doc)
+            index.add(key, decoded)
+        self._size += len(data) - len(record.data)
+        record.data, record.doc = data, decoded
+
+    def _discard(self, key):
+        record = self._records.pop(key)
+        self._size -= len(record.data)
+        for index in self._indexes.values():
+            index.remove(key, record.doc)
+
+    def _trim(self):
+        max_documents = self._options.get('max')
+        max_size = self._options.get('size')
+        while self._records and (
+            (max_documents and len(self._records) > max_documents) or
+            (max_size and self._size > max_size)):
+            self._discard(next(iter(self._records)))
+
+    def _plan_candidates(self, spec, hint=None):
+        """Pick the index that narrows ``spec`` down the most. Returns the
+        candidate record keys (``None`` for a full scan) and the index used.
+        """
+        if '_id' in spec:
+            condition = spec['_id']
+            values = None
+            if isinstance(condition, dict) and list(condition) == ['$in']:
+                values = condition['$in']
+            elif not (_is_operator_dict(condition) or
+                      isinstance(condition, RE_TYPE)):
+                values = [condition]
+            if values is not None:
+                keys = set(_hashable(v) for v in values)
+                return keys, None, '_id_'
+
+        best = None
+        for index in self._indexes.values():
+            if hint is not None and index.name != hint:
+                continue
+            result = index.candidates(spec)
+            if result is None:
+                continue
+            keys, used = result
+            if best is None or len(keys) < len(best[0]):
+                best = (keys, index)
+        if best is None:
+            return None, None, None
+        return best[0], best[1], best[1].name
+
+    def _sort_index(self, ordering):
+        """Find an index whose keys start with the requested ordering.
+        """
+        for index in self._indexes.values():
+            keys = index.keys[:len(ordering)]
+            if keys == ordering or keys == [(f, -d) for f, d in ordering]:
+                return index
+        return None
+
+    def _execute(self, spec, ordering=None, hint=None):
+        """Find the records matching ``spec`` in result order.
+        """
+        with self._lock:
+            candidates, index, name = self._plan_candidates(spec, hint)
+            if candidates is None:
+                scanned = self._records.values()
+            else:
+                scanned = [self._records[key] for key in candidates
+                           if key in self._records]
+                # Keep natural (insertion) order for unsorted results
+                scanned.sort(key=lambda record: record.seq)
+            records = [record for record in scanned
+                       if _match(record.doc, spec)]
+
+        scan_and_order = False
+        field, point = _near_condition(spec)
+        if field is not None and not ordering:
+            def distance(record):
+                points = [v for v in _lookup(record.doc, field)
+                          if _is_point(v)]
+                return min(_distance(p, point) for p in points)
+            records.sort(key=distance)
+            records = records[:DEFAULT_NEAR_LIMIT]
+        elif ordering:
+            for key, direction in reversed(ordering):
+                def sort_key(record, key=key):
+                    values = _lookup(record.doc, key)
+                    return _sort_key(values[0] if values else None)
+                records.sort(key=sort_key, reverse=direction < 0)
+            sort_index = self._sort_index(ordering)
+            scan_and_order = sort_index is None or (index is not None and
+                                                    sort_index is not index)
+            if index is None and sort_index is not None:
+                index, name = sort_index, sort_index.name
+
+        if name is None:
+            cursor, bounds = 'BasicCursor', {}
+        else:
+            cursor = 'BtreeCursor %s' % name
+            fields = index.fields if index is not None else ['_id']
+            bounds = dict((f, spec.get(f)) for f in fields if f in spec)
+        plan = {
+            'cursor': cursor,
+            'index': index,
+            'nscanned': len(scanned),
+            'scanAndOrder': scan_and_order,
+            'indexBounds': bounds,
+        }
+        return records, plan
+
+    def _records_after(self, seq, spec):
+        """Return records inserted after sequence number ``seq`` that match
+        ``spec``, in insertion order (used by tailable cursors).
+        """
+        with self._lock:
+            return [record for record in self._records.values()
+                    if (seq is None or record.seq > seq) and
+                    _match(record.doc, spec)]
+
+    def _distinct(self, key, spec=None):
+        records, plan = self._execute(spec or {})
+        values, seen = [], set()
+        for record in records:
+            for value in _expand(_lookup(record.doc, key)):
+                if isinstance(value, list):
+                    continue
+                hashed = _hashable(value)
+                if hashed not in seen:
+                    seen.add(hashed)
+                    values.append(value)
+        return values
+
+    def _status(self, n=0, **extra):
+        status = {'err': None, 'n': n, 'ok': 1.0}
+        status.update(extra)
+        return status
+
+    def _write(self, safe, kwargs, operation):
+        """Run a write, emulating unacknowledged writes by swallowing errors
+        unless ``safe`` is set.
+        """
+        self.__database.connection._round_trip()
+        if kwargs:
+            safe = True
+        try:
+            with self._lock:
+                result = operation()
+        except OperationFailure, err:
+            self.__database._last_error = unicode(err)
+            if safe:
+                raise
+            return None
+        self.__database._last_error = None
+        return result
+
+    def insert(self, doc_or_docs, manipulate=True, safe=False,
+               check_keys=True, **kwargs):
+        docs = doc_or_docs
+        return_one = isinstance(docs, dict)
+        if return_one:
+            docs = [docs]
+        docs = list(docs)
+        for doc in docs:
+            if not isinstance(doc, dict):
+                raise TypeError('cannot insert object of type %s' % type(doc))
+            if manipulate and '_id' not in doc:
+                doc['_id'] = pymongo.objectid.ObjectId()
+
+        def operation():
+            for doc in docs:
+                if '_id' not in doc:
+                    doc = dict(doc, _id=pymongo.objectid.ObjectId())
+                self._store(doc, check_keys)
+        self._write(safe, kwargs, operation)
+
+        ids = [doc.get('_id', None) for doc in docs]
+        return return_one and ids[0] or ids
+
+    def save(self, to_save, manipulate=True, safe=False, **kwargs):
+        if not isinstance(to_save, dict):
+            raise TypeError('cannot save object of type %s' % type(to_save))
+        if '_id' not in to_save:
+            return self.insert(to_save, manipulate, safe, **kwargs)
+        self.update({'_id': to_save['_id']}, to_save, True, manipulate, safe,
+                    **kwargs)
+        return to_save.get('_id', None)
+
+    def update(self, spec, document, upsert=False, manipulate=False,
+               safe=False, multi=False, **kwargs):
+        if not isinstance(spec, dict):
+            raise TypeError('spec must be an instance of dict')
+        if not isinstance(document, dict):
+            raise TypeError('document must be an instance of dict')
+        is_replacement = not any(k.startswith('$') for k in document)
+        if multi and is_replacement:
+            raise OperationFailure('multi update only works with $ operators')
+
+        def operation():
+            return self._update(spec, document, upsert, multi)
+        return self._write(safe, kwargs, operation)
+
+    def _update(self, spec, document, upsert=False, multi=False):
+        records, plan = self._execute(spec)
+        if not multi:
+            records = records[:1]
+        for record in records:
+            doc = bson.BSON(record.data).decode()
+            doc = _apply_update(doc, document, spec)
+            self._replace(_hashable(record.doc['_id']), doc)
+        if records or not upsert:
+            return self._status(len(records), updatedExisting=bool(records))
+
+        doc = _apply_update(_upsert_document(spec), document, spec)
+        if '_id' not in doc:
+            doc['_id'] = spec.get('_id', pymongo.objectid.ObjectId())
+            if _is_operator_dict(doc['_id']):
+                doc['_id'] = pymongo.objectid.ObjectId()
+        self._store(doc)
+        return self._status(1, updatedExisting=False, upserted=doc['_id'])
+
+    def remove(self, spec_or_id=None, safe=False, **kwargs):
+        spec = spec_or_id
+        if spec is None:
+            spec = {}
+        if not isinstance(spec, dict):
+            spec = {'_id': spec}
+
+        def operation():
+            if self._capped:
+                raise OperationFailure("can't remove from a capped collection")
+            records, plan = self._execute(spec)
+            for record in records:
+                self._discard(_hashable(record.doc['_id']))
+            return self._status(len(records))
+        return self._write(safe, kwargs, operation)
+
+    def find(self, *args, **kwargs):
+        return MemoryCursor(self, *args, **kwargs)
+
+    def find_one(self, spec_or_id=None, *args, **kwargs):
+        if spec_or_id is not None and not isinstance(spec_or_id, dict):
+            spec_or_id = {'_id': spec_or_id}
+        for result in self.find(spec_or_id, *args, **kwargs).limit(-1):
+            return result
+        return None
+
+    def count(self):
+        return self.find().count()
+
+    def distinct(self, key):
+        return self.find().distinct(key)
+
+    def create_index(self, key_or_list, deprecated_unique=None, ttl=None,
+                     **kwargs):
+        keys = _index_keys(key_or_list)
+        name = kwargs.get('name') or _index_name(keys)
+        unique = bool(kwargs.get('unique', deprecated_unique))
+        with self._lock:
+            if name in self._indexes:
+                return name
+            index = _MemoryIndex(u'%s.$%s' % (self.__full_name, name), keys,
+                                 unique=unique,
+                                 sparse=bool(kwargs.get('sparse')))
+            index.name = name
+            for key, record in self._records.items():
+                try:
+                    index.check(key, record.doc)
+                except DuplicateKeyError:
+                    if not kwargs.get('drop_dups'):
+                        raise
+                    self._discard(key)
+                    continue
+                index.add(key, record.doc)
+            self._indexes[name] = index
+            self.__database._created(self)
+        return name
+
+    def ensure_index(self, key_or_list, deprecated_unique=None, ttl=300,
+                     **kwargs):
+        return self.create_index(key_or_list, deprecated_unique, **kwargs)
+
+    def index_information(self):
+        info = {u'_id_': {'key': [(u'_id', 1)]}}
+        for name, index in self._indexes.items():
+            info[name] = {'key': list(index.keys)}
+            if index.unique:
+                info[name]['unique'] = True
+        return info
+
+    def drop_index(self, index_or_name):
+        name = index_or_name
+        if not isinstance(name, basestring):
+            name = _index_name(_index_keys(name))
+        with self._lock:
+            if name not in self._indexes:
+                raise OperationFailure('index not found')
+            del self._indexes[name]
+
+    def drop_indexes(self):
+        with self._lock:
+            self._indexes.clear()
+
+    def drop(self):
+        self.__database.drop_collection(self.__name)
+
+    def map_reduce(self, map, reduce, full_response=False, **kwargs):
+        raise OperationFailure('map/reduce requires a JavaScript engine, '
+                               'which the in-memory backend does not provide')
+
+    def _find_and_modify(self, query=None, update=None, sort=None,
+                         remove=False, new=False, fields=None, upsert=False):
+        query = query or {}
+        ordering = sort and _index_keys(sort.items()
+                                        if isinstance(sort, dict) else sort)
+        with self._lock:
+            records, plan = self._execute(query, ordering)
+            if not records:
+                if not upsert or remove:
+                    return None
+                status = self._update(query, update, upsert=True)
+                if not new:
+                    return None
+                return self.find_one({'_id': status['upserted']},
+                                     fields=fields)
+
+            record = records[0]
+            before = bson.BSON(record.data).decode()
+            key = _hashable(record.doc['_id'])
+            if remove:
+                self._discard(key)
+                return _project(before, fields)
+            doc = _apply_update(bson.BSON(record.data).decode(), update, query)
+            self._replace(key, doc)
+            if new:
+                return _project(bson.BSON(self._records[key].data).decode(),
+                                fields)
+            return _project(before, fields)
+
+
+class MemoryDatabase(object):
+    """An in-memory database mirroring :class:`~pymongo.database.Database`.
+    """
+
+    def __init__(self, connection, name):
+        self.__connection = connection
+        self.__name = unicode(name)
+        self._collections = {}
+        self._existing = set()
+        self._last_error = None
+        self._lock = threading.RLock()
+
+    @property
+    def connection(self):
+        return self.__connection
+
+    @property
+    def name(self):
+        return self.__name
+
+    def __repr__(self):
+        return 'MemoryDatabase(%r)' % self.__name
+
+    def __eq__(self, other):
+        if isinstance(other, MemoryDatabase):
+            return self.__name == other.name
+        return NotImplemented
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.__name)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        name = unicode(name)
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = MemoryCollection(self, name)
+            return self._collections[name]
+
+    def _created(self, collection):
+        self._existing.add(collection.name)
+
+    def collection_names(self):
+        names = sorted(self._existing)
+        if names:
+            names.append(u'system.indexes')
+        return names
+
+    def create_collection(self, name, options=None, **kwargs):
+        name = unicode(name)
+        opts = dict(options or {}, **kwargs)
+        with self._lock:
+            if name in self._existing:
+                raise CollectionInvalid('collection %s already exists' % name)
+            collection = self[name]
+            collection._reset(opts)
+            self._existing.add(name)
+        return collection
+
+    def drop_collection(self, name_or_collection):
+        name = name_or_collection
+        if isinstance(name, MemoryCollection):
+            name = name.name
+        name = unicode(name)
+        with self._lock:
+            # Collection objects are only handles on a name, so any that are
+            # still held elsewhere must see the collection as empty
+            if name in self._collections:
+                self._collections[name]._reset()
+            self._existing.discard(name)
+
+    def dereference(self, dbref):
+        if not isinstance(dbref, pymongo.dbref.DBRef):
+            raise TypeError('cannot dereference a %s' % type(dbref))
+        return self[dbref.collection].find_one({'_id': dbref.id})
+
+    def authenticate(self, name, password):
+        return True
+
+    def logout(self):
+        pass
+
+    def error(self):
+        if self._last_error:
+            return {'err': self._last_error}
+        return None
+
+    def eval(self, code, *args):
+        return self.command('$eval', code, args=args).get('retval', None)
+
+    def command(self, command, value=1, check=True, allowable_errors=[],
+                **kwargs):
+        """Run the subset of database commands the in-memory backend
+        understands: ``count``, ``distinct``, ``findandmodify``, ``ping``,
+        ``getlasterror`` and ``drop``.
+        """
+        if isinstance(command, basestring):
+            command = SON([(command, value)])
+        command = SON(command)
+        command.update(kwargs)
+        verb = command.keys()[0]
+        name = command[verb]
+        self.__connection._round_trip()
+
+        if verb.lower() == 'count':
+            cursor = self[name].find(command.get('query'),
+                                     skip=command.get('skip', 0),
+                                     limit=command.get('limit', 0))
+            return {'n': float(cursor.count(True)), 'ok': 1.0}
+        if verb == 'distinct':
+            values = self[name]._distinct(command['key'],
+                                          command.get('query'))
+            return {'values': values, 'ok': 1.0}
+        if verb.lower() == 'findandmodify':
+            value = self[name]._find_and_modify(
+                command.get('query'), command.get('update'),
+                command.get('sort'), command.get('remove', False),
+                command.get('new', False), command.get('fields'),
+                command.get('upsert', False))
+            return {'value': value, 'ok': 1.0}
+        if verb == 'ping':
+            return {'ok': 1.0}
+        if verb.lower() == 'getlasterror':
+            return {'err': self._last_error, 'n': 0, 'ok': 1.0}
+        if verb == 'drop':
+            self.drop_collection(name)
+            return {'ok': 1.0}
+        message = 'no such cmd: %s' % verb
+        if verb in ('$eval', 'mapreduce', 'group'):
+            message = ('%s requires a JavaScript engine, which the in-memory '
+                       'backend does not provide' % verb)
+        if check and message not in allowable_errors:
+            raise OperationFailure('command %r failed: %s'
+                                   % (command, message))
+        return {'errmsg': message, 'ok': 0.0}
+
+
+class _Server(object):
+    """The shared state behind every connection to one address.
+    """
+
+    def __init__(self):
+        self.databases = {}
+        self.lock = threading.Lock()
+        self.latency = 0
+        self.round_trips = 0
+
+
+class MemoryConnection(object):
+    """A connection to an in-process server, mirroring
+    :class:`~pymongo.connection.Connection`.
+
+    :param latency: seconds the server sleeps for every round trip (queries,
+        getMores, writes and commands), to simulate a remote server in
+        benchmarks; applies to every connection to the same address
+    """
+
+    def __init__(self, host=None, port=None, document_class=dict,
+                 tz_aware=False, latency=None, **kwargs):
+        self.host = host or 'localhost'
+        self.port = port or 27017
+        self.document_class = document_class
+        self.tz_aware = tz_aware
+        self.slave_okay = kwargs.get('slave_okay', False)
+        with _servers_lock:
+            self.__server = _servers.setdefault((self.host, self.port),
+                                                _Server())
+        if latency is not None:
+            self.__server.latency = latency
+
+    def __repr__(self):
+        return 'MemoryConnection(%r, %r)' % (self.host, self.port)
+
+    @property
+    def latency(self):
+        return self.__server.latency
+
+    @property
+    def round_trips(self):
+        """The number of round trips made to the server so far.
+        """
+        return self.__server.round_trips
+
+    def _round_trip(self):
+        server = self.__server
+        server.round_trips += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        server = self.__server
+        with server.lock:
+            if name not in server.databases:
+                server.databases[name] = MemoryDatabase(self, name)
+            return server.databases[name]
+
+    def database_names(self):
+        return sorted(name for name, db in self.__server.databases.items()
+                      if db.collection_names())
+
+    def drop_database(self, name_or_database):
+        name = name_or_database
+        if isinstance(name, MemoryDatabase):
+            name = name.name
+        with self.__server.lock:
+            self.__server.databases.pop(name, None)
+
+    def close_cursor(self, cursor_id):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def end_request(self):
+        pass
@@ -0,0 +1,708 @@
+"""Listeners notified of the operations MongoEngine sends to the database.
+
+Register a :class:`~mongoengine.monitoring.QueryListener` to be told about
+every query, write, command and dereference, with its collection, query,
+timing and the number of documents it returned::
+
+    from mongoengine import monitoring
+
+    stats = monitoring.QueryStats()
+    monitoring.register(stats)
+    ...
+    print stats.report()
+
+When no listeners are registered, operations are passed straight to the
+driver, so monitoring costs next to nothing when it isn't used.
+
+.. versionadded:: 0.5
+"""
+from connection import _get_db
+
+import os
+import sys
+import time
+import math
+import logging
+import warnings
+import threading
+import pymongo
+from collections import OrderedDict
+
+__all__ = ['QueryEvent', 'QueryListener', 'QueryStats', 'LatencyHistogram',
+           'DereferenceDetector', 'NPlusOneWarning', 'NPlusOneError',
+           'SlowQueryLog', 'register', 'unregister', 'log_slow_queries']
+
+
+# The registered listeners. The list is replaced rather than changed, so it
+# may be read without locking
+_listeners = []
+_listeners_lock = threading.Lock()
+
+
+def register(listener):
+    """Register a :class:`~mongoengine.monitoring.QueryListener`.
+    """
+    global _listeners
+    with _listeners_lock:
+        _listeners = _listeners + [listener]
+
+
+def unregister(listener):
+    """Unregister a previously registered
+    :class:`~mongoengine.monitoring.QueryListener`.
+    """
+    global _listeners
+    with _listeners_lock:
+        _listeners = [l for l in _listeners if l is not listener]
+
+
+class QueryEvent(object):
+    """An operation sent to the database.
+
+    :attr:`operation` is one of ``'find'``, ``'count'``, ``'distinct'``,
+    ``'insert'``, ``'save'``, ``'update'``, ``'remove'``,
+    ``'findandmodify'``, ``'map_reduce'``, ``'eval'`` and
+    ``'dereference'``. :attr:`duration` is the time (in seconds) spent
+    waiting on the driver, and :attr:`decode_time` the time spent turning
+    the results into documents. For finds, both are totalled over the
+    cursor's lifetime, and the event finishes once the cursor is exhausted,
+    rewound or closed; a cursor that is dropped before then isn't
+    reported. :attr:`error` holds the exception raised by the driver, if
+    any. For finds, :attr:`sort` is the sort specification, if any. For
+    dereferences, :attr:`source` is the :class:`~mongoengine.Document` class
+    and the name of the field that was dereferenced.
+    """
+
+    __slots__ = ('operation', 'collection', 'query', 'projection', 'sort',
+                 'source', 'started', 'duration', 'documents', 'decode_time',
+                 'error', '_finished')
+
+    def __init__(self, operation, collection, query=None, projection=None,
+                 source=None, sort=None):
+        self.operation = operation
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self.source = source
+        self.sort = sort
+        self.started = time.time()
+        self.duration = 0.0
+        self.documents = 0
+        self.decode_time = 0.0
+        self.error = None
+        self._finished = False
+
+    def __repr__(self):
+        return '<QueryEvent %s %s %r (%d documents, %.2fms)>' % (
+            self.operation, self.collection, self.query, self.documents,
+            self.duration * 1000)
+
+
+class QueryListener(object):
+    """Base class for listeners, which are notified when operations start
+    and finish. Listeners are called on the thread that made the operation,
+    so they should be quick and thread-safe.
+    """
+
+    def started(self, event):
+        pass
+
+    def finished(self, event):
+        pass
+
+
+def _start(operation, collection, query=None, projection=None, source=None,
+           sort=None):
+    event = QueryEvent(operation, collection, query, projection, source, sort)
+    for listener in _listeners:
+        listener.started(event)
+    return event
+
+
+def _finish(event):
+    if event._finished:
+        return
+    event._finished = True
+    for listener in _listeners:
+        listener.finished(event)
+
+
+def _count_written(result):
+    if isinstance(result, dict):
+        return result.get('n') or 0
+    return 0
+
+
+def call(operation, collection, query, func, *args, **kwargs):
+    """Call ``func``, a driver method that performs ``operation`` on
+    ``collection``, notifying the listeners.
+    """
+    if not _listeners:
+        return func(*args, **kwargs)
+    return _call(_start(operation, collection, query), func, args, kwargs)
+
+
+def dereference(dbref, document=None, field_name=None):
+    """Fetch the document ``dbref`` refers to, notifying the listeners.
+    ``document`` and ``field_name`` are the document and field holding the
+    reference, if any.
+    """
+    db = _get_db()
+    if not _listeners:
+        return db.dereference(dbref)
+    source = None
+    if document is not None:
+        source = (document.__class__, field_name)
+    event = _start('dereference', dbref.collection, {'_id': dbref.id},
+                   source=source)
+    return _call(event, db.dereference, (dbref,), {})
+
+
+def _call(event, func, args, kwargs):
+    operation = event.operation
+    started = time.time()
+    try:
+        result = func(*args, **kwargs)
+    except Exception, err:
+        event.duration = time.time() - started
+        event.error = err
+        _finish(event)
+        raise
+    event.duration = time.time() - started
+    if operation in ('update', 'remove'):
+        event.documents = _count_written(result)
+    elif operation == 'insert':
+        event.documents = isinstance(result, list) and len(result) or 1
+    elif operation == 'findandmodify':
+        event.documents = result.get('value') and 1 or 0
+    elif operation in ('count', 'eval', 'map_reduce'):
+        event.documents = 0
+    elif isinstance(result, list):
+        event.documents = len(result)
+    else:
+        event.documents = result is not None and 1 or 0
+    _finish(event)
+    return result
+
+
+class MonitoredCursor(object):
+    """Wraps a driver cursor, timing the fetching of its results and
+    counting them. The cursor's event starts when the first result is
+    fetched, and finishes when the cursor is exhausted, rewound or closed.
+    Events aren't finished when the cursor is garbage collected, as
+    listeners could then run (and query the database) at any point.
+    """
+
+    def __init__(self, cursor, collection, query, projection):
+        self._wrapped = cursor
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = None
+        self.event = None
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def __iter__(self):
+        return self
+
+    def _event(self):
+        if self.event is None or self.event._finished:
+            self.event = _start('find', self._collection, self._query,
+                                self._projection, sort=self._sort)
+        return self.event
+
+    def sort(self, key_or_list, direction=None):
+        self._wrapped.sort(key_or_list, direction)
+        if direction is not None:
+            key_or_list = [(key_or_list, direction)]
+        self._sort = key_or_list
+        return self
+
+    def next(self):
+        event = self._event()
+        started = time.time()
+        try:
+            son = self._wrapped.next()
+        except StopIteration:
+            event.duration += time.time() - started
+            _finish(event)
+            raise
+        event.duration += time.time() - started
+        event.documents += 1
+        return son
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            # Slicing applies a skip and limit to the cursor itself
+            self._wrapped[index]
+            return self
+        # Fetching a single result is an operation of its own
+        event = _start('find', self._collection, self._query,
+                       self._projection, sort=self._sort)
+        return _call(event, self._wrapped.__getitem__, (index,), {})
+
+    def rewind(self):
+        if self.event is not None:
+            _finish(self.event)
+        self._wrapped.rewind()
+        return self
+
+    def close(self):
+        """Finish the cursor's event, and close the driver cursor if it
+        may be closed.
+        """
+        if self.event is not None:
+            _finish(self.event)
+        close = getattr(self._wrapped, 'close', None)
+        if close is not None:
+            close()
+
+
+class MonitoredCollection(object):
+    """Wraps a driver collection, notifying the listeners of the
+    operations made on it. Anything not monitored is passed through.
+    """
+
+    def __init__(self, collection):
+        self._collection_obj = collection
+
+    def __getattr__(self, name):
+        return getattr(self._collection_obj, name)
+
+    def __getitem__(self, name):
+        return self._collection_obj[name]
+
+    def __repr__(self):
+        return repr(self._collection_obj)
+
+    def __eq__(self, other):
+        if isinstance(other, MonitoredCollection):
+            other = other._collection_obj
+        return self._collection_obj == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._collection_obj.full_name)
+
+    def find(self, spec=None, *args, **kwargs):
+        cursor = self._collection_obj.find(spec, *args, **kwargs)
+        if not _listeners:
+            return cursor
+        fields = kwargs.get('fields', args and args[0] or None)
+        return MonitoredCursor(cursor, self._collection_obj.name, spec,
+                               fields)
+
+    def find_one(self, spec_or_id=None, *args, **kwargs):
+        return call('find', self._collection_obj.name, spec_or_id,
+                    self._collection_obj.find_one, spec_or_id, *args,
+                    **kwargs)
+
+    def insert(self, doc_or_docs, *args, **kwargs):
+        return call('insert', self._collection_obj.name, None,
+                    self._collection_obj.insert, doc_or_docs, *args,
+                    **kwargs)
+
+    def save(self, to_save, *args, **kwargs):
+        query = {'_id': to_save.get('_id')}
+        return call('save', self._collection_obj.name, query,
+                    self._collection_obj.save, to_save, *args, **kwargs)
+
+    def update(self, spec, document, *args, **kwargs):
+        return call('update', self._collection_obj.name, spec,
+                    self._collection_obj.update, spec, document, *args,
+                    **kwargs)
+
+    def remove(self, spec_or_id=None, *args, **kwargs):
+        return call('remove', self._collection_obj.name, spec_or_id,
+                    self._collection_obj.remove, spec_or_id, *args,
+                    **kwargs)
+
+    def map_reduce(self, map, reduce, *args, **kwargs):
+        return call('map_reduce', self._collection_obj.name,
+                    kwargs.get('query'), self._collection_obj.map_reduce,
+                    map, reduce, *args, **kwargs)
+
+
+class LatencyHistogram(object):
+    """A histogram of operation durations, in buckets whose bounds grow by
+    a factor of two from 0.1ms, along with the number of documents the
+    operations returned.
+    """
+
+    # The upper bound (in seconds) of the first bucket
+    BASE = 0.0001
+    BUCKETS = 24
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.documents = 0
+        self.decode_time = 0.0
+
+    def add(self, event):
+        duration = event.duration + event.decode_time
+        bucket = 0
+        if duration > self.BASE:
+            bucket = int(math.ceil(math.log(duration / self.BASE, 2)))
+        self.counts[min(bucket, self.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.documents += event.documents
+        self.decode_time += event.decode_time
+
+    @property
+    def mean(self):
+        return self.count and self.total / self.count or 0.0
+
+    def percentile(self, percent):
+        """Return the upper bound (in seconds) of the bucket holding the
+        given percentile of durations.
+        """
+        if not self.count:
+            return 0.0
+        target = self.count * percent / 100.0
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.BASE * 2 ** bucket, self.max)
+        return self.max
+
+
+class QueryStats(QueryListener):
+    """A listener that keeps a
+    :class:`~mongoengine.monitoring.LatencyHistogram` of the operations
+    made on each collection, by operation.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def finished(self, event):
+        key = (event.collection, event.operation)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.add(event)
+
+    def histogram(self, collection=None, operation=None):
+        """Return a histogram of the operations on ``collection`` (or every
+        collection), of type ``operation`` (or every type).
+        """
+        combined = LatencyHistogram()
+        with self._lock:
+            for (name, op), histogram in self.histograms.items():
+                if collection is not None and name != collection:
+                    continue
+                if operation is not None and op != operation:
+                    continue
+                combined.counts = [a + b for a, b in zip(combined.counts,
+                                                         histogram.counts)]
+                combined.count += histogram.count
+                combined.total += histogram.total
+                combined.max = max(combined.max, histogram.max)
+                combined.documents += histogram.documents
+                combined.decode_time += histogram.decode_time
+        return combined
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+    def report(self):
+        """Return a table of the operations on each collection, with their
+        count, mean, 95th percentile and maximum durations (in milliseconds)
+        and the number of documents returned.
+        """
+        lines = ['%-24s %-14s %8s %9s %9s %9s %10s' % (
+            'collection', 'operation', 'count', 'mean', 'p95', 'max',
+            'documents')]
+        for (collection, operation) in sorted(self.histograms):
+            histogram = self.histograms[(collection, operation)]
+            lines.append('%-24s %-14s %8d %9.2f %9.2f %9.2f %10d' % (
+                collection, operation, histogram.count,
+                histogram.mean * 1000, histogram.percentile(95) * 1000,
+                histogram.max * 1000, histogram.documents))
+        return '\n'.join(lines)
+
+
+class NPlusOneWarning(UserWarning):
+    """Issued by a :class:`~mongoengine.monitoring.DereferenceDetector`
+    when the same field is dereferenced too many times by one line of code.
+    """
+
+
+class NPlusOneError(Exception):
+    """Raised by a :class:`~mongoengine.monitoring.DereferenceDetector`
+    in place of :class:`~mongoengine.monitoring.NPlusOneWarning`.
+    """
+
+
+# Frames from files in the mongoengine package are skipped when looking for
+# the code that caused a dereference
+_package_dir = os.path.dirname(os.path.abspath(__file__)) + os.sep
+_package_files = {}
+
+
+def _call_site():
+    """Return the file name, line number and function name of the innermost
+    frame outside of MongoEngine.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        internal = _package_files.get(filename)
+        if internal is None:
+            internal = os.path.abspath(filename).startswith(_package_dir)
+            _package_files[filename] = internal
+        if not internal:
+            return (filename, frame.f_lineno, frame.f_code.co_name)
+        frame = frame.f_back
+    return ('<unknown>', 0, '<unknown>')
+
+
+class DereferenceDetector(QueryListener):
+    """A listener that detects N+1 queries: code that dereferences the same
+    field of many documents one at a time, typically while looping over a
+    queryset. It is meant to be used in tests and on staging servers. ::
+
+        with DereferenceDetector(threshold=10):
+            for post in BlogPost.objects:
+                print post.author.name
+
+    Dereferences made through :class:`~mongoengine.ReferenceField`,
+    :class:`~mongoengine.GenericReferenceField` and lists of them, on the
+    thread that started the detector, are counted by the field and by the
+    line of code (outside of MongoEngine) that caused them. Once a count
+    goes over ``threshold``, a :class:`~mongoengine.monitoring.NPlusOneWarning`
+    naming the queryset whose documents were dereferenced is issued for that
+    line; each field and line is only reported once.
+
+    :param threshold: the number of dereferences of a field by one line of
+        code that is allowed
+    :param raise_error: raise :class:`~mongoengine.monitoring.NPlusOneError`
+        rather than issuing a warning
+    """
+
+    def __init__(self, threshold=10, raise_error=False):
+        self.threshold = threshold
+        self.raise_error = raise_error
+        self.counts = {}
+        self._reported = set()
+        self._queries = {}
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """Reset the counts and start counting the dereferences made on this
+        thread.
+        """
+        self.counts = {}
+        self._reported = set()
+        self._queries = {}
+        self._thread = threading.current_thread()
+        register(self)
+
+    def stop(self):
+        """Stop counting dereferences.
+        """
+        unregister(self)
+        self._thread = None
+
+    def started(self, event):
+        if threading.current_thread() is not self._thread:
+            return
+        if event.operation == 'find':
+            # Remember the queries the dereferenced documents may come from
+            self._queries[event.collection] = event.query
+            return
+        if event.operation != 'dereference' or event.source is None:
+            return
+
+        site = _call_site()
+        key = (event.source, site)
+        count = self.counts.get(key, 0) + 1
+        self.counts[key] = count
+        if count > self.threshold and key not in self._reported:
+            self._reported.add(key)
+            message = self._message(event.source, site, count)
+            if self.raise_error:
+                raise NPlusOneError(message)
+            warnings.warn_explicit(message, NPlusOneWarning, site[0],
+                                   site[1])
+
+    def _message(self, source, site, count):
+        document, field_name = source
+        queryset = '%s.objects' % document.__name__
+        query = self._queries.get(document._meta['collection'])
+        if query:
+            queryset += '(__raw__=%r)' % (query,)
+        return ('%s.%s was dereferenced %d times, one query each, by %s:%d '
+                '(in %s). Load the references of the documents from %s '
+                'together, e.g. with in_bulk(), rather than one at a time' %
+                (document.__name__, field_name, count, site[0], site[1],
+                 site[2], queryset))
+
+
+# The operations whose queries are explained by SlowQueryLog
+_EXPLAINED = ('find', 'count', 'distinct', 'update', 'remove',
+              'findandmodify')
+
+
+def _query_shape(query):
+    """Return a copy of a query with its values replaced by ``'?'``, so that
+    queries that only differ in their values have the same shape.
+    """
+    if isinstance(query, dict):
+        return dict((key, _query_shape(value)) for key, value in query.items())
+    if isinstance(query, (list, tuple)) and query and isinstance(query[0],
+                                                                 dict):
+        # Clauses of an $or
+        return [_query_shape(clause) for clause in query]
+    return '?'
+
+
+def _shape_key(shape):
+    """Return a hashable key for a query shape, ignoring the order of keys.
+    """
+    if isinstance(shape, dict):
+        return tuple(sorted((key, _shape_key(value))
+                            for key, value in shape.items()))
+    if isinstance(shape, list):
+        return tuple(_shape_key(clause) for clause in shape)
+    return shape
+
+
+class SlowQueryLog(QueryListener):
+    """A listener that logs the queries, counts, updates and removes that
+    take longer than ``threshold`` seconds. Set up by passing
+    ``slow_query_threshold`` to :func:`~mongoengine.connect`.
+
+    The first time a query of a given shape (the query with its values
+    stripped, and its sort) is slow, it is explained, and a summary of its
+    plan is cached for the later slow queries of that shape, so the cost of
+    explaining is only paid once per shape. The summary records whether the
+    whole collection was scanned (a ``BasicCursor``), the number of
+    documents scanned and returned, and whether the sort was done in memory
+    (``scanAndOrder``). Each slow operation is logged as a warning, with a
+    dict describing it in the ``slow_query`` attribute of the log record.
+
+    :param threshold: the duration (in seconds) over which operations are
+        logged
+    :param logger: the logger used, ``mongoengine.slowquery`` by default
+    :param max_plans: the number of query shapes whose plans are cached
+    """
+
+    def __init__(self, threshold=0.1, logger=None, max_plans=1000):
+        self.threshold = threshold
+        self.logger = logger or logging.getLogger('mongoengine.slowquery')
+        self.max_plans = max_plans
+        self.plans = OrderedDict()
+        self.explains = 0
+        self._lock = threading.Lock()
+
+    def finished(self, event):
+        duration = event.duration + event.decode_time
+        if duration < self.threshold or event.operation not in _EXPLAINED:
+            return
+
+        query = event.query
+        if query is None:
+            query = {}
+        elif not isinstance(query, dict):
+            query = {'_id': query}
+        shape = _query_shape(query)
+        sort = event.sort and [tuple(item) for item in event.sort] or None
+        key = (event.collection, _shape_key(shape), repr(sort))
+        with self._lock:
+            plan = self.plans.get(key)
+        if plan is None and event.error is None:
+            plan = self._explain(event.collection, query, event.projection,
+                                 sort)
+            with self._lock:
+                self.plans[key] = plan
+                if len(self.plans) > self.max_plans:
+                    self.plans.popitem(last=False)
+
+        record = {
+            'operation': event.operation,
+            'collection': event.collection,
+            'shape': shape,
+            'sort': sort,
+            'duration': duration,
+            'documents': event.documents,
+            'error': event.error and unicode(event.error),
+            'plan': plan,
+        }
+        self.logger.warning('Slow %s on %s took %.1fms (%d documents): %r; '
+                            '%s', event.operation, event.collection,
+                            duration * 1000, event.documents, shape,
+                            self._describe(plan),
+                            extra={'slow_query': record})
+
+    def _explain(self, collection, query, projection, sort):
+        """Explain a query, returning a summary of its plan.
+        """
+        cursor = _get_db()[collection].find(query, fields=projection)
+        if sort:
+            cursor.sort(sort)
+        try:
+            plan = cursor.explain()
+        except pymongo.errors.PyMongoError, err:
+            return {'error': unicode(err)}
+        self.explains += 1
+        return {
+            'cursor': plan.get('cursor'),
+            'full_scan': plan.get('cursor', '').startswith('BasicCursor'),
+            'nscanned': plan.get('nscanned'),
+            'n': plan.get('n'),
+            'scan_and_order': bool(plan.get('scanAndOrder')),
+            'index_only': bool(plan.get('indexOnly')),
+            'millis': plan.get('millis'),
+        }
+
+    def _describe(self, plan):
+        if plan is None:
+            return 'not explained'
+        if 'error' in plan:
+            return 'could not explain: %s' % plan['error']
+        description = '%s, nscanned %s, n %s' % (plan['cursor'],
+                                                  plan['nscanned'], plan['n'])
+        if plan['full_scan']:
+            description += ', full collection scan'
+        if plan['scan_and_order']:
+            description += ', sorted in memory'
+        return description
+
+
+_slow_query_log = None
+
+
+def log_slow_queries(threshold, logger=None):
+    """Log the operations that take longer than ``threshold`` seconds with
+    a :class:`~mongoengine.monitoring.SlowQueryLog`, replacing the one set
+    up before, if any. A ``threshold`` of ``None`` stops logging.
+    """
+    global _slow_query_log
+    if _slow_query_log is not None:
+        unregister(_slow_query_log)
+        _slow_query_log = None
+    if threshold is not None:
+        _slow_query_log = SlowQueryLog(threshold, logger)
+        register(_slow_query_log)
+    return _slow_query_log
@@ -1,13 +1,31 @@
 from connection import _get_db
+import monitoring
+import aliases
 
 import pprint
 import pymongo
 import pymongo.code
+import pymongo.son
 import pymongo.dbref
 import pymongo.objectid
+import pymongo.json_util
 import re
+import sys
 import copy
+import time
+import Queue
+import cPickle
+import base64
+import weakref
 import itertools
+import threading
+import collections
+import multiprocessing
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
 
 __all__ = ['queryset_manager', 'Q', 'InvalidQueryError',
            'InvalidCollectionError']
@@ -15,6 +33,10 @@ __all__ = ['queryset_manager', 'Q', 'InvalidQueryError',
 # The maximum number of items to display in a QuerySet.__repr__
 REPR_OUTPUT_SIZE = 20
 
+# The number of documents in each batch decoded by a prefetching QuerySet when
+# no batch size has been set
+PREFETCH_CHUNK_SIZE = 100
+
 
 class DoesNotExist(Exception):
     pass
@@ -32,6 +54,10 @@ class OperationError(Exception):
     pass
 
 
+class ConflictError(OperationError):
+    pass
+
+
 class InvalidCollectionError(Exception):
     pass
 
@@ -268,6 +294,293 @@ class Q(QNode):
         return not bool(self.query)
 
 
+class CursorPrefetcher(object):
+    """Reads a cursor on a background thread, decoding the documents into
+    :class:`~mongoengine.Document` objects and queueing them in chunks, so
+    that fetching and decoding the next batches overlaps with the consumer's
+    work on the current one. At most ``depth`` chunks are queued at a time.
+
+    The thread stops when the cursor is exhausted, when :meth:`stop` is
+    called, or when the owning :class:`~mongoengine.queryset.QuerySet` is
+    garbage collected.
+
+    .. versionadded:: 0.5
+    """
+
+    # How often (in seconds) a blocked producer checks whether to give up
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, queryset, cursor, depth, chunk_size):
+        self._queue = Queue.Queue(maxsize=depth)
+        self._stopped = threading.Event()
+        self._buffer = collections.deque()
+        self._finished = False
+        # Only keep a weak reference to the queryset, so that abandoning an
+        # iteration part of the way through doesn't leak the thread
+        owner = weakref.ref(queryset)
+        self._thread = threading.Thread(target=self._run,
+            args=(owner, cursor, queryset._document, queryset._loaded_fields,
+                  chunk_size))
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _put(self, item, owner):
+        while not self._stopped.isSet() and owner() is not None:
+            try:
+                self._queue.put(item, True, self.POLL_INTERVAL)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _run(self, owner, cursor, document, projection, chunk_size):
+        try:
+            chunk = []
+            for son in cursor:
+                chunk.append(document._from_son(son, projection))
+                if len(chunk) >= chunk_size:
+                    if not self._put(chunk, owner):
+                        return
+                    chunk = []
+            if chunk and not self._put(chunk, owner):
+                return
+            self._put(None, owner)
+        except Exception:
+            # Hand the error over to the consumer to be re-raised there
+            self._put(sys.exc_info(), owner)
+
+    def next_chunk(self):
+        """Return the next list of documents, or ``None`` once the cursor
+        is exhausted.
+        """
+        if self._buffer:
+            chunk = list(self._buffer)
+            self._buffer.clear()
+            return chunk
+        if self._finished:
+            return None
+        item = self._queue.get()
+        if item is None:
+            self._finished = True
+        elif isinstance(item, tuple):
+            self._finished = True
+            raise item[0], item[1], item[2]
+        return item
+
+    def next(self):
+        if not self._buffer:
+            chunk = self.next_chunk()
+            if chunk is None:
+                raise StopIteration
+            self._buffer.extend(chunk)
+        return self._buffer.popleft()
+
+    def stop(self):
+        """Stop the background thread and wait for it to finish.
+        """
+        self._stopped.set()
+        if self._thread is not threading.currentThread():
+            self._thread.join()
+
+
+class ParallelScan(object):
+    """Scans the documents matched by a :class:`~mongoengine.queryset.QuerySet`
+    with several cursors at once, each reading a disjoint range of ``_id``
+    values on its own thread or process. Iterating over the scan yields the
+    documents of all partitions, in no particular order, as they arrive.
+
+    Statistics for each partition are appended to :attr:`stats` as the
+    partition finishes.
+
+    .. versionadded:: 0.5
+    """
+
+    # How often (in seconds) a blocked worker checks whether to give up
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, queryset, workers, mode):
+        if mode not in ('thread', 'process'):
+            raise ValueError('Unknown parallel scan mode "%s"' % mode)
+        if queryset._limit is not None or queryset._skip is not None:
+            raise InvalidQueryError('A parallel scan cannot be combined with '
+                                    'limit or skip')
+        self.mode = mode
+        self.stats = []
+        self._document = queryset._document
+        self._collection = queryset._collection
+        self._query = queryset._query
+        self._cursor_args = queryset._cursor_args
+        self._projection = queryset._loaded_fields
+        self._where_clause = queryset._where_clause
+        self._chunk_size = queryset._batch_size or PREFETCH_CHUNK_SIZE
+        self.partitions = self._partition(workers)
+
+    def _partition(self, workers):
+        """Split the query into at most ``workers`` ranges of ``_id`` values
+        holding roughly the same number of documents, by sampling the ``_id``
+        at each boundary. The first and last ranges are unbounded.
+        """
+        count = self._collection.find(self._query).count()
+        workers = max(1, min(workers, count))
+        bounds = [None]
+        for i in range(1, workers):
+            cursor = self._collection.find(self._query, fields=['_id'])
+            cursor = cursor.sort('_id', pymongo.ASCENDING)
+            for son in cursor.skip(count * i / workers).limit(1):
+                bounds.append(son['_id'])
+        bounds.append(None)
+        return zip(bounds[:-1], bounds[1:])
+
+    def _partition_query(self, lower, upper):
+        bounds = {}
+        if lower is not None:
+            bounds['$gte'] = lower
+        if upper is not None:
+            bounds['$lt'] = upper
+        if not bounds:
+            return self._query
+        return QuerySet._merge_conditions(self._query, {'_id': bounds})
+
+    def _put(self, results, item, stopped):
+        while not stopped.is_set():
+            try:
+                results.put(item, True, self.POLL_INTERVAL)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _scan(self, index, results, stopped, callback):
+        """Read a single partition, putting chunks of documents on the
+        ``results`` queue followed by the partition's statistics.
+        """
+        lower, upper = self.partitions[index]
+        started = time.time()
+        try:
+            if self.mode == 'process':
+                # Connections can't be shared with the parent process
+                collection = _get_db()[self._document._meta['collection']]
+            else:
+                collection = self._collection
+            cursor = collection.find(self._partition_query(lower, upper),
+                                     **self._cursor_args)
+            if self._where_clause:
+                cursor.where(self._where_clause)
+            cursor.batch_size(self._chunk_size)
+
+            result = None
+            count = [0]
+            if callback is not None:
+                def documents():
+                    for son in cursor:
+                        count[0] += 1
+                        yield self._document._from_son(son, self._projection)
+                result = callback(documents())
+            else:
+                chunk = []
+                for son in cursor:
+                    # Worker processes return the raw SON, leaving the
+                    # decoding to the parent
+                    if self.mode == 'thread':
+                        son = self._document._from_son(son, self._projection)
+                    chunk.append(son)
+                    if len(chunk) >= self._chunk_size:
+                        if not self._put(results, ('chunk', chunk), stopped):
+                            return
+                        count[0] += len(chunk)
+                        chunk = []
+                if chunk:
+                    if not self._put(results, ('chunk', chunk), stopped):
+                        return
+                    count[0] += len(chunk)
+        except Exception, e:
+            if self.mode == 'thread':
+                error = sys.exc_info()
+            else:
+                # The traceback can't be sent back to the parent process
+                error = (e.__class__, e, None)
+                try:
+                    cPickle.dumps(error, cPickle.HIGHEST_PROTOCOL)
+                except Exception:
+                    error = (OperationError, OperationError(repr(e)), None)
+            self._put(results, ('error', error), stopped)
+            return
+
+        elapsed = time.time() - started
+        stats = {
+            'partition': index,
+            'lower': lower,
+            'upper': upper,
+            'documents': count[0],
+            'seconds': elapsed,
+            'rate': elapsed and count[0] / elapsed or 0.0,
+        }
+        if callback is not None:
+            stats['result'] = result
+        self._put(results, ('done', stats), stopped)
+
+    def _run(self, callback=None):
+        """Start a worker for each partition and yield the messages they
+        send back, until every partition has finished.
+        """
+        if self.mode == 'thread':
+            results = Queue.Queue(maxsize=len(self.partitions) * 2)
+            stopped = threading.Event()
+            worker_class = threading.Thread
+        else:
+            results = multiprocessing.Queue(maxsize=len(self.partitions) * 2)
+            stopped = multiprocessing.Event()
+            worker_class = multiprocessing.Process
+
+        workers = []
+        for index in range(len(self.partitions)):
+            worker = worker_class(target=self._scan,
+                                  args=(index, results, stopped, callback))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        try:
+            remaining = len(workers)
+            while remaining:
+                kind, value = results.get()
+                if kind == 'error':
+                    raise value[0], value[1], value[2]
+                if kind == 'done':
+                    self.stats.append(value)
+                    remaining -= 1
+                yield kind, value
+        finally:
+            stopped.set()
+            for worker in workers:
+                # Keep the queue drained so that no worker blocks on it
+                while worker.is_alive():
+                    try:
+                        results.get(True, self.POLL_INTERVAL)
+                    except Queue.Empty:
+                        pass
+                worker.join()
+
+    def __iter__(self):
+        for kind, value in self._run():
+            if kind != 'chunk':
+                continue
+            for doc in value:
+                if self.mode == 'process':
+                    doc = self._document._from_son(doc, self._projection)
+                yield doc
+
+    def map(self, callback):
+        """Call ``callback`` for each partition, on that partition's worker,
+        with an iterator over the partition's documents. Blocks until every
+        partition has been processed and returns their statistics, with the
+        value returned by ``callback`` stored under ``'result'``.
+        """
+        for kind, value in self._run(callback):
+            pass
+        return sorted(self.stats, key=lambda stats: stats['partition'])
+
+
 class QuerySet(object):
     """A set of results returned from a query. Wraps a MongoDB cursor,
     providing :class:`~mongoengine.Document` objects as the results.
@@ -279,26 +592,50 @@ class QuerySet(object):
         self._accessed_collection = False
         self._mongo_query = None
         self._query_obj = Q()
-        self._initial_query = {}
         self._where_clause = None
-        self._loaded_fields = []
+        self._loaded_fields = {}
         self._ordering = []
         self._snapshot = False
         self._timeout = True
-
-        # If inheritance is allowed, only return instances and instances of
-        # subclasses of the class being used
-        if document._meta.get('allow_inheritance'):
-            self._initial_query = {'_types': self._document._class_name}
+        self._batch_size = None
+        self._prefetch_depth = 0
+        self._prefetcher = None
+        self._covered_fields = None
         self._cursor_obj = None
         self._limit = None
         self._skip = None
 
+    @classmethod
+    def _type_query(cls, document):
+        """Return the query matching the instances of ``document`` and of
+        its subclasses. It is built when a query is, rather than when the
+        queryset is created, so that subclasses defined in the meantime are
+        matched.
+        """
+        # If inheritance is allowed, only return instances and instances of
+        # subclasses of the class being used. Every document in the collection
+        # is an instance of a root class without subclasses, so there's no
+        # need to check the type when querying one
+        if not document._meta.get('allow_inheritance') or not (
+                document._superclasses or len(document._subclasses) > 1):
+            return {}
+        if document._meta.get('store_types', True):
+            return {'_types': document._class_name}
+        if len(document._subclasses) > 1:
+            return {'_cls': {'$in': sorted(document._subclasses)}}
+        return {'_cls': document._class_name}
+
     @property
     def _query(self):
         if self._mongo_query is None:
             self._mongo_query = self._query_obj.to_query(self._document)
-            self._mongo_query.update(self._initial_query)
+            self._mongo_query.update(self._type_query(self._document))
+            if self._covered_fields and not self._document._superclasses:
+                # Every document in the collection is an instance of the
+                # root class, and _types (a list) would stop the index from
+                # covering the query
+                self._mongo_query.pop('_types', None)
+                self._mongo_query.pop('_cls', None)
         return self._mongo_query
 
     def ensure_index(self, key_or_list, drop_dups=False, background=False,
@@ -322,7 +659,11 @@ class QuerySet(object):
             key_or_list = [key_or_list]
 
         index_list = []
-        use_types = doc_cls._meta.get('allow_inheritance', True)
+        # Queries on root classes don't need to check the type of the
+        # documents, so neither do their indexes
+        use_types = (doc_cls._meta.get('allow_inheritance', True) and
+                     bool(doc_cls._superclasses))
+        store_types = doc_cls._meta.get('store_types', True)
         for key in key_or_list:
             # Get direction from + or -
             direction = pymongo.ASCENDING
@@ -331,6 +672,11 @@ class QuerySet(object):
             if key.startswith(("+", "-")):
                     key = key[1:]
 
+            # The default id field is only added after the indexes are built
+            if key in ('id', 'pk') and key not in doc_cls._fields:
+                index_list.append(('_id', direction))
+                continue
+
             # Use real field name, do it manually because we need field
             # objects for the next part (list field checking)
             parts = key.split('.')
@@ -340,12 +686,14 @@ class QuerySet(object):
             index_list.append((key, direction))
 
             # Check if a list field is being used, don't use _types if it is
-            if use_types and not all(f._index_with_types for f in fields):
+            if use_types and store_types and not all(f._index_with_types
+                                                     for f in fields):
                 use_types = False
 
-        # If _types is being used, prepend it to every specified index
-        if doc_cls._meta.get('allow_inheritance') and use_types:
-            index_list.insert(0, ('_types', 1))
+        # If _types (or _cls) is being used, prepend it to every specified
+        # index
+        if use_types:
+            index_list.insert(0, (store_types and '_types' or '_cls', 1))
 
         return index_list
 
@@ -401,10 +749,12 @@ class QuerySet(object):
                 self._collection.ensure_index(index, unique=True,
                     background=background, drop_dups=drop_dups, **index_opts)
 
-            # If _types is being used (for polymorphism), it needs an index
-            if '_types' in self._query:
-                self._collection.ensure_index('_types',
-                    background=background, **index_opts)
+            # If _types or _cls is being used (for polymorphism), it needs an
+            # index
+            for key in ('_types', '_cls'):
+                if key in self._query:
+                    self._collection.ensure_index(key,
+                        background=background, **index_opts)
 
             # Ensure all needed field indexes are created
             for field in self._document._fields.values():
@@ -415,21 +765,30 @@ class QuerySet(object):
 
         return self._collection_obj
 
+    @property
+    def _cursor_args(self):
+        cursor_args = {
+            'snapshot': self._snapshot,
+            'timeout': self._timeout,
+        }
+        if self._loaded_fields:
+            cursor_args['fields'] = self._loaded_fields
+        return cursor_args
+
     @property
     def _cursor(self):
         if self._cursor_obj is None:
-            cursor_args = {
-                'snapshot': self._snapshot,
-                'timeout': self._timeout,
-            }
-            if self._loaded_fields:
-                cursor_args['fields'] = self._loaded_fields
+            if self._covered_fields:
+                self._check_covered()
             self._cursor_obj = self._collection.find(self._query, 
-                                                     **cursor_args)
+                                                     **self._cursor_args)
             # Apply where clauses to cursor
             if self._where_clause:
                 self._cursor_obj.where(self._where_clause)
 
+            if self._batch_size:
+                self._cursor_obj.batch_size(self._batch_size)
+
             # apply default ordering
             if self._document._meta['ordering']:
                 self.order_by(*self._document._meta['ordering'])
@@ -645,24 +1004,276 @@ class QuerySet(object):
         try:
             if self._limit == 0:
                 raise StopIteration
-            return self._document._from_son(self._cursor.next())
+            if self._prefetch_depth:
+                return self._get_prefetcher().next()
+            return self._decode(self._cursor.next())
         except StopIteration, e:
             self.rewind()
             raise e
 
+    def _decode(self, son):
+        """Convert a SON document from the cursor to a document, adding the
+        time taken to the cursor's event when it is monitored.
+        """
+        if self._covered_fields:
+            values = [field.to_python(QuerySet._son_value(son, key))
+                      for key, field in self._covered_fields]
+            if len(values) == 1:
+                return values[0]
+            return tuple(values)
+        event = getattr(self._cursor_obj, 'event', None)
+        if event is None:
+            return self._document._from_son(son, self._loaded_fields)
+        started = time.time()
+        doc = self._document._from_son(son, self._loaded_fields)
+        event.decode_time += time.time() - started
+        return doc
+
     def rewind(self):
         """Rewind the cursor to its unevaluated state.
 
         .. versionadded:: 0.3
         """
+        if self._prefetcher is not None:
+            self._prefetcher.stop()
+            self._prefetcher = None
         self._cursor.rewind()
 
+    def _get_prefetcher(self, chunk_size=None):
+        if self._prefetcher is None:
+            chunk_size = chunk_size or self._batch_size or PREFETCH_CHUNK_SIZE
+            self._prefetcher = CursorPrefetcher(self, self._cursor,
+                                                self._prefetch_depth,
+                                                chunk_size)
+        return self._prefetcher
+
+    def prefetch(self, depth=2):
+        """Fetch and decode the next ``depth`` batches of documents on a
+        background thread while the current batch is being processed, so that
+        network round trips and decoding overlap with the application's work
+        rather than stalling it whenever a batch runs out. ::
+
+            for post in BlogPost.objects.batch_size(500).prefetch(2):
+                render(post)
+
+        Batches are the size set by
+        :meth:`~mongoengine.queryset.QuerySet.batch_size` (100 documents if
+        it hasn't been set). :meth:`~mongoengine.queryset.QuerySet.iterator`
+        also makes use of prefetching.
+
+        :param depth: the maximum number of batches to hold ready; ``0``
+            disables prefetching
+
+        .. versionadded:: 0.5
+        """
+        self._prefetch_depth = depth
+        return self
+
+    def iterator(self, chunk_size=100):
+        """Iterate over the results in chunks, yielding a list of documents
+        for each batch received from the server. Only one batch is held in
+        memory at a time, so memory use stays constant no matter how many
+        documents are matched, and each chunk may be handed on to pipeline
+        processing as a unit. ::
+
+            for posts in BlogPost.objects.iterator(500):
+                index_posts(posts)
+
+        When combined with :meth:`~mongoengine.queryset.QuerySet.prefetch`,
+        the following chunks are fetched and decoded in the background while
+        the current one is being processed.
+
+        :param chunk_size: the number of documents to request from the
+            server per batch (and hence the size of each chunk)
+
+        .. versionadded:: 0.5
+        """
+        if self._limit == 0:
+            return
+        self.rewind()
+        self._cursor.batch_size(chunk_size)
+
+        if self._prefetch_depth:
+            prefetcher = self._get_prefetcher(chunk_size)
+            chunk = prefetcher.next_chunk()
+            while chunk is not None:
+                yield chunk
+                chunk = prefetcher.next_chunk()
+            self.rewind()
+            return
+
+        chunk = []
+        for son in self._cursor:
+            chunk.append(self._decode(son))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+        self.rewind()
+
+    def parallel_scan(self, workers=4, mode='thread', callback=None):
+        """Read the matched documents with ``workers`` concurrent cursors,
+        splitting the query into disjoint ranges of ``_id`` values of roughly
+        equal size. This speeds up full-collection jobs such as exports,
+        backfills and reindexing. The query's filters and field selection
+        are applied to every partition; ordering is not. ::
+
+            for post in BlogPost.objects(published=True).parallel_scan(8):
+                export(post)
+
+        Without a ``callback``, a :class:`~mongoengine.queryset.ParallelScan`
+        is returned, which yields the documents of all partitions as they
+        arrive. With one, ``callback`` is called on each worker with an
+        iterator over its partition's documents, and a list of statistics is
+        returned once every partition is done. Each partition's statistics
+        give its ``_id`` bounds (``lower`` and ``upper``), ``documents``,
+        ``seconds``, ``rate`` (documents per second) and the callback's
+        ``result``.
+
+        :param workers: the number of partitions to scan concurrently
+        :param mode: ``'thread'`` to scan on threads, or ``'process'`` to
+            scan in separate processes (so decoding and callbacks aren't
+            limited by the GIL)
+        :param callback: an optional function called with each partition
+
+        .. versionadded:: 0.5
+        """
+        scan = ParallelScan(self, workers, mode)
+        if callback is not None:
+            return scan.map(callback)
+        return scan
+
+    def tail(self, await_data=True, start_after=None, callback=None,
+             batch_size=100, timeout=None, poll_interval=0.5):
+        """Follow a capped collection, yielding the matched documents as they
+        are inserted. Tailing starts after the most recently inserted
+        document, or after ``start_after``, and continues until ``timeout``
+        seconds have passed (or forever). ::
+
+            for entry in LogEntry.objects(level='error').tail():
+                alert(entry)
+
+        If the cursor dies (for instance because the collection wrapped
+        around past it, or the connection was lost), tailing resumes with a
+        new cursor from the ``_id`` of the last document seen. This relies on
+        ``_id`` values increasing with insertion, as the default
+        :class:`~pymongo.objectid.ObjectId`\ s do.
+
+        With a ``callback``, documents are instead passed to it in lists of
+        up to ``batch_size``, as soon as they have been received; tailing
+        stops when the callback returns ``False``, and the number of
+        documents delivered is returned.
+
+        :param await_data: have the server wait for new documents before
+            answering each getMore, rather than polling every
+            ``poll_interval`` seconds; drivers that don't support awaiting
+            data fall back to polling
+        :param start_after: a document, or the ``_id`` of a document, to
+            resume tailing after
+        :param callback: an optional function called with each batch of
+            documents
+        :param batch_size: the largest number of documents passed to
+            ``callback`` at once
+        :param timeout: the number of seconds to tail for; ``None`` tails
+            until the consumer stops
+        :param poll_interval: the number of seconds to wait before checking
+            for new documents when none were found
+
+        .. versionadded:: 0.5
+        """
+        meta = self._document._meta
+        if not (meta['max_documents'] or meta['max_size']):
+            raise OperationError('Only capped collections may be tailed')
+
+        if isinstance(start_after, self._document):
+            id_field = meta['id_field']
+            id_value = start_after[id_field]
+            start_after = self._document._fields[id_field].to_mongo(id_value)
+        batches = self._tail_batches(await_data, start_after, batch_size,
+                                     timeout, poll_interval)
+        if callback is None:
+            return (doc for batch in batches for doc in batch)
+
+        delivered = 0
+        for batch in batches:
+            delivered += len(batch)
+            if callback(batch) is False:
+                break
+        return delivered
+
+    def _tail_cursor(self, query, await_data):
+        """Open a tailable cursor, returning it along with whether the server
+        awaits data on it.
+        """
+        args = {'timeout': self._timeout}
+        if self._loaded_fields:
+            args['fields'] = self._loaded_fields
+        if await_data:
+            try:
+                return self._collection.find(query, tailable=True,
+                                             await_data=True, **args), True
+            except TypeError:
+                # The driver doesn't support awaiting data
+                pass
+        return self._collection.find(query, tailable=True, **args), False
+
+    def _tail_batches(self, await_data, last_id, batch_size, timeout,
+                      poll_interval):
+        """Generate lists of documents inserted into the capped collection
+        after ``last_id``, replacing the cursor whenever it dies.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        collection = self._collection
+        if last_id is None:
+            # Start after the most recently inserted document
+            last = collection.find(fields=['_id']).sort('$natural', -1)
+            for son in last.limit(1):
+                last_id = son['_id']
+
+        cursor, awaiting = None, False
+        while True:
+            if cursor is None or not cursor.alive:
+                query = self._query
+                if last_id is not None:
+                    query = self._merge_conditions(query,
+                                                   {'_id': {'$gt': last_id}})
+                cursor, awaiting = self._tail_cursor(query, await_data)
+
+            batch = []
+            try:
+                while len(batch) < batch_size:
+                    son = cursor.next()
+                    last_id = son['_id']
+                    doc = self._document._from_son(son, self._loaded_fields)
+                    batch.append(doc)
+            except StopIteration:
+                pass
+            except (pymongo.errors.OperationFailure,
+                    pymongo.errors.AutoReconnect):
+                # Resume from the last document seen with a new cursor
+                cursor = None
+            if batch:
+                yield batch
+            if deadline is not None and time.time() >= deadline:
+                return
+            if batch:
+                continue
+            if cursor is None or not cursor.alive or not awaiting:
+                wait = poll_interval
+                if deadline is not None:
+                    wait = min(wait, max(deadline - time.time(), 0))
+                time.sleep(wait)
+
     def count(self):
         """Count the selected elements in the query.
         """
         if self._limit == 0:
             return 0
-        return self._cursor.count(with_limit_and_skip=True)
+        return monitoring.call('count', self._collection.name, self._query,
+                               self._cursor.count, with_limit_and_skip=True)
 
     def __len__(self):
         return self.count()
@@ -789,39 +1400,443 @@ class QuerySet(object):
             return self
         # Integer index provided
         elif isinstance(key, int):
-            return self._document._from_son(self._cursor[key])
+            return self._decode(self._cursor[key])
         raise AttributeError
 
+    def _keyset_ordering(self):
+        """Return the sort keys used for keyset pagination: the current
+        ordering (or the document's default ordering) followed by ``_id`` as a
+        tiebreaker.
+        """
+        ordering = self._ordering
+        if not ordering:
+            default_ordering = self._document._meta['ordering']
+            ordering = QuerySet._build_ordering(self._document,
+                                                default_ordering)
+        ordering = list(ordering)
+        if '_id' not in [key for key, direction in ordering]:
+            ordering.append(('_id', pymongo.ASCENDING))
+        return ordering
+
+    @classmethod
+    def _son_value(cls, son, key):
+        """Get the value at the dotted database key ``key`` in ``son``.
+        """
+        value = son
+        for part in key.split('.'):
+            if not isinstance(value, dict):
+                return None
+            value = value.get(part)
+        return value
+
+    def _keyset_values(self, last, ordering):
+        """Convert a document, a sequence of values or a continuation token
+        into a list of database values for the sort keys in ``ordering``.
+        """
+        keys = [key for key, direction in ordering]
+        if isinstance(last, basestring):
+            try:
+                token = json.loads(base64.urlsafe_b64decode(str(last)),
+                                   object_hook=pymongo.json_util.object_hook)
+            except (TypeError, ValueError):
+                raise InvalidQueryError('Invalid continuation token')
+            if token.get('k') != keys:
+                raise InvalidQueryError('Continuation token does not match '
+                                        'the ordering of the queryset')
+            return token['v']
+
+        if isinstance(last, self._document):
+            son = last.to_mongo()
+            return [QuerySet._son_value(son, key) for key in keys]
+
+        if len(last) != len(keys):
+            raise InvalidQueryError('Expected %d values to paginate after '
+                                    '(for %s)' % (len(keys), ', '.join(keys)))
+        values = []
+        for key, value in zip(keys, last):
+            try:
+                fields = QuerySet._lookup_field(self._document,
+                                                key.split('.'))
+            except (KeyError, InvalidQueryError):
+                fields = None
+            if key == '_id':
+                id_field = self._document._meta['id_field']
+                fields = [self._document._fields[id_field]]
+            if fields and value is not None:
+                value = fields[-1].to_mongo(value)
+            values.append(value)
+        return values
+
+    def _keyset_projection(self, ordering):
+        """Return the current projection, changed so that the sort keys in
+        ``ordering`` are loaded: added to an inclusion projection, or no
+        longer excluded by an exclusion projection.
+        """
+        projection = dict(self._loaded_fields)
+        keys = [key for key, direction in ordering]
+        if [path for path, value in projection.items()
+            if value == 1 and path != '_id']:
+            for key in keys:
+                parts = key.split('.')
+                prefixes = ['.'.join(parts[:i + 1])
+                            for i in range(len(parts))]
+                if not [p for p in prefixes if projection.get(p) == 1]:
+                    projection[key] = 1
+        else:
+            for key in keys:
+                if projection.get(key) == 0:
+                    del projection[key]
+        return projection
+
+    @classmethod
+    def _keyset_token(cls, ordering, values):
+        """Build an opaque continuation token from sort key values.
+        """
+        token = {'k': [key for key, direction in ordering], 'v': values}
+        token = json.dumps(token, default=pymongo.json_util.default)
+        return base64.urlsafe_b64encode(token)
+
+    def _keyset_query(self, ordering, values):
+        """Build a query matching the documents that sort after ``values``,
+        i.e. ``(k1 > v1) or (k1 == v1 and k2 > v2) or ...``, combined with the
+        current query. Null and missing values sort before all others.
+        """
+        clauses = []
+        for i, (key, direction) in enumerate(ordering):
+            equal = dict((k, v) for (k, d), v in zip(ordering[:i], values))
+            value = values[i]
+            if direction == pymongo.ASCENDING:
+                if value is None:
+                    after = [{'$ne': None}]
+                else:
+                    after = [{'$gt': value}]
+            elif value is None:
+                # Nothing sorts after null values in descending order
+                after = []
+            else:
+                after = [{'$lt': value}, None]
+            for condition in after:
+                clause = dict(equal)
+                clause[key] = condition
+                clauses.append(clause)
+
+        query = copy.deepcopy(self._query)
+        if '$or' in query:
+            # MongoDB doesn't support nested $or operations, so distribute the
+            # existing $or clauses over the range clauses
+            clauses = [QuerySet._merge_conditions(a, b)
+                       for a in query['$or'] for b in clauses]
+        query['$or'] = clauses
+        return query
+
+    @classmethod
+    def _merge_conditions(cls, query, other):
+        """AND two Mongo query dicts together. Equality conditions are
+        rewritten as ``$in`` so they may be combined with range operators on
+        the same field, and overlapping bounds are narrowed.
+        """
+        merged = copy.deepcopy(query)
+        for field, ops in copy.deepcopy(other).items():
+            if field not in merged:
+                merged[field] = ops
+                continue
+            current = merged[field]
+            if not isinstance(current, dict):
+                current = {'$in': [current]}
+            if not isinstance(ops, dict):
+                ops = {'$in': [ops]}
+            for op, value in ops.items():
+                if op not in current:
+                    current[op] = value
+                elif op in ('$gt', '$gte'):
+                    current[op] = max(current[op], value)
+                elif op in ('$lt', '$lte'):
+                    current[op] = min(current[op], value)
+                elif op == '$in':
+                    current[op] = [v for v in current[op] if v in value]
+                elif current[op] != value:
+                    message = 'Conflicting values for ' + field
+                    raise InvalidQueryError(message)
+            merged[field] = current
+        return merged
+
+    def paginate_after(self, last, page_size):
+        """Retrieve the page of documents that follows ``last`` in the
+        current ordering. Rather than skipping over the earlier results, which
+        costs the server time proportional to the offset, a range query on
+        the sort keys is used, so deep pages are as cheap as the first one.
+        ``_id`` is used as a tiebreaker, so documents with equal sort keys are
+        neither skipped nor repeated. ::
+
+            posts, token = BlogPost.objects.order_by('-date').paginate_after(
+                None, 20)
+            # ... later, usually in another request
+            posts, token = BlogPost.objects.order_by('-date').paginate_after(
+                token, 20)
+
+        Returns a tuple of the list of documents and a continuation token
+        that may be passed back as ``last`` to fetch the next page; the token
+        is ``None`` when there are no further documents.
+
+        :param last: ``None`` for the first page, the last document of the
+            previous page, a continuation token, or a sequence of values for
+            the sort keys followed by the primary key
+        :param page_size: the maximum number of documents to return
+
+        .. versionadded:: 0.5
+        """
+        ordering = self._keyset_ordering()
+        if last is None:
+            query = self._query
+        else:
+            query = self._keyset_query(ordering,
+                                       self._keyset_values(last, ordering))
+
+        # The sort keys are needed to build the continuation token
+        projection = self._keyset_projection(ordering)
+        cursor_args = self._cursor_args
+        cursor_args.pop('fields', None)
+        if projection:
+            cursor_args['fields'] = projection
+        cursor = self._collection.find(query, **cursor_args)
+        if self._where_clause:
+            cursor.where(self._where_clause)
+        # Fetch one extra document to find out whether there is another page
+        cursor.sort(ordering).limit(page_size + 1)
+        sons = list(cursor)
+
+        token = None
+        if len(sons) > page_size:
+            sons = sons[:page_size]
+            values = [QuerySet._son_value(sons[-1], k) for k, d in ordering]
+            token = QuerySet._keyset_token(ordering, values)
+        docs = [self._document._from_son(son, projection or None)
+                for son in sons]
+        return docs, token
+
     def distinct(self, field):
         """Return a list of distinct values for a given field.
 
         :param field: the field to select distinct values from
 
         .. versionadded:: 0.4
+        .. versionchanged:: 0.5 - field names are translated to their
+           database names
         """
-        return self._cursor.distinct(field)
+        try:
+            field = QuerySet._translate_field_name(self._document, field)
+        except InvalidQueryError:
+            # Not a document field, so assume it is a database field name
+            pass
+        return monitoring.call('distinct', self._collection.name,
+                               self._query, self._cursor.distinct, field)
 
     def only(self, *fields):
-        """Load only a subset of this document's fields. ::
+        """Load only a subset of this document's fields. Subfields of embedded
+        documents may be selected using dot notation. ::
+
+            post = BlogPost.objects(...).only("title", "author.name")
 
-            post = BlogPost.objects(...).only("title")
+        Fields that weren't loaded are fetched (all at once) the first time
+        one of them is accessed, and are left untouched when the document is
+        saved.
 
         :param fields: fields to include
 
         .. versionadded:: 0.3
+        .. versionchanged:: 0.5 - added support for subfields
         """
-        self._loaded_fields = []
+        # Keep any projection operators (see slice() and elem_match())
+        self._loaded_fields = dict((path, value) for path, value
+                                   in self._loaded_fields.items()
+                                   if isinstance(value, dict))
         for field in fields:
-            if '.' in field:
-                raise InvalidQueryError('Subfields cannot be used as '
-                                        'arguments to QuerySet.only')
             # Translate field name
-            field = QuerySet._lookup_field(self._document, field)[-1].db_field
-            self._loaded_fields.append(field)
+            field = QuerySet._translate_field_name(self._document, field)
+            self._loaded_fields[field] = 1
 
         # _cls is needed for polymorphism
         if self._document._meta.get('allow_inheritance'):
-            self._loaded_fields += ['_cls']
+            self._loaded_fields['_cls'] = 1
+        # _version is needed for saving versioned documents
+        if self._document._meta.get('versioned'):
+            self._loaded_fields['_version'] = 1
+        return self
+
+    def covered(self, *fields):
+        """Return only the values of the given fields, answering the query
+        from an index alone, without reading the documents. Each result is
+        the value of the field, or a tuple of values if several fields are
+        given. ::
+
+            class User(Document):
+                email = StringField()
+                meta = {'indexes': [('email', 'id')]}
+
+            user_ids = User.objects(email__in=emails).covered('email', 'id')
+
+        Unlike :meth:`~mongoengine.queryset.QuerySet.only`, exactly the given
+        fields are projected: ``_id`` is left out unless it is asked for, and
+        so is ``_cls``. If the document is the root of its class hierarchy,
+        the ``_types`` condition is dropped from the query, as every document
+        in the collection matches it. When the results are fetched, an
+        :class:`~mongoengine.queryset.InvalidQueryError` is raised unless a
+        declared index (from :attr:`indexes`, unique fields or ``_id``)
+        without list fields contains every field queried, sorted and
+        returned.
+
+        :param fields: the fields whose values are returned
+
+        .. versionadded:: 0.5
+        """
+        covered_fields = []
+        for field_name in fields:
+            parts = field_name.split('.')
+            if parts[0] == 'pk':
+                parts[0] = self._document._meta['id_field']
+            path = QuerySet._lookup_field(self._document, parts)
+            key = '.'.join(field.db_field for field in path)
+            covered_fields.append((key, path[-1]))
+        self._covered_fields = covered_fields
+
+        self._loaded_fields = dict((key, 1) for key, field in covered_fields)
+        if '_id' not in self._loaded_fields:
+            self._loaded_fields['_id'] = 0
+        # Rebuild the query and cursor, which may have been created already
+        self._mongo_query = None
+        if self._cursor_obj is not None:
+            self._cursor_obj = None
+            if self._ordering:
+                self._cursor.sort(self._ordering)
+        return self
+
+    def _check_covered(self):
+        """Raise an :class:`~mongoengine.queryset.InvalidQueryError` unless a
+        declared index can cover the query.
+        """
+        query = self._query
+        ordering = self._ordering or QuerySet._build_ordering(
+            self._document, self._document._meta['ordering'])
+        queried = set(query)
+        needed = queried.union(key for key, field in self._covered_fields)
+        needed.update(key for key, direction in ordering)
+        # The index must be usable, i.e. start with a key queried or sorted on
+        usable = set(queried)
+        if ordering:
+            usable.add(ordering[0][0])
+
+        indexes = ([[('_id', pymongo.ASCENDING)]] +
+                   self._document._meta['indexes'] +
+                   self._document._meta['unique_indexes'])
+        for index in indexes:
+            keys = [key for key, direction in index]
+            if needed.issubset(keys) and keys[0] in usable and not any(
+                    self._is_multikey(key) for key in keys):
+                return
+        message = 'Query on %s cannot be covered: no index without list ' \
+                  'fields includes %s'
+        raise InvalidQueryError(message % (self._document._meta['collection'],
+                                           ', '.join(sorted(needed))))
+
+    def _is_multikey(self, key):
+        """Return whether an index on the database key ``key`` holds one
+        entry per item of a list, in which case it cannot cover a query.
+        """
+        if key == '_types':
+            return True
+        fields = self._document._fields
+        for part in key.split('.'):
+            field = [f for f in fields.values() if f.db_field == part]
+            if not field:
+                return False
+            field = field[0]
+            if not field._index_with_types:
+                # A list field
+                return True
+            document_type = getattr(field, 'document_type', None)
+            fields = getattr(document_type, '_fields', {})
+        return False
+
+    def exclude(self, *fields):
+        """Load all but the given fields of this document. Subfields of
+        embedded documents may be excluded using dot notation. ::
+
+            post = BlogPost.objects(...).exclude("comments")
+
+        As with :meth:`~mongoengine.queryset.QuerySet.only`, excluded fields
+        are fetched when accessed and are never overwritten by saving.
+
+        :param fields: fields to exclude
+
+        .. versionadded:: 0.5
+        """
+        fields = [QuerySet._translate_field_name(self._document, field)
+                  for field in fields]
+        include = [path for path, value in self._loaded_fields.items()
+                   if value == 1 and path != '_cls']
+        if include:
+            # Narrow down the fields selected with only()
+            for field in fields:
+                if field not in self._loaded_fields:
+                    raise InvalidQueryError('Cannot exclude "%s" as it was '
+                                            'not selected with only()' % field)
+                del self._loaded_fields[field]
+        else:
+            for field in fields:
+                self._loaded_fields[field] = 0
+        return self
+
+    def slice(self, field, skip_or_limit, limit=None):
+        """Load only part of a list field, using a ``$slice`` projection. ::
+
+            # The last 10 comments
+            post = BlogPost.objects(...).slice('comments', -10).first()
+            # 10 comments, skipping the first 20
+            post = BlogPost.objects(...).slice('comments', 20, 10).first()
+
+        The other fields are loaded as normal. The partial list may not be
+        modified, and is not written back when the document is saved.
+
+        :param field: the list field to slice
+        :param skip_or_limit: the number of items to return, counting from
+            the end of the list if negative; or the number of items to skip
+            if ``limit`` is given
+        :param limit: the number of items to return after skipping
+
+        .. versionadded:: 0.5
+        """
+        field = QuerySet._translate_field_name(self._document, field)
+        if limit is None:
+            value = skip_or_limit
+        else:
+            value = [skip_or_limit, limit]
+        self._loaded_fields[field] = {'$slice': value}
+        return self
+
+    def elem_match(self, field, **query):
+        """Load only the first item of a list of embedded documents that
+        matches the query, using an ``$elemMatch`` projection. ::
+
+            post = BlogPost.objects(...).elem_match('comments', author='x')
+
+        The other fields are loaded as normal. The partial list may not be
+        modified, and is not written back when the document is saved.
+
+        :param field: the list field to match items of
+        :param query: Django-style query keyword arguments, evaluated against
+            the embedded documents in the list
+
+        .. versionadded:: 0.5
+        """
+        fields = QuerySet._lookup_field(self._document, field.split('.'))
+        document = getattr(getattr(fields[-1], 'field', None),
+                           'document_type', None)
+        if document is None:
+            raise InvalidQueryError('elem_match may only be used with lists '
+                                    'of embedded documents')
+        field = '.'.join(f.db_field for f in fields)
+        query = QuerySet._transform_query(_doc_cls=document, **query)
+        self._loaded_fields[field] = {'$elemMatch': query}
         return self
 
     def order_by(self, *keys):
@@ -832,6 +1847,15 @@ class QuerySet(object):
         :param keys: fields to order the query results by; keys may be
             prefixed with **+** or **-** to determine the ordering direction
         """
+        key_list = QuerySet._build_ordering(self._document, keys)
+        self._ordering = key_list
+        self._cursor.sort(key_list)
+        return self
+
+    @classmethod
+    def _build_ordering(cls, doc_cls, keys):
+        """Build a PyMongo sort spec from MongoEngine ordering keys.
+        """
         key_list = []
         for key in keys:
             if not key: continue
@@ -841,11 +1865,13 @@ class QuerySet(object):
             if key[0] in ('-', '+'):
                 key = key[1:]
             key = key.replace('__', '.')
+            try:
+                key = QuerySet._translate_field_name(doc_cls, key)
+            except (KeyError, InvalidQueryError):
+                # Not a document field (e.g. a raw database key), use as-is
+                pass
             key_list.append((key, direction))
-
-        self._ordering = key_list
-        self._cursor.sort(key_list)
-        return self
+        return key_list
 
     def explain(self, format=False):
         """Return an explain plan record for the
@@ -873,6 +1899,21 @@ class QuerySet(object):
         """
         self._timeout = enabled
 
+    def batch_size(self, size):
+        """Set the number of documents the server returns per batch. Larger
+        batches mean fewer round trips (getMore calls) when iterating over
+        many documents, smaller ones mean less memory held by the cursor.
+
+        :param size: the number of documents per batch; ``0`` uses the
+            server's default
+
+        .. versionadded:: 0.5
+        """
+        self._batch_size = size
+        if self._cursor_obj is not None:
+            self._cursor_obj.batch_size(size)
+        return self
+
     def delete(self, safe=False):
         """Delete the documents matched by the query.
 
@@ -930,6 +1971,10 @@ class QuerySet(object):
             elif key in mongo_update and isinstance(mongo_update[key], dict):
                 mongo_update[key].update(value)
 
+        # Any change to a versioned document makes a new version
+        if _doc_cls and _doc_cls._meta.get('versioned'):
+            mongo_update.setdefault('$inc', {}).setdefault('_version', 1)
+
         return mongo_update
 
     def update(self, safe_update=True, upsert=False, **update):
@@ -981,6 +2026,66 @@ class QuerySet(object):
         except pymongo.errors.OperationFailure, e:
             raise OperationError(u'Update failed [%s]' % unicode(e))
 
+    def modify(self, new=True, upsert=False, remove=False, **update):
+        """Atomically update (or remove) the first document matched by the
+        query and return it, in a single round trip, using MongoDB's
+        ``findandmodify`` command. The document to modify is chosen according
+        to the :class:`~mongoengine.queryset.QuerySet`\ 's ordering, and only
+        the fields selected with :meth:`~mongoengine.queryset.QuerySet.only`
+        are returned. ::
+
+            job = Job.objects(state='queued').order_by('created').modify(
+                set__state='running')
+
+        ``None`` is returned if no document matched the query.
+
+        :param new: return the document as it is after the update, rather
+            than as it was before
+        :param upsert: insert a document if none matched the query
+        :param remove: remove the document rather than updating it
+        :param update: Django-style update keyword arguments
+
+        .. versionadded:: 0.5
+        """
+        if remove and update:
+            raise OperationError('Cannot both update and remove a document')
+        if not remove and not update:
+            raise OperationError('No update was given')
+
+        command = pymongo.son.SON([
+            ('findandmodify', self._collection.name),
+            ('query', self._query),
+        ])
+        ordering = self._ordering
+        if not ordering:
+            # Fall back on the document's default ordering
+            ordering = QuerySet._build_ordering(
+                self._document, self._document._meta['ordering'])
+        if ordering:
+            command['sort'] = pymongo.son.SON(ordering)
+        if remove:
+            command['remove'] = True
+        else:
+            command['update'] = QuerySet._transform_update(self._document,
+                                                           **update)
+            command['new'] = new
+            command['upsert'] = upsert
+        if self._loaded_fields:
+            command['fields'] = self._loaded_fields
+
+        try:
+            # Older servers report an error when nothing matched the query
+            result = monitoring.call('findandmodify', self._collection.name,
+                self._query, self._collection.database.command, command,
+                allowable_errors=['No matching object found'])
+        except pymongo.errors.OperationFailure, err:
+            raise OperationError(u'Modify failed (%s)' % unicode(err))
+
+        son = result.get('value')
+        if not son:
+            return None
+        return self._document._from_son(son, self._loaded_fields)
+
     def __iter__(self):
         return self
 
@@ -1040,7 +2145,8 @@ class QuerySet(object):
         code = pymongo.code.Code(code, scope=scope)
 
         db = _get_db()
-        return db.eval(code, *fields)
+        return monitoring.call('eval', collection, query, db.eval, code,
+                               *fields)
 
     def sum(self, field):
         """Sum over the values of the specified field.
@@ -1148,6 +2254,11 @@ class QuerySetManager(object):
             # Document class being used rather than a document object
             return self
 
+        if not aliases.is_resolved(owner):
+            raise OperationError('The fields of %s have no aliases yet; call '
+                                 'mongoengine.aliases.resolve_all() after '
+                                 'connecting' % owner.__name__)
+
         db = _get_db()
         collection = owner._meta['collection']
         if (db, collection) not in self._collections:
@@ -1178,9 +2289,14 @@ class QuerySetManager(object):
             else:
                 self._collections[(db, collection)] = db[collection]
 
+        collection = self._collections[(db, collection)]
+        if monitoring._listeners:
+            # Let listeners know about the operations made on the collection
+            collection = monitoring.MonitoredCollection(collection)
+
         # owner is the document that contains the QuerySetManager
         queryset_class = owner._meta['queryset_class'] or QuerySet
-        queryset = queryset_class(owner, self._collections[(db, collection)])
+        queryset = queryset_class(owner, collection)
         if self._manager_func:
             if self._manager_func.func_code.co_argcount == 1:
                 queryset = self._manager_func(queryset)
@@ -0,0 +1,171 @@
+from queryset import OperationError
+
+import threading
+import pymongo
+from collections import OrderedDict
+
+__all__ = ['UnitOfWork', 'current_unit_of_work']
+
+
+_local = threading.local()
+
+
+def current_unit_of_work():
+    """Return the innermost :class:`~mongoengine.unitofwork.UnitOfWork`
+    that is active on this thread, or ``None``.
+
+    .. versionadded:: 0.5
+    """
+    units = getattr(_local, 'units', None)
+    if units:
+        return units[-1]
+    return None
+
+
+class UnitOfWork(object):
+    """Records the documents saved and deleted on this thread, and writes
+    them all when it is committed rather than one at a time. ::
+
+        with UnitOfWork():
+            for post in BlogPost.objects(author=author):
+                post.author_name = author.name
+                post.save()
+
+    While a unit of work is active, :meth:`~mongoengine.Document.save` only
+    validates the document, and :meth:`~mongoengine.Document.delete` only
+    records it; saving a document several times results in a single write of
+    its final state. On commit, new documents are inserted with one batch
+    insert per collection, updates are sent one after another, deleted
+    documents are removed with one operation per collection. If ``safe`` is
+    ``True``, each of these operations waits for the server to confirm it,
+    documents are only marked as saved once their write is confirmed, and
+    the first failure raises :class:`~mongoengine.OperationError`, leaving
+    the writes after it unsent. Versioned documents are still saved one at
+    a time, as each save's version check needs its own reply.
+
+    Queries made while a unit of work is active don't see the writes it has
+    recorded. Leaving a ``with`` block commits the unit of work, unless an
+    exception was raised, in which case the recorded writes are discarded.
+
+    :param safe: check that the writes succeeded when committing
+
+    .. versionadded:: 0.5
+    """
+
+    def __init__(self, safe=True):
+        self.safe = safe
+        self._saves = OrderedDict()
+        self._deletes = OrderedDict()
+        self._active = False
+
+    def __enter__(self):
+        self.begin()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    @property
+    def pending(self):
+        """The number of documents waiting to be saved or deleted.
+        """
+        return len(self._saves) + len(self._deletes)
+
+    def begin(self):
+        """Make this the active unit of work on this thread.
+        """
+        if self._active:
+            raise OperationError('Unit of work has already begun')
+        if not hasattr(_local, 'units'):
+            _local.units = []
+        _local.units.append(self)
+        self._active = True
+
+    def _end(self):
+        if self._active:
+            _local.units.remove(self)
+            self._active = False
+
+    def save(self, document, force_insert=False):
+        """Record that a document is to be saved.
+        """
+        key = id(document)
+        self._deletes.pop(key, None)
+        force_insert = force_insert or (key in self._saves and
+                                        self._saves[key][1])
+        self._saves[key] = (document, force_insert)
+
+    def delete(self, document):
+        """Record that a document is to be deleted.
+        """
+        key = id(document)
+        self._saves.pop(key, None)
+        id_field = document._meta['id_field']
+        if document[id_field] is not None:
+            self._deletes[key] = document
+
+    def rollback(self):
+        """Discard the recorded writes and end the unit of work.
+        """
+        self._saves.clear()
+        self._deletes.clear()
+        self._end()
+
+    def commit(self):
+        """Write the recorded saves and deletes, and end the unit of work.
+        """
+        self._end()
+        saves, self._saves = self._saves.values(), OrderedDict()
+        deletes, self._deletes = self._deletes.values(), OrderedDict()
+        if not saves and not deletes:
+            return
+
+        inserts, updates, versioned, removes = OrderedDict(), [], [], {}
+        for document, force_insert in saves:
+            collection = document.__class__.objects._collection
+            doc = document.to_mongo()
+            if document._meta.get('versioned'):
+                versioned.append((document, doc, force_insert))
+            elif force_insert:
+                inserts.setdefault(collection, []).append((document, doc))
+            elif document._projection is not None or document._tracked_lists:
+                if '_id' not in doc:
+                    raise OperationError('Cannot save a document that was '
+                                         'loaded without its id')
+                update = document._build_update(doc)
+                updates.append((collection, document, doc, update, False))
+            elif '_id' not in doc:
+                inserts.setdefault(collection, []).append((document, doc))
+            else:
+                updates.append((collection, document, doc, doc, True))
+        for document in deletes:
+            collection = document.__class__.objects._collection
+            id_field = document._meta['id_field']
+            object_id = document._fields[id_field].to_mongo(document[id_field])
+            removes.setdefault(collection, []).append(object_id)
+
+        safe = self.safe
+        try:
+            for collection, pending in inserts.items():
+                docs = [doc for document, doc in pending]
+                ids = collection.insert(docs, safe=safe)
+                for (document, doc), object_id in zip(pending, ids):
+                    document._saved(doc, object_id)
+            for collection, document, doc, update, upsert in updates:
+                if update:
+                    result = collection.update({'_id': doc['_id']}, update,
+                                               upsert=upsert, safe=safe)
+                    if safe and not upsert and not result.get('n'):
+                        document._save_deleted(collection, doc, safe)
+                document._saved(doc, doc['_id'])
+            for collection, object_ids in removes.items():
+                collection.remove({'_id': {'$in': object_ids}}, safe=safe)
+        except pymongo.errors.OperationFailure, err:
+            message = u'Could not commit unit of work (%s)' % unicode(err)
+            raise OperationError(message)
+
+        for document, doc, force_insert in versioned:
+            document._save(doc, self.safe, force_insert)
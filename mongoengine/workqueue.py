@@ -0,0 +1,280 @@
+from document import Document
+from fields import (StringField, IntField, DateTimeField, DictField,
+                    ObjectIdField)
+from queryset import Q
+
+import time
+import random
+import datetime
+import pymongo.objectid
+
+__all__ = ['QueuedJob', 'JobQueue']
+
+
+# A placeholder owner for jobs that haven't been claimed. Jobs are created with
+# every field set so that they never grow, as documents in capped collections
+# may not grow when they are updated.
+NO_OWNER = pymongo.objectid.ObjectId('0' * 24)
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class QueuedJob(Document):
+    """A job in a :class:`~mongoengine.workqueue.JobQueue`. Jobs carry their
+    data in :attr:`payload`; alternatively, :class:`QueuedJob` may be
+    subclassed to add fields. Jobs are stored in the ``mongoengine.jobs``
+    collection, unless a subclass sets another :attr:`collection` in its
+    :attr:`meta`.
+
+    A queue may be kept in a capped collection by subclassing
+    :class:`QueuedJob` and setting :attr:`collection` and
+    :attr:`max_documents` or :attr:`max_size` in its :attr:`meta`; workers
+    then wait for new jobs by tailing the collection. Acknowledged jobs are
+    marked as done rather than removed, as documents can't be removed from a
+    capped collection.
+
+    .. versionadded:: 0.5
+    """
+
+    QUEUED = 0
+    CLAIMED = 1
+    DONE = 2
+    FAILED = 3
+
+    queue = StringField(required=True)
+    payload = DictField()
+    state = IntField(default=QUEUED)
+    priority = IntField(default=0)
+    attempts = IntField(default=0)
+    created = DateTimeField(default=datetime.datetime.utcnow)
+    # When the job may next be claimed
+    available = DateTimeField(default=datetime.datetime.utcnow)
+    # The worker that has claimed the job, and until when
+    owner = ObjectIdField(default=NO_OWNER)
+    lease_expires = DateTimeField(default=EPOCH)
+
+    meta = {
+        'collection': 'mongoengine.jobs',
+        'indexes': [('queue', 'state', '-priority', 'available')],
+    }
+
+
+class JobQueue(object):
+    """A queue of jobs stored as :class:`~mongoengine.workqueue.QueuedJob`
+    documents, which may be shared by any number of workers in any number of
+    processes. ::
+
+        queue = JobQueue('emails')
+        queue.enqueue([{'to': 'ross@example.com'},
+                       {'to': 'harry@example.com'}])
+
+        # In a worker
+        while True:
+            jobs = queue.get(10)
+            for job in jobs:
+                send_email(**job.payload)
+            queue.ack(jobs)
+
+    Jobs are claimed atomically with a lease. A job that isn't acknowledged
+    before its lease expires (e.g. because its worker died) may be claimed
+    by another worker; long-running jobs should call
+    :meth:`~mongoengine.workqueue.JobQueue.heartbeat` to extend their lease.
+
+    :param name: the name of the queue; many queues may share a collection
+    :param job_class: the :class:`~mongoengine.workqueue.QueuedJob`
+        (sub)class used to store jobs
+    :param lease: the number of seconds jobs are claimed for by default
+    :param min_wait: the shortest time (in seconds) to wait between polls for
+        new jobs
+    :param max_wait: the longest time (in seconds) to wait between polls for
+        new jobs; waits double up to this when no jobs are found
+
+    .. versionadded:: 0.5
+    """
+
+    def __init__(self, name='default', job_class=QueuedJob, lease=60,
+                 min_wait=0.05, max_wait=5.0):
+        self.name = name
+        self.job_class = job_class
+        self.lease = lease
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        # Identifies the jobs claimed through this queue object
+        self.worker_id = pymongo.objectid.ObjectId()
+        self._wait = min_wait
+        self._last_seen = None
+
+    @property
+    def capped(self):
+        meta = self.job_class._meta
+        return bool(meta['max_documents'] or meta['max_size'])
+
+    def _jobs(self, jobs):
+        return self.job_class.objects(id__in=[job.id for job in jobs],
+                                      owner=self.worker_id,
+                                      state=QueuedJob.CLAIMED)
+
+    def enqueue(self, jobs, priority=0, delay=0):
+        """Add jobs to the queue with a single insert, returning their ids.
+
+        :param jobs: a list of :class:`~mongoengine.workqueue.QueuedJob`
+            objects, or dicts to be used as the payloads of new jobs
+        :param priority: the priority of jobs given as dicts; jobs with a
+            higher priority are claimed first
+        :param delay: the number of seconds before the jobs may be claimed
+        """
+        now = datetime.datetime.utcnow()
+        available = now + datetime.timedelta(seconds=delay)
+        # Jobs may be given as any iterable, which is consumed here
+        jobs = [self.job_class(payload=job, priority=priority)
+                if isinstance(job, dict) else job for job in jobs]
+        docs = []
+        for job in jobs:
+            job.queue = self.name
+            job.created = now
+            job.available = available
+            job.validate()
+            docs.append(job.to_mongo())
+        if not docs:
+            return []
+
+        collection = self.job_class.objects._collection
+        ids = collection.insert(docs, safe=True)
+        for job, object_id in zip(jobs, ids):
+            job.id = object_id
+        return ids
+
+    def claim(self, count=1, lease=None):
+        """Atomically claim up to ``count`` jobs that are queued, or whose
+        lease has expired, returning the claimed jobs. Each job is claimed
+        with a findAndModify, so no job is claimed by two workers at once.
+
+        :param count: the maximum number of jobs to claim
+        :param lease: the number of seconds to claim the jobs for
+        """
+        lease = lease or self.lease
+        jobs = []
+        while len(jobs) < count:
+            now = datetime.datetime.utcnow()
+            expires = now + datetime.timedelta(seconds=lease)
+            claimable = (Q(state=QueuedJob.QUEUED) |
+                         Q(state=QueuedJob.CLAIMED, lease_expires__lt=now))
+            queryset = self.job_class.objects(claimable, queue=self.name,
+                                              available__lte=now)
+            job = queryset.order_by('-priority', 'available').modify(
+                set__state=QueuedJob.CLAIMED, set__owner=self.worker_id,
+                set__lease_expires=expires, inc__attempts=1)
+            if job is None:
+                break
+            jobs.append(job)
+        return jobs
+
+    def get(self, count=1, timeout=None, lease=None):
+        """Claim up to ``count`` jobs, waiting until at least one is
+        available. Polling backs off exponentially from ``min_wait`` to
+        ``max_wait`` seconds while the queue is empty; with a capped
+        collection, the collection is tailed instead so that new jobs are
+        noticed as soon as they are inserted.
+
+        :param count: the maximum number of jobs to claim
+        :param timeout: the maximum number of seconds to wait; an empty list
+            is returned if no job could be claimed in time
+        :param lease: the number of seconds to claim the jobs for
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            jobs = self.claim(count, lease)
+            if jobs:
+                self._wait = self.min_wait
+                return jobs
+
+            wait = self._wait
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return []
+                wait = min(wait, remaining)
+            if self.capped:
+                self._tail(wait)
+            else:
+                # Add some jitter so that idle workers don't poll in lockstep
+                time.sleep(wait * random.uniform(0.5, 1.0))
+            self._wait = min(self._wait * 2, self.max_wait)
+
+    def _tail(self, timeout):
+        """Wait for up to ``timeout`` seconds for a job to be inserted into
+        the (capped) collection.
+        """
+        jobs = self.job_class.objects.only('id')
+        for job in jobs.tail(start_after=self._last_seen, timeout=timeout,
+                             poll_interval=self.min_wait):
+            self._last_seen = job.id
+            return True
+        return False
+
+    def heartbeat(self, jobs, lease=None):
+        """Extend the lease on jobs claimed by this queue, returning the
+        number of jobs whose lease was extended. Jobs whose lease already
+        expired and were claimed by another worker are not extended.
+
+        :param jobs: the jobs to extend the lease on
+        :param lease: the number of seconds from now that the lease ends
+        """
+        if not jobs:
+            return 0
+        lease = lease or self.lease
+        expires = datetime.datetime.utcnow()
+        expires += datetime.timedelta(seconds=lease)
+        return self._jobs(jobs).update(set__lease_expires=expires)
+
+    def ack(self, jobs):
+        """Acknowledge that jobs have been completed, removing them from the
+        queue with a single operation. Jobs in capped collections are marked
+        as done instead.
+
+        :param jobs: the jobs to acknowledge
+        """
+        if not jobs:
+            return
+        if self.capped:
+            self._jobs(jobs).update(set__state=QueuedJob.DONE,
+                                    set__owner=NO_OWNER)
+        else:
+            self._jobs(jobs).delete(safe=True)
+
+    def nack(self, jobs, delay=0, max_attempts=None):
+        """Return jobs that couldn't be completed to the queue with a single
+        operation, so that they may be claimed again once ``delay`` seconds
+        have passed.
+
+        :param jobs: the jobs to return to the queue
+        :param delay: the number of seconds before the jobs may be claimed
+        :param max_attempts: if given, jobs that have been claimed this many
+            times are marked as failed rather than being returned to the queue
+        """
+        if not jobs:
+            return
+        available = datetime.datetime.utcnow()
+        available += datetime.timedelta(seconds=delay)
+        if max_attempts is not None:
+            self._jobs(jobs).filter(attempts__gte=max_attempts).update(
+                set__state=QueuedJob.FAILED, set__owner=NO_OWNER)
+        self._jobs(jobs).update(set__state=QueuedJob.QUEUED,
+                                set__owner=NO_OWNER, set__available=available,
+                                set__lease_expires=EPOCH)
+
+    def reclaim(self):
+        """Return all jobs whose lease has expired to the queue, returning
+        their number. Expired jobs may be claimed without this, but it keeps
+        :meth:`~mongoengine.workqueue.JobQueue.count` accurate.
+        """
+        now = datetime.datetime.utcnow()
+        jobs = self.job_class.objects(queue=self.name, state=QueuedJob.CLAIMED,
+                                      lease_expires__lt=now)
+        return jobs.update(set__state=QueuedJob.QUEUED, set__owner=NO_OWNER)
+
+    def count(self, state=QueuedJob.QUEUED):
+        """Return the number of jobs in the queue that are in ``state``.
+        """
+        return self.job_class.objects(queue=self.name, state=state).count()
@@ -0,0 +1,222 @@
+from queryset import OperationError
+
+import time
+import Queue
+import atexit
+import threading
+
+__all__ = ['BufferedWriter']
+
+
+# Markers put on a writer's queue to have the background thread flush its
+# batch straight away, or flush and stop
+_FLUSH = object()
+_STOP = object()
+
+# The writers that are still open, which are closed when the interpreter exits
+_open_writers = set()
+_open_writers_lock = threading.Lock()
+
+
+def _close_open_writers():
+    with _open_writers_lock:
+        writers = list(_open_writers)
+    for writer in writers:
+        writer.close()
+
+atexit.register(_close_open_writers)
+
+
+class BufferedWriter(object):
+    """Buffers new documents of one :class:`~mongoengine.Document` class
+    and inserts them in batches on a background thread, so that writing a
+    document doesn't wait for a round trip to the server. This suits
+    high-volume documents such as log entries, metrics and audit events. ::
+
+        writer = BufferedWriter(LogEntry, batch_size=1000)
+        writer.write(LogEntry(level='info', message='Started'))
+
+    Documents are validated when they are written, and may be written from
+    any number of threads. A batch is inserted once ``batch_size`` documents
+    are waiting, or ``flush_interval`` seconds after its first document was
+    written. When ``max_queued`` documents are waiting to be inserted,
+    :meth:`~mongoengine.writer.BufferedWriter.write` blocks until there is
+    room (or drops the document, if ``block`` is ``False``). Writers that
+    haven't been closed are flushed when the interpreter exits.
+
+    :param document: the :class:`~mongoengine.Document` class written
+    :param batch_size: the largest number of documents inserted at once
+    :param flush_interval: the longest time (in seconds) a document waits
+        before being inserted
+    :param max_queued: the largest number of documents waiting to be
+        inserted before writes block or are dropped
+    :param block: whether writes to a full writer wait for room, rather than
+        dropping the document
+    :param safe: check that each batch was inserted successfully
+
+    .. versionadded:: 0.5
+    """
+
+    def __init__(self, document, batch_size=500, flush_interval=1.0,
+                 max_queued=10000, block=True, safe=False):
+        self.document = document
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block = block
+        self.safe = safe
+        self._collection = document.objects._collection
+        self._queue = Queue.Queue(max_queued)
+        self._lock = threading.Lock()
+        # Held while checking that the writer is open and queueing, so that
+        # nothing is queued after the background thread has been stopped
+        self._write_lock = threading.Lock()
+        self._closed = False
+
+        self.queued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_error = None
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        with _open_writers_lock:
+            _open_writers.add(self)
+
+    @property
+    def pending(self):
+        """The number of documents waiting to be inserted.
+        """
+        return self._queue.qsize()
+
+    @property
+    def latency(self):
+        """The average time (in seconds) between a document being written
+        and being inserted.
+        """
+        if not self.flushed:
+            return 0.0
+        return self.total_latency / self.flushed
+
+    def stats(self):
+        """Return the writer's counters as a dict.
+        """
+        with self._lock:
+            return {
+                'queued': self.queued,
+                'pending': self.pending,
+                'flushed': self.flushed,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'batches': self.batches,
+                'latency': self.latency,
+                'max_latency': self.max_latency,
+            }
+
+    def write(self, doc, timeout=None):
+        """Validate a document and queue it to be inserted, returning
+        ``True`` if it was queued or ``False`` if it was dropped because the
+        writer is full.
+
+        :param doc: the document to insert
+        :param timeout: the longest time (in seconds) to wait for room when
+            the writer is full and blocks
+        """
+        if not isinstance(doc, self.document):
+            raise TypeError('Only %s documents may be written' %
+                            self.document.__name__)
+        doc.validate()
+        son = doc.to_mongo()
+        with self._write_lock:
+            if self._closed:
+                raise OperationError('Cannot write to a closed writer')
+            try:
+                self._queue.put((doc, son, time.time()), self.block, timeout)
+            except Queue.Full:
+                with self._lock:
+                    self.dropped += 1
+                return False
+        with self._lock:
+            self.queued += 1
+        return True
+
+    def flush(self):
+        """Insert every document written so far, waiting until they have
+        been inserted.
+        """
+        with self._write_lock:
+            if self._closed:
+                return
+            self._queue.put(_FLUSH)
+        self._queue.join()
+
+    def close(self):
+        """Insert every document written so far and stop the background
+        thread. Documents may not be written once the writer is closed.
+        """
+        with _open_writers_lock:
+            _open_writers.discard(self)
+        with self._write_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            item = self._queue.get()
+            batch, received = [], [item]
+            deadline = time.time() + self.flush_interval
+            while item is not _FLUSH and item is not _STOP:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    timeout = max(deadline - time.time(), 0)
+                    item = self._queue.get(True, timeout)
+                except Queue.Empty:
+                    break
+                received.append(item)
+            stopped = _STOP in received
+            try:
+                if batch:
+                    self._insert(batch)
+            except Exception, err:
+                # Keep the thread alive, so that later batches are inserted
+                self._failed(batch, err)
+            finally:
+                for item in received:
+                    self._queue.task_done()
+
+    def _failed(self, batch, err):
+        with self._lock:
+            self.failed += len(batch)
+            self.last_error = err
+
+    def _insert(self, batch):
+        """Insert a batch of queued documents, and update the counters.
+        """
+        docs = [son for doc, son, written in batch]
+        try:
+            ids = self._collection.insert(docs, safe=self.safe)
+        except Exception, err:
+            # Errors from the driver, or from encoding the documents
+            self._failed(batch, err)
+            return
+
+        now = time.time()
+        id_field = self.document._meta['id_field']
+        with self._lock:
+            self.batches += 1
+            for (doc, son, written), object_id in zip(batch, ids):
+                doc[id_field] = doc._fields[id_field].to_python(object_id)
+                latency = now - written
+                self.flushed += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
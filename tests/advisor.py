@@ -0,0 +1,172 @@
+import os
+import sys
+import unittest
+import tempfile
+import datetime
+from StringIO import StringIO
+
+from mongoengine import *
+from mongoengine import monitoring
+from mongoengine.advisor import (QueryShape, ShapeRecorder, advise,
+                                 load_shapes, main)
+
+
+# Named uniquely, as the command line tool advises on every document class
+# by name, and other test modules define their own BlogPost
+class AdvisedComment(EmbeddedDocument):
+    author_name = StringField(db_field='a')
+
+
+class AdvisedPost(Document):
+    title = StringField()
+    author = StringField(db_field='au')
+    date = DateTimeField()
+    slug = StringField(unique=True)
+    published = BooleanField()
+    comments = ListField(EmbeddedDocumentField(AdvisedComment))
+    meta = {
+        'indexes': ['author', ('author', '-date'), 'title'],
+    }
+
+
+class AdvisedAnimal(Document):
+    name = StringField()
+    meta = {'store_types': False}
+
+
+class AdvisedDog(AdvisedAnimal):
+    pass
+
+
+class AdvisorTest(unittest.TestCase):
+
+    def setUp(self):
+        connect(db='mongoenginetest')
+        AdvisedPost.drop_collection()
+
+    def tearDown(self):
+        AdvisedPost.drop_collection()
+
+    def test_query_shape(self):
+        """Ensure that query shapes record the operators used on each field,
+        without their values.
+        """
+        now = datetime.datetime.now()
+        query = AdvisedPost.objects(author='Ross', date__gt=now,
+                                 title__in=['a', 'b'])._query
+        shape = QueryShape.from_query('advisedpost', query,
+                                      [('date', -1)], {'title': 1})
+        self.assertEqual(shape.filter, {'au': ['$eq'], 'date': ['$gt'],
+                                        'title': ['$in']})
+        self.assertEqual(shape.equality_fields, set(['au']))
+        self.assertEqual(shape.range_fields, set(['date', 'title']))
+
+        shape = QueryShape.from_query('advisedpost', {'$or': [{'a': 1},
+                                                            {'b': 2}]})
+        self.assertEqual(shape.filter, {'a': ['$or'], 'b': ['$or']})
+        shape = QueryShape.from_dict(shape.to_dict())
+        self.assertEqual(shape.key, QueryShape.from_query(
+            'advisedpost', {'$or': [{'b': 1}, {'a': 2}]}).key)
+
+    def test_advise(self):
+        """Ensure that unindexed queries, redundant indexes and unused
+        indexes are reported, with recommended indexes.
+        """
+        now = datetime.datetime.now()
+        recorder = ShapeRecorder()
+        monitoring.register(recorder)
+        try:
+            for author in ('Ross', 'Harry'):
+                posts = [p for p in AdvisedPost.objects(author=author)
+                                                    .order_by('-date')]
+            posts = [p for p in AdvisedPost.objects(published=True,
+                                                 date__lt=now)]
+            posts = [p for p in AdvisedPost.objects(author='Ross')
+                                                .order_by('published')]
+            AdvisedPost.objects(slug='hello').count()
+        finally:
+            monitoring.unregister(recorder)
+        shapes = recorder.shapes
+        self.assertEqual(len(shapes), 4)
+        self.assertEqual(sum(shape.count for shape in shapes), 5)
+
+        report = advise(shapes, [AdvisedPost])
+        problems = sorted((problem, index)
+                          for shape, problem, index in report.unindexed)
+        self.assertEqual(problems, [
+            ('no usable index', [('published', 1), ('date', 1)]),
+            ('sorted in memory', [('au', 1), ('published', 1)]),
+        ])
+        self.assertEqual(report.redundant, [
+            ('advisedpost', [('au', 1)], [('au', 1), ('date', -1)]),
+        ])
+        self.assertEqual(report.unused, [('advisedpost', [('title', 1)])])
+        self.assertEqual(report.entries('advisedpost'), [
+            ('author', '-date'), ('published', 'date'),
+            ('author', 'published'),
+        ])
+
+        # The entries build the recommended indexes
+        from mongoengine.queryset import QuerySet
+        self.assertEqual(QuerySet._build_index_spec(AdvisedPost,
+                                                    ('published', 'date')),
+                         [('published', 1), ('date', 1)])
+        text = report.format()
+        self.assertTrue("('published', 'date')," in text)
+        self.assertTrue('Unused index' in text)
+
+    def test_advise_types(self):
+        """Ensure that recommended indexes start with the key used to match
+        the type by the queries that match one.
+        """
+        AdvisedAnimal.drop_collection()
+        recorder = ShapeRecorder()
+        monitoring.register(recorder)
+        try:
+            AdvisedAnimal.objects(name='Rex').count()
+            AdvisedDog.objects(name='Rex').count()
+            AdvisedPost.objects(title='Hello').count()
+        finally:
+            monitoring.unregister(recorder)
+
+        report = advise(recorder.shapes, [AdvisedAnimal, AdvisedDog,
+                                          AdvisedPost])
+        self.assertEqual(report.recommendations('advisedanimal'),
+                         [[('_cls', 1), ('name', 1)]])
+        self.assertEqual(report.entries('advisedanimal'), ['name'])
+        # Queries on a root class without subclasses don't match the type
+        self.assertEqual(report.recommendations('advisedpost'), [])
+        self.assertEqual(report.unused, [
+            ('advisedpost', [('au', 1), ('date', -1)]),
+        ])
+        AdvisedAnimal.drop_collection()
+
+    def test_main(self):
+        """Ensure that the command line tool reads saved shapes.
+        """
+        recorder = ShapeRecorder()
+        recorder.finished(monitoring.QueryEvent(
+            'find', 'advisedpost', {'comments.a': 'Ross'}))
+        recorder.finished(monitoring.QueryEvent('insert', 'advisedpost'))
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            recorder.save(path)
+            shapes = load_shapes(path)
+            self.assertEqual(len(shapes), 1)
+            report = advise(shapes, [AdvisedPost])
+            self.assertEqual(report.entries('advisedpost')[-1],
+                             'comments.author_name')
+
+            sys.stdout = output = StringIO()
+            try:
+                main(['-m', 'tests.advisor', path])
+            finally:
+                sys.stdout = sys.__stdout__
+            self.assertTrue("'comments.author_name'," in output.getvalue())
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
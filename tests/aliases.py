@@ -0,0 +1,200 @@
+import unittest
+import datetime
+
+from mongoengine import *
+from mongoengine import aliases
+from mongoengine.connection import _get_db
+
+
+class LogEntry(Document):
+    timestamp = DateTimeField()
+    message = StringField()
+    level = StringField(db_field='lvl')
+    tags = ListField(StringField())
+    meta = {
+        'compact_keys': True,
+        'indexes': ['timestamp', ('tags', '-timestamp')],
+    }
+
+
+class AliasesTest(unittest.TestCase):
+
+    def setUp(self):
+        connect(db='mongoenginetest')
+        aliases.resolve_aliases(LogEntry)
+        self.db = _get_db()
+        LogEntry.drop_collection()
+
+    def tearDown(self):
+        LogEntry.drop_collection()
+
+    def test_aliases(self):
+        """Ensure that fields are stored under short aliases, which are
+        recorded in the metadata collection.
+        """
+        fields = LogEntry._fields
+        self.assertEqual(fields['level'].db_field, 'lvl')
+        self.assertEqual(fields['id'].db_field, '_id')
+        names = ['message', 'tags', 'timestamp']
+        db_fields = [fields[name].db_field for name in names]
+        for db_field in db_fields:
+            self.assertTrue(len(db_field) == 1)
+        self.assertEqual(len(set(db_fields)), 3)
+
+        record = self.db[aliases.METADATA_COLLECTION].find_one('logentry')
+        for name, db_field in zip(names, db_fields):
+            self.assertEqual(record['aliases'][name], db_field)
+            self.assertEqual(record['used'][db_field], name)
+
+        LogEntry(message='Started', level='info', tags=['boot']).save()
+        doc = self.db.logentry.find_one()
+        keys = ['_id', '_cls', '_types', 'lvl', fields['message'].db_field,
+                fields['tags'].db_field]
+        self.assertEqual(sorted(doc.keys()), sorted(keys))
+
+    def test_stable_aliases(self):
+        """Ensure that fields keep their aliases when connecting again and
+        when fields are added, and that aliases aren't reused.
+        """
+        message = LogEntry._fields['message'].db_field
+        connect(db='mongoenginetest')
+        aliases.resolve_aliases(LogEntry)
+        self.assertEqual(LogEntry._fields['message'].db_field, message)
+
+        # Another version of the document, with one field removed and one
+        # added
+        class NewLogEntry(Document):
+            message = StringField()
+            host = StringField()
+            meta = {'collection': 'logentry', 'compact_keys': True}
+
+        aliases.resolve_aliases(NewLogEntry)
+        self.assertEqual(NewLogEntry._fields['message'].db_field, message)
+        used = [LogEntry._fields[name].db_field
+                for name in ('message', 'tags', 'timestamp')]
+        host = NewLogEntry._fields['host'].db_field
+        self.assertTrue(host not in used)
+        self.assertTrue(host not in ('lvl', '_id', '_cls', '_types'))
+
+    def test_explicit_resolution(self):
+        """Ensure that aliases are only assigned when asked to, and that
+        documents can't be used until they have been.
+        """
+        class AliasedMetric(Document):
+            name = StringField()
+            value = FloatField()
+            meta = {'compact_keys': True}
+
+        metadata = self.db[aliases.METADATA_COLLECTION]
+        metadata.remove({'_id': 'aliasedmetric'})
+        connect(db='mongoenginetest')
+        self.assertEqual(metadata.find_one({'_id': 'aliasedmetric'}), None)
+        self.assertEqual(AliasedMetric._fields['name'].db_field, 'name')
+        self.assertFalse(aliases.is_resolved(AliasedMetric))
+        self.assertRaises(OperationError, lambda: AliasedMetric.objects)
+
+        aliases.resolve_all()
+        self.assertTrue(aliases.is_resolved(AliasedMetric))
+        self.assertNotEqual(AliasedMetric._fields['name'].db_field, 'name')
+        self.assertEqual(AliasedMetric.objects.count(), 0)
+        metadata.remove({'_id': 'aliasedmetric'})
+
+    def test_queries(self):
+        """Ensure that queries, updates, ordering and projections use the
+        aliases.
+        """
+        now = datetime.datetime.now()
+        for i in range(3):
+            LogEntry(timestamp=now + datetime.timedelta(seconds=i),
+                     message='Message %d' % i, level='info',
+                     tags=['a', 'b'][:i]).save()
+
+        entries = LogEntry.objects(message='Message 1')
+        self.assertEqual(entries.count(), 1)
+        self.assertEqual(entries.first().tags, ['a'])
+        self.assertEqual(LogEntry.objects(tags='b').count(), 1)
+
+        messages = [e.message for e in LogEntry.objects.order_by('-timestamp')]
+        self.assertEqual(messages, ['Message 2', 'Message 1', 'Message 0'])
+
+        distinct = sorted(LogEntry.objects.distinct('message'))
+        self.assertEqual(distinct, ['Message 0', 'Message 1', 'Message 2'])
+
+        entry = LogEntry.objects.only('message').order_by('timestamp').first()
+        self.assertEqual(entry.message, 'Message 0')
+        self.assertEqual(entry._data['level'], None)
+
+        LogEntry.objects(message='Message 0').update(set__level='debug')
+        self.assertEqual(LogEntry.objects(level='debug').count(), 1)
+
+    def test_indexes(self):
+        """Ensure that indexes use the aliases.
+        """
+        timestamp = LogEntry._fields['timestamp'].db_field
+        tags = LogEntry._fields['tags'].db_field
+        self.assertTrue([(timestamp, 1)] in LogEntry._meta['indexes'])
+        self.assertTrue([(tags, 1), (timestamp, -1)]
+                        in LogEntry._meta['indexes'])
+
+        info = LogEntry.objects._collection.index_information()
+        self.assertTrue('%s_1' % timestamp in info)
+        self.assertTrue('%s_1_%s_-1' % (tags, timestamp) in info)
+
+    def test_migrate(self):
+        """Ensure that existing documents are rewritten to use the aliases.
+        """
+        for i in range(5):
+            self.db.logentry.insert({'_cls': 'LogEntry',
+                                     'message': 'Message %d' % i,
+                                     'lvl': 'info', 'tags': ['a']})
+        self.assertEqual(aliases.migrate(LogEntry, batch_size=2), 5)
+
+        message = LogEntry._fields['message'].db_field
+        for doc in self.db.logentry.find():
+            self.assertFalse('message' in doc)
+            self.assertTrue(message in doc)
+            self.assertEqual(doc['lvl'], 'info')
+        messages = sorted(e.message for e in LogEntry.objects)
+        self.assertEqual(messages, ['Message %d' % i for i in range(5)])
+
+    def test_migrate_to_taken_names(self):
+        """Ensure that fields may be migrated to aliases that are the
+        previous names of other fields, and that new aliases are never the
+        name of a field.
+        """
+        class AliasedMessage(Document):
+            b = StringField()
+            message = StringField()
+            meta = {'compact_keys': True}
+
+        metadata = self.db[aliases.METADATA_COLLECTION]
+        metadata.remove({'_id': 'aliasedmessage'})
+        metadata.insert({'_id': 'aliasedmessage',
+                         'aliases': {'b': 'a', 'message': 'b'},
+                         'used': {'a': 'b', 'b': 'message'}})
+        AliasedMessage.drop_collection()
+        self.db.aliasedmessage.insert({'_cls': 'AliasedMessage', 'b': 'B',
+                                       'message': 'Hello'})
+        self.assertEqual(aliases.migrate(AliasedMessage), 1)
+        doc = self.db.aliasedmessage.find_one()
+        self.assertEqual((doc['a'], doc['b']), ('B', 'Hello'))
+        self.assertFalse('message' in doc)
+        message = AliasedMessage.objects.get()
+        self.assertEqual((message.b, message.message), ('B', 'Hello'))
+
+        class AliasedPoint(Document):
+            a = IntField()
+            b = IntField()
+            meta = {'compact_keys': True}
+
+        metadata.remove({'_id': 'aliasedpoint'})
+        new = aliases.resolve_aliases(AliasedPoint)
+        self.assertEqual(sorted(new.values()), ['c', 'd'])
+
+        AliasedMessage.drop_collection()
+        metadata.remove({'_id': {'$in': ['aliasedmessage',
+                                         'aliasedpoint']}})
+
+
+if __name__ == '__main__':
+    unittest.main()
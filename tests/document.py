@@ -4,6 +4,7 @@ import pymongo
 
 from mongoengine import *
 from mongoengine.connection import _get_db
+from mongoengine.unitofwork import UnitOfWork, current_unit_of_work
 
 
 class DocumentTest(unittest.TestCase):
@@ -289,32 +290,34 @@ class DocumentTest(unittest.TestCase):
         BlogPost.drop_collection()
 
         info = BlogPost.objects._collection.index_information()
-        # _id, types, '-date', 'tags', ('cat', 'date')
-        self.assertEqual(len(info), 5)
+        # _id, '-date', 'tags', ('cat', 'date')
+        self.assertEqual(len(info), 4)
 
         # Indexes are lazy so use list() to perform query
         list(BlogPost.objects)
         info = BlogPost.objects._collection.index_information()
         info = [value['key'] for key, value in info.iteritems()]
-        self.assertTrue([('_types', 1), ('category', 1), ('addDate', -1)] 
-                        in info)
-        self.assertTrue([('_types', 1), ('addDate', -1)] in info)
-        # tags is a list field so it shouldn't have _types in the index
+        # BlogPost is a root class, so its indexes don't need _types
+        self.assertTrue([('category', 1), ('addDate', -1)] in info)
+        self.assertTrue([('addDate', -1)] in info)
         self.assertTrue([('tags', 1)] in info)
         
         class ExtendedBlogPost(BlogPost):
             title = StringField()
-            meta = {'indexes': ['title']}
+            tags = ListField(StringField())
+            meta = {'indexes': ['title', 'tags']}
 
         BlogPost.drop_collection()
 
         list(ExtendedBlogPost.objects)
         info = ExtendedBlogPost.objects._collection.index_information()
         info = [value['key'] for key, value in info.iteritems()]
-        self.assertTrue([('_types', 1), ('category', 1), ('addDate', -1)] 
-                        in info)
-        self.assertTrue([('_types', 1), ('addDate', -1)] in info)
+        self.assertTrue([('category', 1), ('addDate', -1)] in info)
+        self.assertTrue([('addDate', -1)] in info)
         self.assertTrue([('_types', 1), ('title', 1)] in info)
+        # tags is a list field so it shouldn't have _types in the index
+        self.assertTrue([('tags', 1)] in info)
+        self.assertTrue([('_types', 1)] in info)
 
         BlogPost.drop_collection()
 
@@ -504,6 +507,218 @@ class DocumentTest(unittest.TestCase):
         except ValidationError:
             fail()
 
+    def test_versioned_save(self):
+        """Ensure that saving a versioned document fails if it has been
+        changed since it was loaded, and that saves may be retried.
+        """
+        class Page(Document):
+            title = StringField()
+            views = IntField(default=0)
+            meta = {'versioned': True}
+
+        Page.drop_collection()
+
+        page = Page(title='Test')
+        page.save()
+        self.assertEqual(page._version, 1)
+        page.views = 1
+        page.save()
+        self.assertEqual(page._version, 2)
+
+        first = Page.objects.get()
+        second = Page.objects.get()
+        self.assertEqual(first._version, 2)
+        first.views = 10
+        first.save()
+        second.title = 'Changed'
+        self.assertRaises(ConflictError, second.save)
+        self.assertEqual(Page.objects.get().title, 'Test')
+
+        # Atomic updates also make a new version
+        Page.objects.update_one(inc__views=1)
+        self.assertEqual(Page.objects.only('title').get()._version, 4)
+        self.assertRaises(ConflictError, first.save)
+
+        def add_view(page):
+            page.views += 1
+            return page.views
+        self.assertEqual(second.retry_save(add_view), 12)
+        page = Page.objects.get()
+        self.assertEqual((page.views, page._version), (12, 5))
+
+        # Give up after the given number of retries
+        def conflicting_change(page):
+            Page.objects.update_one(inc__views=1)
+            page.title = 'Lost'
+        self.assertRaises(ConflictError, page.retry_save,
+                          conflicting_change, retries=2)
+        page = Page.objects.get()
+        self.assertEqual((page.views, page.title), (15, 'Test'))
+
+        # A deleted document can't be saved again
+        page.delete()
+        self.assertRaises(Page.DoesNotExist, page.retry_save, add_view)
+
+        # Documents stored before versioning was enabled are at version 0
+        Page.objects._collection.insert({'_cls': 'Page', '_types': ['Page'],
+                                         'title': 'Legacy', 'views': 3})
+        legacy = Page.objects.get()
+        self.assertEqual(legacy._version, None)
+        legacy.views = 4
+        legacy.save()
+        self.assertEqual(legacy._version, 1)
+        page = Page.objects.get()
+        self.assertEqual((page.views, page._version), (4, 1))
+        stale = Page.objects._collection.find_one()
+        del stale['_version']
+        stale = Page._from_son(stale)
+        stale.title = 'Stale'
+        self.assertRaises(ConflictError, stale.save)
+
+        # New documents with their own id are inserted
+        page = Page(id=pymongo.objectid.ObjectId(), title='Own id')
+        page.save()
+        self.assertEqual(page._version, 1)
+        self.assertEqual(Page.objects(title='Own id').count(), 1)
+
+        Page.drop_collection()
+
+    def test_versioned_save_custom_pk(self):
+        """Ensure that new versioned documents with a custom primary key
+        are stored whole, including their class.
+        """
+        class Animal(Document):
+            name = StringField(primary_key=True)
+            meta = {'versioned': True}
+
+        class Dog(Animal):
+            breed = StringField()
+
+        Animal.drop_collection()
+        dog = Dog(name='rex', breed='collie')
+        dog.save()
+        self.assertEqual(dog._version, 1)
+        self.assertEqual(Dog.objects.count(), 1)
+        self.assertEqual(Animal.objects.count(), 1)
+        son = Animal.objects._collection.find_one()
+        self.assertEqual(son['_cls'], 'Animal.Dog')
+        self.assertEqual(son['_version'], 1)
+
+        animal = Animal.objects.get()
+        self.assertTrue(isinstance(animal, Dog))
+        self.assertEqual(animal.breed, 'collie')
+        animal.breed = 'beagle'
+        animal.save()
+        self.assertEqual(Dog.objects.get()._version, 2)
+        self.assertRaises(ConflictError, Dog(name='rex').save)
+
+        Animal.drop_collection()
+
+    def test_unit_of_work(self):
+        """Ensure that saves and deletes inside a unit of work are written
+        when it is committed, and discarded if it is rolled back.
+        """
+        self.Person.drop_collection()
+        existing = self.Person(name='Existing', age=30)
+        existing.save()
+        doomed = self.Person(name='Doomed', age=40)
+        doomed.save()
+
+        with UnitOfWork() as unit:
+            people = [self.Person(name='Person %d' % i) for i in range(3)]
+            for person in people:
+                person.save()
+            existing.age = 31
+            existing.save()
+            existing.age = 32
+            existing.save()
+            doomed.delete()
+            # Documents deleted before they were ever written are forgotten
+            transient = self.Person(name='Transient')
+            transient.save()
+            transient.delete()
+
+            self.assertEqual(unit.pending, 5)
+            self.assertEqual(self.Person.objects.count(), 2)
+            self.assertEqual(self.Person.objects.get(name='Existing').age, 30)
+            self.assertRaises(ValidationError, self.Person(age='x').save)
+
+        self.assertTrue(all(person.id is not None for person in people))
+        self.assertEqual(transient.id, None)
+        names = sorted(person.name for person in self.Person.objects)
+        self.assertEqual(names, ['Existing', 'Person 0', 'Person 1',
+                                 'Person 2'])
+        self.assertEqual(self.Person.objects.get(name='Existing').age, 32)
+        self.assertEqual(current_unit_of_work(), None)
+
+        # Writes are discarded when an exception is raised
+        def fail():
+            with UnitOfWork():
+                existing.age = 50
+                existing.save()
+                raise ValueError
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(self.Person.objects.get(name='Existing').age, 32)
+
+        self.Person.drop_collection()
+
+    def test_unit_of_work_errors(self):
+        """Ensure that committing a unit of work raises on the first write
+        that fails, and that documents are only marked as saved once they
+        have been written.
+        """
+        class Account(Document):
+            username = StringField(unique=True)
+            balance = IntField()
+
+        Account.drop_collection()
+        existing = Account(username='ross', balance=10)
+        existing.save()
+
+        def commit():
+            with UnitOfWork():
+                duplicate.save()
+                existing.balance = 20
+                existing.save()
+        duplicate = Account(username='ross')
+        self.assertRaises(OperationError, commit)
+        self.assertEqual(duplicate.id, None)
+        self.assertEqual(Account.objects.get(username='ross').balance, 10)
+
+        # Unconfirmed writes are sent without waiting for each reply
+        with UnitOfWork(safe=False):
+            Account(username='harry').save()
+        self.assertEqual(Account.objects.count(), 2)
+
+        Account.drop_collection()
+
+    def test_unit_of_work_middleware(self):
+        """Ensure that the unit of work of a request whose response was
+        never processed doesn't capture the writes of the next request.
+        """
+        from mongoengine.django.middleware import UnitOfWorkMiddleware
+
+        class Request(object):
+            pass
+
+        self.Person.drop_collection()
+        middleware = UnitOfWorkMiddleware()
+        abandoned = Request()
+        middleware.process_request(abandoned)
+        self.Person(name='Abandoned').save()
+
+        request = Request()
+        middleware.process_request(request)
+        self.assertEqual(current_unit_of_work(), request.unit_of_work)
+        self.Person(name='Next').save()
+        middleware.process_response(request, None)
+        self.assertEqual(current_unit_of_work(), None)
+        names = [person.name for person in self.Person.objects]
+        self.assertEqual(names, ['Next'])
+        self.assertEqual(abandoned.unit_of_work.pending, 0)
+
+        self.Person.drop_collection()
+
     def test_delete(self):
         """Ensure that document may be deleted using the delete method.
         """
@@ -564,6 +779,86 @@ class DocumentTest(unittest.TestCase):
 
         BlogPost.drop_collection()
 
+    def test_save_list_operations(self):
+        """Ensure that changes to a saved document's list fields are saved
+        with list operators, falling back to setting the whole list.
+        """
+        class Comment(EmbeddedDocument):
+            content = StringField()
+
+        class BlogPost(Document):
+            comments = ListField(EmbeddedDocumentField(Comment))
+            tags = ListField(StringField())
+
+        BlogPost.drop_collection()
+
+        post = BlogPost(tags=['fun'], comments=[Comment(content='Yay')])
+        post.save()
+        self.assertEqual(post._build_update(post.to_mongo()), {})
+
+        post.tags.append('leisure')
+        post.comments.append(Comment(content='Nice'))
+        update = post._build_update(post.to_mongo())
+        self.assertEqual(update.keys(), ['$push'])
+        self.assertEqual(update['$push']['tags'], 'leisure')
+        self.assertEqual(update['$push']['comments']['content'], 'Nice')
+
+        # Concurrent appends are not lost
+        other = BlogPost.objects.get()
+        other.tags.extend(['sun', 'sea'])
+        post.save()
+        self.assertEqual(other._build_update(other.to_mongo()),
+                         {'$pushAll': {'tags': ['sun', 'sea']}})
+        other.save()
+        post = BlogPost.objects.get()
+        self.assertEqual(post.tags, ['fun', 'leisure', 'sun', 'sea'])
+        self.assertEqual(len(post.comments), 2)
+
+        post.tags.remove('sun')
+        post.tags.add_to_set('fun')
+        self.assertEqual(post._build_update(post.to_mongo()),
+                         {'$pull': {'tags': 'sun'}})
+        post.save()
+        post.tags.add_to_set('rain')
+        post.tags.add_to_set('snow')
+        self.assertEqual(post._build_update(post.to_mongo()),
+                         {'$addToSet': {'tags': {'$each': ['rain', 'snow']}}})
+        post.save()
+        self.assertEqual(BlogPost.objects.get().tags,
+                         ['fun', 'leisure', 'sea', 'rain', 'snow'])
+
+        # Sorting, mixing operations, in-place changes and reassignment
+        # write the whole list
+        post.tags.sort()
+        post.comments.append(Comment(content='Great'))
+        post.comments.remove(post.comments[0])
+        update = post._build_update(post.to_mongo())
+        self.assertEqual(sorted(update['$set'].keys()), ['comments', 'tags'])
+        post.save()
+
+        post = BlogPost.objects.get()
+        post.comments[0].content = 'Changed'
+        post.tags = ['new']
+        update = post._build_update(post.to_mongo())
+        self.assertEqual(sorted(update['$set'].keys()), ['comments', 'tags'])
+        post.save()
+        post = BlogPost.objects.get()
+        self.assertEqual(post.tags, ['new'])
+        self.assertEqual(post.comments[0].content, 'Changed')
+
+        # Documents deleted in the meantime are inserted again, as documents
+        # without list fields are, unless they were only partially loaded
+        post.tags.append('again')
+        BlogPost.objects.delete()
+        post.save()
+        self.assertEqual(BlogPost.objects.get().tags, ['new', 'again'])
+        post = BlogPost.objects.only('tags').get()
+        post.tags.append('partial')
+        BlogPost.objects.delete()
+        self.assertRaises(OperationError, post.save)
+
+        BlogPost.drop_collection()
+
     def test_save_embedded_document(self):
         """Ensure that a document with an embedded document field may be 
         saved in the database.
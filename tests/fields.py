@@ -1,5 +1,7 @@
+import os
 import unittest
 import datetime
+from StringIO import StringIO
 from decimal import Decimal
 
 import pymongo
@@ -7,6 +9,7 @@ import gridfs
 
 from mongoengine import *
 from mongoengine.connection import _get_db
+from mongoengine.fields import CompressedValue
 
 
 class FieldTest(unittest.TestCase):
@@ -261,6 +264,56 @@ class FieldTest(unittest.TestCase):
 
         BlogPost.drop_collection()
 
+    def test_sorted_list_insertion(self):
+        """Ensure that items added to a saved sorted list are inserted in
+        order and saved with an ordered push.
+        """
+        class Score(EmbeddedDocument):
+            points = IntField()
+
+        class Leaderboard(Document):
+            scores = SortedListField(EmbeddedDocumentField(Score),
+                                     ordering='points')
+            names = SortedListField(StringField())
+
+        Leaderboard.drop_collection()
+
+        board = Leaderboard(names=['mike', 'anne'],
+                            scores=[Score(points=5), Score(points=1)])
+        board.save()
+        board = Leaderboard.objects.get()
+
+        board.names.append('john')
+        board.scores.extend([Score(points=3), Score(points=9)])
+        self.assertEqual(board.names, ['anne', 'john', 'mike'])
+        self.assertEqual([s.points for s in board.scores], [1, 3, 5, 9])
+        update = board._build_update(board.to_mongo())
+        self.assertEqual(update['$push']['names'],
+                         {'$each': ['john'], '$sort': 1})
+        self.assertEqual(update['$push']['scores']['$sort'], {'points': 1})
+
+        # Items pushed concurrently are kept, and the stored list is sorted
+        Leaderboard.objects.update_one(push__names='bob')
+        board.save()
+        board = Leaderboard.objects.get()
+        self.assertEqual(board.names, ['anne', 'bob', 'john', 'mike'])
+        self.assertEqual([s.points for s in board.scores], [1, 3, 5, 9])
+
+        # Reassigned lists are sorted and written as a whole
+        board.names = ['zoe', 'adam']
+        board.save()
+        self.assertEqual(Leaderboard.objects.get().names, ['adam', 'zoe'])
+
+        # Items whose sort keys are changed in place are sorted when saved
+        board = Leaderboard.objects.get()
+        board.scores.append(Score(points=4))
+        board.scores[0].points = 10
+        board.save()
+        board = Leaderboard.objects.get()
+        self.assertEqual([s.points for s in board.scores], [3, 4, 5, 9, 10])
+
+        Leaderboard.drop_collection()
+
     def test_dict_validation(self):
         """Ensure that dict types work as expected.
         """
@@ -605,6 +658,30 @@ class FieldTest(unittest.TestCase):
 
         Attachment.drop_collection()
 
+    def test_binary_buffer(self):
+        """Ensure that binary fields in buffer mode load memoryviews of their
+        values, which may be saved again.
+        """
+        class Attachment(Document):
+            blob = BinaryField(buffer=True, max_bytes=8)
+
+        Attachment.drop_collection()
+
+        BLOB = '\xe6\x00\xc4\xff\x07'
+        Attachment(blob=BLOB).save()
+
+        attachment = Attachment.objects.first()
+        self.assertTrue(isinstance(attachment.blob, memoryview))
+        self.assertEqual(attachment.blob.tobytes(), BLOB)
+        attachment.validate()
+        attachment.save()
+        self.assertEqual(Attachment.objects.first().blob.tobytes(), BLOB)
+
+        attachment.blob = memoryview(BLOB * 2)
+        self.assertRaises(ValidationError, attachment.validate)
+
+        Attachment.drop_collection()
+
     def test_binary_validation(self):
         """Ensure that invalid values cannot be assigned to binary fields.
         """
@@ -640,6 +717,61 @@ class FieldTest(unittest.TestCase):
         AttachmentRequired.drop_collection()
         AttachmentSizeLimit.drop_collection()
 
+    def test_compressed_fields(self):
+        """Ensure that large values of compressed fields are stored
+        compressed, and decompressed when first accessed.
+        """
+        class Page(Document):
+            title = CompressedField(StringField())
+            html = CompressedField(StringField(), threshold=100)
+            headers = CompressedField(DictField(), threshold=100)
+            blob = CompressedField(BinaryField(), threshold=100)
+
+        Page.drop_collection()
+
+        html = u'<p>Caf\xe9</p>' * 100
+        headers = {'content-type': 'text/html', 'links': ['/a'] * 50}
+        blob = '\xe6\x00\xc4\xff\x07' * 100
+        Page(title=u'Home', html=html, headers=headers, blob=blob).save()
+
+        son = Page.objects._collection.find_one()
+        self.assertEqual(son['title'], u'Home')
+        for name in ('html', 'headers', 'blob'):
+            self.assertTrue(isinstance(son[name], pymongo.binary.Binary))
+            self.assertEqual(son[name].subtype,
+                             pymongo.binary.USER_DEFINED_SUBTYPE)
+        self.assertTrue(len(son['html']) < len(html))
+
+        page = Page.objects.first()
+        self.assertTrue(isinstance(page._data['html'], CompressedValue))
+        self.assertEqual(page.title, u'Home')
+        self.assertEqual(page.html, html)
+        self.assertEqual(page.headers, headers)
+        self.assertEqual(page.blob, blob)
+        self.assertEqual(Page.objects(title=u'Home').count(), 1)
+
+        # Values that weren't accessed are saved as they were loaded
+        page = Page.objects.first()
+        page.title = u'Index'
+        page.save()
+        self.assertTrue(isinstance(page._data['html'], CompressedValue))
+        page = Page.objects.first()
+        self.assertEqual(page.title, u'Index')
+        self.assertEqual(page.html, html)
+
+        # Values that don't compress are stored as they are
+        page.blob = os.urandom(200)
+        page.save()
+        son = Page.objects._collection.find_one()
+        self.assertEqual(str(son['blob']), page.blob)
+        self.assertNotEqual(son['blob'].subtype,
+                            pymongo.binary.USER_DEFINED_SUBTYPE)
+
+        page.title = 2
+        self.assertRaises(ValidationError, page.validate)
+
+        Page.drop_collection()
+
     def test_choices_validation(self):
         """Ensure that value is in a container of allowed values.
         """
@@ -731,6 +863,38 @@ class FieldTest(unittest.TestCase):
             file = FileField()
         d = DemoFile.objects.create()
 
+    def test_file_streaming(self):
+        """Ensure that files may be read chunk by chunk into buffers and
+        file-like objects.
+        """
+        class Media(Document):
+            file = FileField()
+
+        Media.drop_collection()
+
+        data = ''.join(chr(i % 256) for i in range(600000))
+        media = Media()
+        media.file.put(data, chunk_size=256 * 1024)
+        media.save()
+
+        media = Media.objects.first()
+        self.assertEqual(len(list(media.file.chunks())), 3)
+
+        buffer = bytearray(len(data))
+        self.assertEqual(media.file.readinto(buffer), len(data))
+        self.assertEqual(str(buffer), data)
+
+        buffer = bytearray(1000)
+        self.assertEqual(media.file.readinto(buffer), 1000)
+        self.assertEqual(str(buffer), data[:1000])
+
+        output = StringIO()
+        self.assertEqual(media.file.write_to(output), len(data))
+        self.assertEqual(output.getvalue(), data)
+
+        media.file.delete()
+        Media.drop_collection()
+
     def test_file_uniqueness(self):
         """Ensure that each instance of a FileField is unique
         """
@@ -0,0 +1,144 @@
+import unittest
+import datetime
+import pymongo.errors
+
+from mongoengine import *
+from mongoengine.connection import _get_db
+from mongoengine.memory import MemoryConnection
+
+
+class Comment(EmbeddedDocument):
+    author = StringField()
+    votes = IntField()
+
+
+class Post(Document):
+    title = StringField(unique=True)
+    author = StringField()
+    tags = ListField(StringField())
+    comments = ListField(EmbeddedDocumentField(Comment))
+    views = IntField(default=0)
+    published = DateTimeField()
+    meta = {'indexes': [('author', '-views')]}
+
+
+class MemoryBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        connect(db='mongoenginetest', backend='memory')
+        self.db = _get_db()
+        Post.drop_collection()
+
+    def tearDown(self):
+        Post.drop_collection()
+
+    def test_connect(self):
+        """Ensure that the memory backend is selected through connect, and
+        that connections to the same address share data.
+        """
+        self.assertTrue(isinstance(self.db.connection, MemoryConnection))
+        Post(title='Shared').save()
+        other = MemoryConnection()['mongoenginetest']
+        self.assertEqual(other.post.find_one()['title'], 'Shared')
+        self.assertRaises(ConnectionError, connect, 'mongoenginetest',
+                          backend='unknown')
+
+    def test_queries(self):
+        """Ensure that the operators emitted by the query compiler are
+        evaluated.
+        """
+        published = datetime.datetime(2010, 1, 1)
+        Post(title='A', author='ross', tags=['db', 'python'], views=10,
+             comments=[Comment(author='harry', votes=3)],
+             published=published).save()
+        Post(title='B', author='ross', tags=['python'], views=5).save()
+        Post(title='C', author='harry', tags=[], views=20).save()
+
+        def titles(queryset):
+            return sorted(post.title for post in queryset)
+        self.assertEqual(titles(Post.objects(tags='db')), ['A'])
+        self.assertEqual(titles(Post.objects(tags__size=0)), ['C'])
+        self.assertEqual(titles(Post.objects(tags__all=['db', 'python'])),
+                         ['A'])
+        self.assertEqual(titles(Post.objects(views__gte=10)), ['A', 'C'])
+        self.assertEqual(titles(Post.objects(views__nin=[5, 10])), ['C'])
+        self.assertEqual(titles(Post.objects(author__istartswith='R')),
+                         ['A', 'B'])
+        self.assertEqual(titles(Post.objects(published__exists=True)), ['A'])
+        self.assertEqual(titles(Post.objects(views__not__gt=5)), ['B'])
+        self.assertEqual(titles(Post.objects(comments__author='harry')),
+                         ['A'])
+        self.assertEqual(titles(Post.objects(Q(author='harry') |
+                                             Q(views__lt=10))), ['B', 'C'])
+        self.assertEqual([post.title for post in Post.objects.order_by(
+            'author', '-views')], ['C', 'A', 'B'])
+        self.assertEqual(Post.objects.distinct('author'), ['ross', 'harry'])
+        self.assertEqual(Post.objects(author='ross').count(), 2)
+
+    def test_updates(self):
+        """Ensure that the update operators are applied.
+        """
+        post = Post(title='A', author='ross', tags=['db'])
+        post.save()
+        Post.objects(title='A').update(inc__views=2, push__tags='python',
+                                       set__author='harry')
+        Post.objects(title='A').update(pull__tags='db')
+        Post.objects(title='A').update(push__comments=Comment(votes=1))
+        self.db.post.update({'comments.votes': 1},
+                            {'$inc': {'comments.$.votes': 1}})
+        post.reload()
+        self.assertEqual((post.views, post.author), (2, 'harry'))
+        self.assertEqual(post.tags, ['python'])
+        self.assertEqual(post.comments[0].votes, 2)
+
+        Post.objects(title='B').update(set__views=1, upsert=True)
+        self.assertEqual(Post.objects.get(title='B').views, 1)
+
+        # Renames may not overlap, as they would depend on their order
+        self.db.post.update({'title': 'A'},
+                            {'$rename': {'author': 'writer'}}, safe=True)
+        self.assertEqual(self.db.post.find_one({'title': 'A'})['writer'],
+                         'harry')
+        for update in ({'$rename': {'title': 'writer', 'writer': 'title'}},
+                       {'$rename': {'tags': 'meta.tags', 'views': 'meta'}},
+                       {'$rename': {'writer': 'writer'}},
+                       {'$rename': {'writer': 'by'}, '$set': {'by': 'x'}}):
+            self.assertRaises(pymongo.errors.OperationFailure,
+                              self.db.post.update, {'title': 'A'}, update,
+                              safe=True)
+        doc = self.db.post.find_one({'title': 'A'})
+        self.assertEqual((doc['title'], doc['writer']), ('A', 'harry'))
+
+    def test_file_fields(self):
+        """Ensure that documents with file fields may be created, although
+        GridFS isn't supported.
+        """
+        class Attachment(Document):
+            name = StringField()
+            data = FileField()
+
+        attachment = Attachment(name='notes.txt')
+        attachment.save()
+        self.assertEqual(Attachment.objects.get().name, 'notes.txt')
+        self.assertEqual(attachment.data.get(), None)
+
+    def test_indexes(self):
+        """Ensure that unique indexes are enforced and that compound indexes
+        are used to answer queries.
+        """
+        Post(title='A', author='ross').save()
+        self.assertRaises(OperationError, Post(title='A').save)
+
+        for i in range(20):
+            Post(title=str(i), author='harry', views=i).save()
+        plan = Post.objects(author='ross').explain()
+        self.assertEqual(plan['cursor'],
+                         'BtreeCursor author_1_views_-1')
+        self.assertEqual(plan['nscanned'], 1)
+        info = self.db.post.index_information()
+        self.assertTrue('title_1' in info)
+        self.assertTrue(info['title_1']['unique'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+import unittest
+import logging
+import warnings
+
+from mongoengine import *
+from mongoengine import monitoring
+
+
+class Recorder(monitoring.QueryListener):
+
+    def __init__(self):
+        self.started_events = []
+        self.events = []
+
+    def started(self, event):
+        self.started_events.append(event)
+
+    def finished(self, event):
+        self.events.append(event)
+
+    def operations(self):
+        return [(event.collection, event.operation, event.documents)
+                for event in self.events]
+
+
+class Author(Document):
+    name = StringField()
+
+
+class Book(Document):
+    title = StringField()
+    author = ReferenceField(Author)
+    editors = ListField(ReferenceField(Author))
+
+
+class MonitoringTest(unittest.TestCase):
+
+    def setUp(self):
+        connect(db='mongoenginetest')
+        Author.drop_collection()
+        Book.drop_collection()
+        self.recorder = Recorder()
+        monitoring.register(self.recorder)
+
+    def tearDown(self):
+        monitoring.unregister(self.recorder)
+        Author.drop_collection()
+        Book.drop_collection()
+
+    def test_events(self):
+        """Ensure that listeners are told about the operations made by
+        querysets and documents.
+        """
+        author = Author(name='Ross')
+        author.save()
+        for i in range(3):
+            Book(title='Book %d' % i, author=author).save()
+        self.assertEqual(self.recorder.operations(),
+                         [('author', 'save', 1)] + [('book', 'save', 1)] * 3)
+
+        del self.recorder.events[:]
+        books = [book for book in Book.objects.only('author')]
+        self.assertEqual(len(books), 3)
+        self.assertEqual(Book.objects(title='Book 0').count(), 1)
+        Book.objects(title='Book 1').update(set__title='Updated')
+        Book.objects(title='Book 2').delete(safe=True)
+        self.assertEqual(books[0].author.name, 'Ross')
+        self.assertEqual(self.recorder.operations(), [
+            ('book', 'find', 3),
+            ('book', 'count', 0),
+            ('book', 'update', 1),
+            ('book', 'remove', 1),
+            ('author', 'dereference', 1),
+        ])
+
+        find = self.recorder.events[0]
+        self.assertEqual(find.projection, {'author': 1, '_cls': 1})
+        self.assertTrue(find.duration > 0 and find.decode_time > 0)
+        self.assertEqual(self.recorder.events[2].query['title'], 'Book 1')
+        self.assertEqual(self.recorder.started_events[-5:],
+                         self.recorder.events)
+
+        del self.recorder.events[:]
+        self.assertEqual(Book.objects.first().title, 'Book 0')
+        self.assertEqual(self.recorder.operations(), [('book', 'find', 1)])
+
+        # Finds finish when their cursor is exhausted or closed, not when
+        # it's garbage collected
+        del self.recorder.events[:]
+        cursor = Book.objects._collection.find()
+        cursor.next()
+        del cursor
+        self.assertEqual(self.recorder.events, [])
+        cursor = Book.objects._collection.find()
+        cursor.next()
+        cursor.close()
+        self.assertEqual(self.recorder.operations(), [('book', 'find', 1)])
+
+        # Listeners aren't told about anything once they are unregistered,
+        # and collections are no longer wrapped
+        monitoring.unregister(self.recorder)
+        del self.recorder.events[:]
+        list(Book.objects)
+        self.assertEqual(self.recorder.events, [])
+        self.assertFalse(isinstance(Book.objects._collection,
+                                    monitoring.MonitoredCollection))
+
+    def test_query_stats(self):
+        """Ensure that the built-in aggregator keeps histograms per
+        collection and operation.
+        """
+        stats = monitoring.QueryStats()
+        monitoring.register(stats)
+        for i in range(10):
+            Author(name=str(i)).save()
+        authors = [author for author in Author.objects]
+        Book.objects.count()
+        monitoring.unregister(stats)
+
+        saves = stats.histogram('author', 'save')
+        self.assertEqual(saves.count, 10)
+        self.assertTrue(0 < saves.percentile(50) <= saves.max)
+        self.assertEqual(stats.histogram('author', 'find').documents, 10)
+        self.assertEqual(stats.histogram('author').count, 11)
+        self.assertEqual(stats.histogram(operation='count').count, 1)
+        self.assertTrue('author' in stats.report())
+
+        stats.reset()
+        self.assertEqual(stats.histogram().count, 0)
+
+    def test_slow_query_log(self):
+        """Ensure that slow queries are logged with their plan, which is
+        explained once per query shape.
+        """
+        class LogEntry(Document):
+            message = StringField()
+            meta = {'allow_inheritance': False}
+
+        LogEntry.drop_collection()
+        for i in range(10):
+            LogEntry(message=str(i)).save()
+
+        class Handler(logging.Handler):
+            records = []
+            def emit(self, record):
+                self.records.append(record.slow_query)
+
+        handler = Handler()
+        logger = logging.getLogger('mongoengine.slowquery')
+        logger.addHandler(handler)
+        connect(db='mongoenginetest', slow_query_threshold=0)
+        try:
+            slow_log = monitoring._slow_query_log
+            for message in ('1', '2'):
+                entries = [e for e in LogEntry.objects(message=message)]
+                self.assertEqual(LogEntry.objects(message=message).count(),
+                                 1)
+            entries = [e for e in LogEntry.objects.order_by('-message')]
+        finally:
+            logger.removeHandler(handler)
+            connect(db='mongoenginetest')
+        self.assertEqual(monitoring._slow_query_log, None)
+        self.assertFalse(slow_log in monitoring._listeners)
+
+        records = Handler.records
+        self.assertEqual([r['operation'] for r in records],
+                         ['find', 'count'] * 2 + ['find'])
+        self.assertEqual(records[2]['collection'], 'logentry')
+        self.assertEqual(records[2]['shape'], {'message': '?'})
+        self.assertEqual(slow_log.explains, 2)
+        plan = records[0]['plan']
+        self.assertTrue(plan['full_scan'])
+        self.assertEqual((plan['nscanned'], plan['n']), (10, 1))
+        self.assertFalse(plan['scan_and_order'])
+        self.assertTrue(records[3]['plan'] is plan)
+        self.assertEqual(records[4]['sort'], [('message', -1)])
+        self.assertTrue(records[4]['plan']['scan_and_order'])
+        LogEntry.drop_collection()
+
+    def test_dereference_detector(self):
+        """Ensure that fields dereferenced many times by one line of code are
+        reported, naming the field and the queryset.
+        """
+        author = Author(name='Ross')
+        author.save()
+        for i in range(5):
+            Book(title='Book %d' % i, author=author,
+                 editors=[author]).save()
+
+        detector = monitoring.DereferenceDetector(threshold=3)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', monitoring.NPlusOneWarning)
+            with detector:
+                names = [book.author.name
+                         for book in Book.objects(title__ne='Other')]
+                # A few dereferences are fine
+                books = [book for book in Book.objects[:3]]
+                editors = [book.editors[0].name for book in books]
+        self.assertEqual(names, ['Ross'] * 5)
+        self.assertEqual(len(caught), 1)
+        message = str(caught[0].message)
+        self.assertTrue('Book.author was dereferenced 4 times' in message)
+        self.assertTrue('Book.objects(__raw__=' in message)
+        self.assertEqual(caught[0].filename, __file__.rstrip('c'))
+
+        counts = sorted((source[1], count) for (source, site), count
+                        in detector.counts.items())
+        self.assertEqual(counts, [('author', 5), ('editors', 3)])
+        self.assertFalse(detector in monitoring._listeners)
+
+        detector = monitoring.DereferenceDetector(threshold=2,
+                                                  raise_error=True)
+        def read_authors():
+            with detector:
+                for book in Book.objects:
+                    book.author
+        self.assertRaises(monitoring.NPlusOneError, read_authors)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,11 +3,14 @@
 
 import unittest
 import pymongo
+import time
+import threading
 from datetime import datetime, timedelta
 
 from mongoengine.queryset import (QuerySet, MultipleObjectsReturned,
                                   DoesNotExist)
 from mongoengine import *
+from mongoengine.base import PartialList
 
 
 class QuerySetTest(unittest.TestCase):
@@ -427,10 +430,10 @@ class QuerySetTest(unittest.TestCase):
 
         obj = self.Person.objects.only('name').get()
         self.assertEqual(obj.name, person.name)
-        self.assertEqual(obj.age, None)
+        self.assertEqual(obj._data['age'], None)
 
         obj = self.Person.objects.only('age').get()
-        self.assertEqual(obj.name, None)
+        self.assertEqual(obj._data['name'], None)
         self.assertEqual(obj.age, person.age)
 
         obj = self.Person.objects.only('name', 'age').get()
@@ -450,7 +453,247 @@ class QuerySetTest(unittest.TestCase):
         # Check field names are looked up properly
         obj = Employee.objects(id=employee.id).only('salary').get()
         self.assertEqual(obj.salary, employee.salary)
-        self.assertEqual(obj.name, None)
+        self.assertEqual(obj._data['name'], None)
+
+    def test_covered(self):
+        """Ensure that covered queries return the values of indexed fields
+        and are answered from the index alone.
+        """
+        class User(Document):
+            email = StringField(db_field='e')
+            name = StringField()
+            tags = ListField(StringField())
+            meta = {'indexes': [('email', 'id'), 'tags'],
+                    'allow_inheritance': False}
+
+        User.drop_collection()
+        ross = User(email='ross@example.com', name='Ross')
+        ross.save()
+        harry = User(email='harry@example.com', name='Harry')
+        harry.save()
+
+        emails = ['ross@example.com', 'harry@example.com']
+        users = User.objects(email__in=emails).order_by('email')
+        users.covered('email', 'id')
+        self.assertEqual([u for u in users],
+                         [('harry@example.com', harry.id),
+                          ('ross@example.com', ross.id)])
+        self.assertEqual(users._query, {'e': {'$in': emails}})
+        self.assertEqual(users._loaded_fields, {'e': 1, '_id': 1})
+        self.assertTrue(users.explain()['indexOnly'])
+
+        users = User.objects(email='ross@example.com').covered('pk')
+        self.assertEqual(users.first(), ross.id)
+        users = User.objects(email='ross@example.com').covered('email')
+        self.assertEqual(users._loaded_fields, {'e': 1, '_id': 0})
+        self.assertEqual([u for u in users], ['ross@example.com'])
+
+        # Queries that no index covers are refused
+        users = User.objects(name='Ross').covered('email')
+        self.assertRaises(InvalidQueryError, users.first)
+        users = User.objects(email='ross@example.com').covered('name')
+        self.assertRaises(InvalidQueryError, users.first)
+        users = User.objects(tags='a').covered('tags')
+        self.assertRaises(InvalidQueryError, users.first)
+
+        User.drop_collection()
+
+        # _types is dropped from queries on the root of a class hierarchy,
+        # but is needed on subclasses, and can't be covered
+        class Account(Document):
+            email = StringField(unique=True)
+            name = StringField()
+            meta = {'indexes': [('name', 'id')]}
+
+        class Admin(Account):
+            pass
+
+        Account.drop_collection()
+        Admin(email='ross@example.com', name='Ross').save()
+        accounts = Account.objects(email='ross@example.com').covered('email')
+        self.assertEqual(accounts.first(), 'ross@example.com')
+        self.assertFalse('_types' in accounts._query)
+        admin = Account.objects.first()
+        accounts = Account.objects(name='Ross').covered('id')
+        self.assertEqual(accounts.first(), admin.id)
+        admins = Admin.objects(email='ross@example.com').covered('email')
+        self.assertRaises(InvalidQueryError, admins.first)
+        Account.drop_collection()
+
+    def test_only_subfields(self):
+        """Ensure that subfields of embedded documents may be selected and
+        excluded.
+        """
+        class User(EmbeddedDocument):
+            name = StringField()
+            email = StringField(db_field='e')
+
+        class BlogPost(Document):
+            title = StringField()
+            author = EmbeddedDocumentField(User, db_field='a')
+            comments = ListField(StringField())
+
+        BlogPost.drop_collection()
+
+        author = User(name='Test User', email='test@example.com')
+        BlogPost(title='Test', author=author, comments=['Great']).save()
+
+        post = BlogPost.objects.only('author.email').get()
+        self.assertEqual(post.author.email, 'test@example.com')
+        self.assertEqual(post.author._data['name'], None)
+        # Subfields that were left out are loaded when accessed
+        self.assertEqual(post.author.name, 'Test User')
+        self.assertEqual(BlogPost.objects.only('author.email')._loaded_fields,
+                         {'a.e': 1, '_cls': 1})
+
+        post = BlogPost.objects.exclude('author.email', 'comments').get()
+        self.assertEqual(post.author.name, 'Test User')
+        self.assertEqual(post.author._data['email'], None)
+        self.assertEqual(post._data['comments'], None)
+        self.assertEqual(post.author.email, 'test@example.com')
+
+        post = BlogPost.objects.only('title', 'comments').exclude('comments')
+        self.assertEqual(post.get()._data['comments'], None)
+        self.assertRaises(InvalidQueryError,
+                          BlogPost.objects.only('title').exclude, 'comments')
+
+        BlogPost.drop_collection()
+
+    def test_partial_document(self):
+        """Ensure that fields left out of a partially loaded document are
+        loaded lazily, and are not overwritten when it is saved.
+        """
+        class User(EmbeddedDocument):
+            name = StringField()
+            email = StringField()
+
+        class BlogPost(Document):
+            title = StringField()
+            views = IntField()
+            author = EmbeddedDocumentField(User)
+            tags = ListField(StringField())
+
+        BlogPost.drop_collection()
+
+        author = User(name='Test User', email='test@example.com')
+        BlogPost(title='Test', views=1, author=author, tags=['a']).save()
+
+        post = BlogPost.objects.only('title').get()
+        self.assertEqual(post._missing_fields,
+                         set(['views', 'author', 'tags']))
+        # All missing fields are loaded when the first one is accessed
+        self.assertEqual(post.views, 1)
+        self.assertEqual(post._missing_fields, set())
+        self.assertEqual(post.tags, ['a'])
+        self.assertEqual(post.author.email, 'test@example.com')
+
+        # Saving only writes the fields that were loaded
+        post = BlogPost.objects.exclude('tags').get()
+        BlogPost.objects.update(push__tags='b')
+        post.title = 'Changed'
+        post.save()
+        post = BlogPost.objects.get()
+        self.assertEqual(post.title, 'Changed')
+        self.assertEqual(post.tags, ['a', 'b'])
+
+        # Only the loaded subfields of embedded documents are written
+        post = BlogPost.objects.only('author.name').get()
+        BlogPost.objects.update(set__author__email='new@example.com')
+        post.author.name = 'New Name'
+        post.save()
+        post = BlogPost.objects.get()
+        self.assertEqual(post.author.name, 'New Name')
+        self.assertEqual(post.author.email, 'new@example.com')
+        self.assertEqual(post.views, 1)
+
+        # Reading a subfield that was left out loads the rest of the
+        # embedded document, which is then saved as a whole
+        post = BlogPost.objects.only('author.name').get()
+        post.author.name = 'Other Name'
+        self.assertEqual(post.author.email, 'new@example.com')
+        self.assertEqual(post.author.name, 'Other Name')
+        post.author.email = 'other@example.com'
+        post.save()
+        post = BlogPost.objects.get()
+        self.assertEqual(post.author.name, 'Other Name')
+        self.assertEqual(post.author.email, 'other@example.com')
+        self.assertEqual(post.tags, ['a', 'b'])
+
+        # The same goes for embedded documents in lists
+        class Comment(EmbeddedDocument):
+            author = StringField()
+            text = StringField()
+
+        class Thread(Document):
+            comments = ListField(EmbeddedDocumentField(Comment))
+
+        Thread.drop_collection()
+        Thread(comments=[Comment(author='a', text='First'),
+                         Comment(author='b', text='Second')]).save()
+        thread = Thread.objects.only('comments.author').get()
+        self.assertEqual([c._data['text'] for c in thread.comments],
+                         [None, None])
+        self.assertEqual([c.text for c in thread.comments],
+                         ['First', 'Second'])
+        Thread.drop_collection()
+
+        # Assigning a missing field means it will be saved
+        post = BlogPost.objects.only('title').get()
+        post.views = 5
+        self.assertEqual(post._missing_fields, set(['author', 'tags']))
+        post.save()
+        post = BlogPost.objects.get()
+        self.assertEqual(post.views, 5)
+        self.assertEqual(post.tags, ['a', 'b'])
+
+        BlogPost.drop_collection()
+
+    def test_slice_and_elem_match(self):
+        """Ensure that $slice and $elemMatch projections load part of a list,
+        which is left untouched when the document is saved.
+        """
+        class Comment(EmbeddedDocument):
+            author = StringField(db_field='a')
+            text = StringField()
+
+        class BlogPost(Document):
+            title = StringField()
+            comments = ListField(EmbeddedDocumentField(Comment))
+
+        BlogPost.drop_collection()
+
+        comments = [Comment(author='user%d' % (i % 3), text='Comment %d' % i)
+                    for i in range(10)]
+        BlogPost(title='Test', comments=comments).save()
+
+        post = BlogPost.objects.slice('comments', -3).get()
+        self.assertEqual([c.text for c in post.comments],
+                         ['Comment 7', 'Comment 8', 'Comment 9'])
+        self.assertEqual(post.title, 'Test')
+        self.assertTrue(isinstance(post.comments, PartialList))
+        self.assertRaises(TypeError, post.comments.append, Comment())
+        self.assertRaises(TypeError, post.comments.pop)
+
+        post = BlogPost.objects.only('title').slice('comments', 2, 2).get()
+        self.assertEqual([c.text for c in post.comments],
+                         ['Comment 2', 'Comment 3'])
+
+        post = BlogPost.objects.elem_match('comments', author='user2').get()
+        self.assertEqual([c.text for c in post.comments], ['Comment 2'])
+        self.assertEqual(BlogPost.objects.elem_match('comments',
+                                                     author='x')._loaded_fields,
+                         {'comments': {'$elemMatch': {'a': 'x'}}})
+        self.assertRaises(InvalidQueryError, BlogPost.objects.elem_match,
+                          'title', author='x')
+
+        # Saving doesn't truncate the stored list
+        post.title = 'Changed'
+        post.save()
+        post = BlogPost.objects.get()
+        self.assertEqual(post.title, 'Changed')
+        self.assertEqual(len(post.comments), 10)
+
+        BlogPost.drop_collection()
 
     def test_find_embedded(self):
         """Ensure that an embedded document is properly returned from a query.
@@ -770,6 +1013,277 @@ class QuerySetTest(unittest.TestCase):
         ages = [p.age for p in self.Person.objects.order_by('-name')]
         self.assertEqual(ages, [30, 40, 20])
 
+    def test_batch_size(self):
+        """Ensure that the cursor batch size may be set.
+        """
+        for i in range(5):
+            self.Person(name='User %d' % i, age=i).save()
+
+        people = self.Person.objects.batch_size(2)
+        self.assertTrue(isinstance(people, QuerySet))
+        self.assertEqual(people._batch_size, 2)
+        self.assertEqual(len(list(people)), 5)
+
+    def test_iterator(self):
+        """Ensure that QuerySet.iterator yields chunks of documents.
+        """
+        for i in range(25):
+            self.Person(name='User %d' % i, age=i).save()
+
+        chunks = list(self.Person.objects.order_by('age').iterator(10))
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+        self.assertTrue(all(isinstance(p, self.Person) for p in chunks[0]))
+        ages = [p.age for chunk in chunks for p in chunk]
+        self.assertEqual(ages, range(25))
+
+        chunks = list(self.Person.objects(age__lt=5).iterator(10))
+        self.assertEqual([len(chunk) for chunk in chunks], [5])
+
+        self.assertEqual(list(self.Person.objects[:0].iterator(10)), [])
+
+    def test_prefetch(self):
+        """Ensure that prefetching querysets return the same results as
+        normal querysets.
+        """
+        for i in range(25):
+            self.Person(name='User %d' % i, age=i).save()
+
+        people = self.Person.objects.order_by('age').batch_size(4).prefetch(2)
+        self.assertEqual([p.age for p in people], range(25))
+        # The queryset may be iterated over again once exhausted
+        self.assertEqual([p.age for p in people], range(25))
+
+        chunks = list(self.Person.objects.prefetch(1).iterator(10))
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+
+        # Rewinding part of the way through stops the background thread
+        people = self.Person.objects.order_by('age').batch_size(2).prefetch(2)
+        self.assertEqual(people.next().age, 0)
+        prefetcher = people._prefetcher
+        people.rewind()
+        self.assertFalse(prefetcher._thread.isAlive())
+        self.assertEqual([p.age for p in people][:2], [0, 1])
+
+    def test_parallel_scan(self):
+        """Ensure that a parallel scan returns each matched document exactly
+        once, in both thread and process mode.
+        """
+        for i in range(50):
+            self.Person(name='User %d' % i, age=i).save()
+
+        for mode in ('thread', 'process'):
+            people = self.Person.objects(age__gte=10).only('age')
+            scan = people.batch_size(7).parallel_scan(4, mode=mode)
+            self.assertEqual(len(scan.partitions), 4)
+            results = list(scan)
+            self.assertEqual(sorted(p.age for p in results), range(10, 50))
+            self.assertTrue(all(p._data['name'] is None for p in results))
+            self.assertEqual(sum(s['documents'] for s in scan.stats), 40)
+
+        # A callback is called once per partition
+        def total_age(people):
+            return sum(person.age for person in people)
+        stats = self.Person.objects.parallel_scan(3, callback=total_age)
+        self.assertEqual([s['partition'] for s in stats], [0, 1, 2])
+        self.assertEqual(sum(s['result'] for s in stats), sum(range(50)))
+        self.assertTrue(all(s['documents'] > 0 for s in stats))
+
+        # Fewer documents than workers
+        stats = self.Person.objects(age__lt=2).parallel_scan(
+            4, callback=list)
+        self.assertEqual(len(stats), 2)
+
+        self.assertRaises(InvalidQueryError,
+                          self.Person.objects.limit(5).parallel_scan)
+
+    def test_modify(self):
+        """Ensure that modify atomically updates a document and returns it.
+        """
+        self.Person(name='User A', age=20).save()
+        self.Person(name='User B', age=30).save()
+
+        person = self.Person.objects(age__gt=10).order_by('-age').modify(
+            inc__age=1)
+        self.assertEqual((person.name, person.age), ('User B', 31))
+
+        person = self.Person.objects(name='User A').modify(new=False,
+                                                           set__age=25)
+        self.assertEqual(person.age, 20)
+        self.assertEqual(self.Person.objects(name='User A').get().age, 25)
+
+        person = self.Person.objects(name='User A').only('name').modify(
+            set__age=26)
+        self.assertEqual(person._missing_fields, set(['age']))
+        self.assertEqual(person.age, 26)
+
+        self.assertEqual(self.Person.objects(name='User C').modify(
+            set__age=1), None)
+        person = self.Person.objects(name='User C').modify(upsert=True,
+                                                           set__age=40)
+        self.assertEqual((person.name, person.age), ('User C', 40))
+
+        person = self.Person.objects.order_by('age').modify(remove=True)
+        self.assertEqual(person.name, 'User A')
+        self.assertEqual(self.Person.objects.count(), 2)
+
+        self.assertRaises(OperationError, self.Person.objects.modify)
+        self.assertRaises(OperationError, self.Person.objects.modify,
+                          remove=True, set__age=1)
+
+    def test_tail(self):
+        """Ensure that documents inserted into capped collections may be
+        followed with tail.
+        """
+        class LogEntry(Document):
+            level = StringField()
+            message = StringField()
+            meta = {'max_documents': 100}
+
+        LogEntry.drop_collection()
+        old = LogEntry(level='error', message='old')
+        old.save()
+
+        def insert():
+            time.sleep(0.1)
+            for i in range(3):
+                LogEntry(level='error', message=str(i)).save()
+                LogEntry(level='info', message=str(i)).save()
+        thread = threading.Thread(target=insert)
+        thread.start()
+        entries = LogEntry.objects(level='error').tail(timeout=1,
+                                                       poll_interval=0.01)
+        messages = []
+        for entry in entries:
+            messages.append(entry.message)
+            if len(messages) == 3:
+                break
+        thread.join()
+        self.assertEqual(messages, ['0', '1', '2'])
+
+        # Resume after a given document, delivering batches to a callback
+        batches = []
+        delivered = LogEntry.objects.tail(start_after=old, batch_size=4,
+                                          callback=batches.append,
+                                          timeout=0.2, poll_interval=0.01)
+        self.assertEqual(delivered, 6)
+        self.assertEqual([len(batch) for batch in batches], [4, 2])
+
+        # Tailing stops when the callback returns False
+        delivered = LogEntry.objects.tail(start_after=old.id, batch_size=1,
+                                          callback=lambda batch: False)
+        self.assertEqual(delivered, 1)
+
+        self.assertRaises(OperationError, self.Person.objects.tail)
+        LogEntry.drop_collection()
+
+    def test_order_by_db_field(self):
+        """Ensure that ordering uses the database names of fields.
+        """
+        class Score(Document):
+            points = IntField(db_field='p')
+
+        Score.drop_collection()
+        for points in (2, 3, 1):
+            Score(points=points).save()
+
+        points = [s.points for s in Score.objects.order_by('-points')]
+        self.assertEqual(points, [3, 2, 1])
+        self.assertEqual(Score.objects.order_by('points')._ordering,
+                         [('p', pymongo.ASCENDING)])
+
+        Score.drop_collection()
+
+    def test_paginate_after(self):
+        """Ensure that keyset pagination returns the same pages as skip-based
+        slicing, including when sort keys are tied.
+        """
+        for i, age in enumerate([30, 20, 30, 20, 40, 30, 20, 30, 40, 10]):
+            self.Person(name='User %d' % i, age=age).save()
+
+        for ordering in (('age',), ('-age',), ('-age', 'name')):
+            expected = [p.id for p in
+                        self.Person.objects.order_by(*ordering + ('id',))]
+
+            pages = []
+            last = None
+            while True:
+                queryset = self.Person.objects.order_by(*ordering)
+                people, last = queryset.paginate_after(last, 3)
+                pages.append([p.id for p in people])
+                if last is None:
+                    break
+
+            self.assertEqual([len(page) for page in pages], [3, 3, 3, 1])
+            self.assertEqual(sum(pages, []), expected)
+
+            # Skip-based slicing should produce exactly the same pages
+            for i, page in enumerate(pages):
+                queryset = self.Person.objects.order_by(*ordering + ('id',))
+                sliced = [p.id for p in queryset[i * 3:i * 3 + 3]]
+                self.assertEqual(sliced, page)
+
+        # Documents and raw values may be used instead of a token
+        people = list(self.Person.objects.order_by('age', 'id'))
+        queryset = self.Person.objects(age__gte=20).order_by('age')
+        page, token = queryset.paginate_after(people[2], 2)
+        self.assertEqual(page, people[3:5])
+        queryset = self.Person.objects(age__gte=20).order_by('age')
+        page, token = queryset.paginate_after((20, people[2].id), 2)
+        self.assertEqual(page, people[3:5])
+
+        # Existing $or conditions must be preserved
+        queryset = self.Person.objects(Q(age=10) | Q(age=40)).order_by('age')
+        page, token = queryset.paginate_after(None, 2)
+        self.assertEqual([p.age for p in page], [10, 40])
+        page, token = queryset.paginate_after(token, 2)
+        self.assertEqual([p.age for p in page], [40])
+        self.assertEqual(token, None)
+
+        # Tokens are tied to the ordering they were created for
+        page, token = self.Person.objects.order_by('age').paginate_after(None,
+                                                                         2)
+        queryset = self.Person.objects.order_by('name')
+        self.assertRaises(InvalidQueryError, queryset.paginate_after, token, 2)
+        self.assertRaises(InvalidQueryError, queryset.paginate_after,
+                          'not a token', 2)
+
+    def test_paginate_after_projection(self):
+        """Ensure that keyset pagination works with only() and exclude(),
+        including when the sort key isn't selected.
+        """
+        for i, age in enumerate([30, 20, 10]):
+            self.Person(name='User %d' % i, age=age).save()
+
+        for queryset in (self.Person.objects.only('name'),
+                         self.Person.objects.exclude('age'),
+                         self.Person.objects.exclude('name')):
+            queryset = queryset.order_by('age')
+            page, token = queryset.paginate_after(None, 2)
+            self.assertEqual([p.age for p in page], [10, 20])
+            page, token = queryset.paginate_after(token, 2)
+            self.assertEqual([p.name for p in page], ['User 0'])
+            self.assertEqual(token, None)
+
+    def test_paginate_after_nulls(self):
+        """Ensure that keyset pagination doesn't stop at null or missing
+        sort keys, in either direction.
+        """
+        for i, age in enumerate([None, None, 3, 1, 2]):
+            self.Person(name='User %d' % i, age=age).save()
+
+        for ordering in ('age', '-age'):
+            expected = [p.id for p in
+                        self.Person.objects.order_by(ordering, 'id')]
+            ids = []
+            last = None
+            while True:
+                queryset = self.Person.objects.order_by(ordering)
+                people, last = queryset.paginate_after(last, 1)
+                ids += [p.id for p in people]
+                if last is None:
+                    break
+            self.assertEqual(ids, expected)
+
     def test_map_reduce(self):
         """Ensure map/reduce is both mapping and reducing.
         """
@@ -1201,12 +1715,17 @@ class QuerySetTest(unittest.TestCase):
             date = DateTimeField()
             meta = {'indexes': ['-date']}
 
+        class ExtendedBlogPost(BlogPost):
+            meta = {'indexes': ['date']}
+
         # Indexes are lazy so use list() to perform query
-        list(BlogPost.objects)
+        list(ExtendedBlogPost.objects)
         info = BlogPost.objects._collection.index_information()
         info = [value['key'] for key, value in info.iteritems()]
         self.assertTrue([('_types', 1)] in info)
-        self.assertTrue([('_types', 1), ('date', -1)] in info)
+        self.assertTrue([('_types', 1), ('date', 1)] in info)
+        # The indexes of root classes don't start with _types
+        self.assertTrue([('date', -1)] in info)
 
         BlogPost.drop_collection()
 
@@ -1221,6 +1740,57 @@ class QuerySetTest(unittest.TestCase):
 
         BlogPost.drop_collection()
 
+    def test_types_pruning(self):
+        """Ensure that queries on root classes without subclasses don't
+        check the type, and that types may be stored as _cls alone.
+        """
+        class Cat(Document):
+            name = StringField()
+
+        self.assertEqual(Cat.objects._query, {})
+        self.assertTrue('_types' in Cat(name='Tom').to_mongo())
+
+        class Animal(Document):
+            name = StringField()
+            meta = {'store_types': False}
+
+        class Dog(Animal):
+            meta = {'indexes': ['name']}
+
+        class Puppy(Dog):
+            pass
+
+        Animal.drop_collection()
+        Animal(name='Fish').save()
+        Dog(name='Rex').save()
+        Puppy(name='Fido').save()
+
+        self.assertFalse('_types' in Puppy(name='Spot').to_mongo())
+        self.assertEqual(Animal.objects._query, {'_cls': {'$in': [
+            'Animal', 'Animal.Dog', 'Animal.Dog.Puppy']}})
+        self.assertEqual(Dog.objects._query, {'_cls': {'$in': [
+            'Animal.Dog', 'Animal.Dog.Puppy']}})
+        self.assertEqual(Puppy.objects._query, {'_cls': 'Animal.Dog.Puppy'})
+        self.assertEqual(Animal.objects.count(), 3)
+        self.assertEqual(sorted(dog.name for dog in Dog.objects),
+                         ['Fido', 'Rex'])
+        self.assertEqual(Puppy.objects.get().name, 'Fido')
+
+        # Subclasses defined after a queryset was created are matched
+        dogs = Dog.objects
+        class Beagle(Dog):
+            pass
+        Beagle(name='Snoopy').save()
+        self.assertEqual(dogs.count(), 3)
+        self.assertEqual(Animal.objects(name='Snoopy').get().name, 'Snoopy')
+
+        self.assertEqual(Dog._meta['indexes'], [[('_cls', 1), ('name', 1)]])
+        info = Dog.objects._collection.index_information()
+        info = [value['key'] for key, value in info.iteritems()]
+        self.assertTrue([('_cls', 1)] in info)
+
+        Animal.drop_collection()
+
     def test_dict_with_custom_baseclass(self):
         """Ensure DictField working with custom base clases.
         """
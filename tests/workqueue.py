@@ -0,0 +1,131 @@
+import unittest
+import time
+import datetime
+import threading
+
+from mongoengine import *
+from mongoengine.workqueue import QueuedJob, JobQueue
+
+
+class JobQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        connect(db='mongoenginetest')
+        QueuedJob.drop_collection()
+
+    def tearDown(self):
+        QueuedJob.drop_collection()
+
+    def test_enqueue_and_claim(self):
+        """Ensure that jobs are claimed in order of priority, and that a job
+        is only claimed by one worker at a time.
+        """
+        queue = JobQueue('test')
+        ids = queue.enqueue({'n': i} for i in range(5))
+        self.assertEqual(len(ids), 5)
+        urgent = QueuedJob(payload={'n': 'urgent'}, priority=10)
+        self.assertEqual(queue.enqueue(iter([urgent])), [urgent.id])
+        # Jobs in other queues aren't claimed
+        JobQueue('other').enqueue([{'n': 'other'}])
+        self.assertEqual(queue.count(), 6)
+
+        jobs = queue.claim(2)
+        self.assertEqual([job.payload['n'] for job in jobs], ['urgent', 0])
+        self.assertTrue(all(job.owner == queue.worker_id for job in jobs))
+        self.assertEqual(jobs[0].attempts, 1)
+
+        other = JobQueue('test')
+        others = other.claim(10)
+        self.assertEqual([job.payload['n'] for job in others], [1, 2, 3, 4])
+        self.assertEqual(other.claim(), [])
+
+        # Only the owner may acknowledge a job
+        other.ack(jobs)
+        self.assertEqual(queue.count(QueuedJob.CLAIMED), 6)
+        queue.ack(jobs)
+        self.assertEqual(queue.count(QueuedJob.CLAIMED), 4)
+        ids = [job.id for job in jobs]
+        self.assertEqual(QueuedJob.objects(id__in=ids).count(), 0)
+
+    def test_leases(self):
+        """Ensure that expired leases are reclaimed, and that heartbeats
+        extend leases.
+        """
+        queue = JobQueue('test', lease=60)
+        queue.enqueue([{'n': 1}, {'n': 2}])
+        jobs = queue.claim(2)
+
+        # Expire the first lease
+        expired = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        QueuedJob.objects(id=jobs[0].id).update(set__lease_expires=expired)
+        other = JobQueue('test')
+        self.assertEqual(queue.heartbeat(jobs), 2)
+        self.assertEqual(other.claim(2), [])
+
+        QueuedJob.objects(id=jobs[0].id).update(set__lease_expires=expired)
+        self.assertEqual(queue.reclaim(), 1)
+        reclaimed = other.claim(2)
+        self.assertEqual([job.payload['n'] for job in reclaimed], [1])
+        self.assertEqual(reclaimed[0].attempts, 2)
+        # The original worker has lost the job
+        self.assertEqual(queue.heartbeat(jobs), 1)
+
+    def test_nack(self):
+        """Ensure that jobs may be returned to the queue, with a delay and a
+        maximum number of attempts.
+        """
+        queue = JobQueue('test')
+        queue.enqueue([{'n': 1}, {'n': 2}])
+        jobs = queue.claim(2)
+        queue.nack(jobs[:1])
+        queue.nack(jobs[1:], delay=60)
+        self.assertEqual([job.payload['n'] for job in queue.claim(2)], [1])
+
+        jobs = QueuedJob.objects(payload__n=1)
+        queue.nack(list(jobs), max_attempts=2)
+        self.assertEqual(queue.count(QueuedJob.FAILED), 1)
+
+    def test_get(self):
+        """Ensure that get waits for jobs to be enqueued.
+        """
+        queue = JobQueue('test', min_wait=0.01, max_wait=0.05)
+        self.assertEqual(queue.get(timeout=0.1), [])
+
+        def enqueue():
+            time.sleep(0.1)
+            JobQueue('test').enqueue([{'n': 1}])
+        thread = threading.Thread(target=enqueue)
+        thread.start()
+        jobs = queue.get(5, timeout=5)
+        thread.join()
+        self.assertEqual([job.payload['n'] for job in jobs], [1])
+
+    def test_capped_queue(self):
+        """Ensure that queues in capped collections are tailed for new jobs,
+        and that acknowledged jobs are marked as done.
+        """
+        class CappedJob(QueuedJob):
+            meta = {'collection': 'capped_jobs', 'max_documents': 100}
+
+        CappedJob.drop_collection()
+        queue = JobQueue('test', job_class=CappedJob, min_wait=0.01,
+                         max_wait=0.05)
+        self.assertTrue(queue.capped)
+        self.assertEqual(queue.get(timeout=0.1), [])
+
+        def enqueue():
+            time.sleep(0.1)
+            JobQueue('test', job_class=CappedJob).enqueue([{'n': 1}])
+        thread = threading.Thread(target=enqueue)
+        thread.start()
+        jobs = queue.get(timeout=5)
+        thread.join()
+        self.assertEqual([job.payload['n'] for job in jobs], [1])
+
+        queue.ack(jobs)
+        self.assertEqual(queue.count(QueuedJob.DONE), 1)
+        CappedJob.drop_collection()
+
+
+if __name__ == '__main__':
+    unittest.main()
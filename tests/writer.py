@@ -0,0 +1,165 @@
+import unittest
+import time
+import warnings
+import threading
+
+from mongoengine import *
+from mongoengine.writer import BufferedWriter
+import mongoengine.writer
+
+
+class LogEntry(Document):
+    level = StringField(required=True)
+    message = StringField()
+    meta = {'max_documents': 1000}
+
+
+class Event(Document):
+    name = StringField()
+    data = DictField()
+
+
+class BufferedWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        connect(db='mongoenginetest')
+        LogEntry.drop_collection()
+
+    def tearDown(self):
+        LogEntry.drop_collection()
+
+    def test_write(self):
+        """Ensure that documents written from several threads are inserted
+        in batches.
+        """
+        writer = BufferedWriter(LogEntry, batch_size=10, flush_interval=60)
+
+        def write(thread):
+            for i in range(20):
+                writer.write(LogEntry(level='info', message='%d' % thread))
+        threads = [threading.Thread(target=write, args=(i,))
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.flush()
+
+        self.assertEqual(LogEntry.objects.count(), 100)
+        stats = writer.stats()
+        self.assertEqual(stats['queued'], 100)
+        self.assertEqual(stats['flushed'], 100)
+        self.assertEqual(stats['pending'], 0)
+        self.assertEqual(stats['batches'], 10)
+        self.assertTrue(stats['max_latency'] >= stats['latency'] > 0)
+
+        entry = LogEntry(level='error')
+        writer.write(entry)
+        writer.close()
+        self.assertEqual(LogEntry.objects.with_id(entry.id).level, 'error')
+        self.assertRaises(OperationError, writer.write, LogEntry(level='x'))
+
+        # Documents are validated when written
+        writer = BufferedWriter(LogEntry)
+        self.assertRaises(ValidationError, writer.write, LogEntry())
+        self.assertRaises(TypeError, writer.write, writer)
+        writer.close()
+
+    def test_close_while_writing(self):
+        """Ensure that every document written while a writer is being
+        closed is either inserted or rejected.
+        """
+        writer = BufferedWriter(LogEntry, batch_size=10, flush_interval=60)
+        written = []
+
+        # At most 750 documents, as the collection is capped
+        def write():
+            for i in range(150):
+                try:
+                    writer.write(LogEntry(level='info'))
+                except OperationError:
+                    return
+                written.append(True)
+        threads = [threading.Thread(target=write) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.01)
+        writer.close()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(LogEntry.objects.count(), len(written))
+        self.assertEqual(writer.stats()['flushed'], len(written))
+
+    def test_unencodable_document(self):
+        """Ensure that a batch that can't be inserted is counted as failed,
+        and that the writer carries on.
+        """
+        Event.drop_collection()
+        writer = BufferedWriter(Event, batch_size=10, flush_interval=60)
+        # Valid, but can't be encoded as BSON
+        writer.write(Event(name='bad', data={'value': object()}))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            writer.flush()
+        stats = writer.stats()
+        self.assertEqual((stats['failed'], stats['flushed']), (1, 0))
+        self.assertTrue(writer.last_error is not None)
+
+        writer.write(Event(name='good'))
+        writer.close()
+        self.assertEqual(Event.objects.get().name, 'good')
+        Event.drop_collection()
+
+    def test_flush_interval(self):
+        """Ensure that documents are inserted once the flush interval has
+        passed.
+        """
+        writer = BufferedWriter(LogEntry, flush_interval=0.05)
+        writer.write(LogEntry(level='info'))
+        time.sleep(0.3)
+        self.assertEqual(LogEntry.objects.count(), 1)
+        writer.close()
+
+    def test_backpressure(self):
+        """Ensure that writes to a full writer block or are dropped.
+        """
+        writer = BufferedWriter(LogEntry, batch_size=1, max_queued=2,
+                                block=False)
+        # Hold up the background thread's first insert while the queue fills
+        inserting, release = threading.Event(), threading.Event()
+        insert = writer._insert
+        def slow_insert(batch):
+            inserting.set()
+            release.wait()
+            insert(batch)
+        writer._insert = slow_insert
+
+        writer.write(LogEntry(level='info'))
+        inserting.wait()
+        self.assertTrue(writer.write(LogEntry(level='info')))
+        self.assertTrue(writer.write(LogEntry(level='info')))
+        self.assertFalse(writer.write(LogEntry(level='info')))
+        self.assertEqual(writer.dropped, 1)
+
+        writer.block = True
+        self.assertFalse(writer.write(LogEntry(level='info'), timeout=0.01))
+        self.assertEqual(writer.dropped, 2)
+
+        release.set()
+        writer.close()
+        self.assertEqual(LogEntry.objects.count(), 3)
+        self.assertEqual(writer.stats()['queued'], 3)
+
+    def test_close_at_exit(self):
+        """Ensure that writers that haven't been closed are flushed when the
+        interpreter exits.
+        """
+        writer = BufferedWriter(LogEntry, flush_interval=60)
+        writer.write(LogEntry(level='info'))
+        mongoengine.writer._close_open_writers()
+        self.assertEqual(LogEntry.objects.count(), 1)
+        self.assertEqual(mongoengine.writer._open_writers, set())
+
+
+if __name__ == '__main__':
+    unittest.main()